@@ -11,6 +11,7 @@ import io
 import re
 import base64
 import logging
+import sqlite3
 
 # Импорт констант из конфигурационного модуля
 from config import (
@@ -26,14 +27,29 @@ from config import (
     APP_YEAR,
     SUPPORTED_LANGUAGES,
     DEFAULT_LANGUAGE,
-    TTS_VOICES_BY_LANGUAGE
+    TTS_VOICES_BY_LANGUAGE,
+    LIBRARY_PAGE_SIZE,
+    DUPLICATE_POLICY,
+    GENERATION_CACHE,
+    GENERATION_CACHE_FILE,
+    GENERATION_HEDGING,
+    GENERATION_BREAKER
 )
 
 # Импорт утилит для определения языка
 from utils import get_user_language
 
 # Импорт модуля интернационализации
-from i18n import t, get_translations, get_genre_list, get_age_ranges
+from i18n import t, get_translations, get_genre_list, get_genre_key, get_age_ranges
+
+# Типизированная запись сказки
+from story import Story
+
+# Промпт генерации и кэш ответов
+from prompts import build_story_prompt
+from generation_cache import GenerationCache, cache_key
+from generation import stream_story, split_story, clean_title, GenerationError, hedge_stats
+from circuit_breaker import model_breakers
 
 # --- 1. Настройка страницы (ДОЛЖНА БЫТЬ ПЕРВОЙ) ---
 st.set_page_config(
@@ -78,11 +94,16 @@ logger = logging.getLogger(__name__)
 # Диагностический блок для захвата "призрачных" ошибок
 try:
     # Импорт модулей
-    from auth import init_auth_state, is_authenticated, sign_out, get_current_user, _SUPABASE_AVAILABLE
+    from auth import init_auth_state, is_authenticated, sign_out, get_current_user, get_library_namespace, _SUPABASE_AVAILABLE
     import storage # Локальная библиотека сказок
+    import audio_store # Хранилище озвучек (MP3 по ключу текст+голос)
     
     # Инициализация состояния авторизации
     init_auth_state()
+    # Личная библиотека текущего пользователя (или гостевой сессии)
+    # Тариф (квоту) библиотеке назначает storage.set_library_plan() — источника тарифов пока нет,
+    # поэтому приложение его не вызывает и библиотеки не ограничены
+    library_namespace = get_library_namespace()
 except Exception as diagnostic_error:
     import traceback
     error_details = traceback.format_exc()
@@ -97,6 +118,33 @@ if not _SUPABASE_AVAILABLE:
     logger.warning("Supabase library is not installed or incompatible. Auth features are disabled.")
     # Не показываем st.warning на экране, чтобы не засорять UI
 
+# --- Вёрстка текста сказки ---
+def format_paragraph(text):
+    # Заменяет **text** на <strong>text</strong> для рендеринга в HTML
+    formatted = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', text.strip())
+    return f'<p style="text-indent: 1.5em; margin-bottom: 0.8em; text-align: justify;">{formatted}</p>'
+
+
+def story_html(title, body):
+    """Заголовок и абзацы сказки (общая вёрстка для готовой и генерируемой сказки)"""
+    formatted_body = "".join([format_paragraph(para) for para in body.split('\n') if para.strip()])
+    return f"""
+    <h2 style='text-align: center; margin-bottom: 1rem;'>{title}</h2>
+    <div style="
+        background: rgba(255,255,255,0.05); 
+        padding: 30px; 
+        border-radius: 12px; 
+        font-family: 'Georgia', 'Times New Roman', serif; 
+        font-size: 1.15em; 
+        line-height: 1.6; 
+        color: #e8eaed;
+        margin-bottom: 1.5rem;
+    ">
+    {formatted_body}
+    </div>
+    """
+
+
 # --- Функция для создания красивого плеера ---
 def display_audio_player(audio_bytes, label="🎧 Аудио-сказка", autoplay=False):
     """Профессиональный аудио-плеер с полным набором функций"""
@@ -460,10 +508,66 @@ with st.sidebar:
     
     # 3. Личная библиотека
     st.markdown(f"### {t('library_title', user_lang)}")
-    saved_stories = storage.load_stories()
+    # Поиск по библиотеке (полнотекстовый индекс, без сканирования текстов)
+    library_query = st.text_input(
+        t('library_search_placeholder', user_lang),
+        key="library_search",
+        placeholder=t('library_search_placeholder', user_lang),
+        label_visibility="collapsed"
+    ).strip()
+    
+    # Фильтры по ребёнку и жанру (вторичные индексы, без сканирования библиотеки)
+    library_filters = {}
+    child_values = storage.library_facets('child', namespace=library_namespace)
+    genre_values = storage.library_facets('genre', namespace=library_namespace)
+    if child_values or genre_values:
+        fc1, fc2 = st.columns(2)
+        with fc1:
+            child_filter = st.selectbox(
+                t('library_filter_all_children', user_lang),
+                options=[None] + list(child_values),
+                format_func=lambda v: t('library_filter_all_children', user_lang) if v is None else v.title(),
+                key="library_filter_child",
+                label_visibility="collapsed"
+            )
+        with fc2:
+            genre_filter = st.selectbox(
+                t('library_filter_all_genres', user_lang),
+                options=[None] + list(genre_values),
+                format_func=lambda v: t('library_filter_all_genres', user_lang) if v is None else t(f'genres.{v}', user_lang),
+                key="library_filter_genre",
+                label_visibility="collapsed"
+            )
+        if child_filter:
+            library_filters['child'] = child_filter
+        if genre_filter:
+            library_filters['genre'] = genre_filter
+
+    # Только метаданные (id, title, created_at) — тела загружаются при открытии
+    next_cursor = None
+    if library_query:
+        saved_stories = storage.search(library_query, limit=20, namespace=library_namespace)
+    else:
+        # Постраничный вывод: стек курсоров открытых страниц (None — первая страница)
+        if 'library_cursors' not in st.session_state or st.session_state.get('library_filters') != library_filters:
+            st.session_state['library_cursors'] = [None]
+            st.session_state['library_filters'] = library_filters
+        library_cursors = st.session_state['library_cursors']
+        if library_filters:
+            saved_stories, next_cursor = storage.query(
+                LIBRARY_PAGE_SIZE, library_cursors[-1], namespace=library_namespace, **library_filters
+            )
+        else:
+            saved_stories, next_cursor = storage.list_stories(
+                LIBRARY_PAGE_SIZE, library_cursors[-1], namespace=library_namespace
+            )
+        if not saved_stories and len(library_cursors) > 1:
+            # Последнюю сказку страницы удалили — возвращаемся на предыдущую
+            library_cursors.pop()
+            st.rerun()
     
     if not saved_stories:
-        st.caption(t('library_empty', user_lang))
+        st.caption(t('library_search_empty', user_lang) if library_query else t('library_empty', user_lang))
     else:
         for s in saved_stories:
             tc1, tc2 = st.columns([5, 1], vertical_alignment="center")
@@ -472,15 +576,29 @@ with st.sidebar:
                 display_title = (s['title'][:22] + '..') if len(s['title']) > 22 else s['title']
                 created_date = s.get('created_at', '')[:10]
                 if st.button(f"📄 {display_title}", key=f"load_{s['id']}", help=f"Дата: {created_date}\nНажмите, чтобы прочитать" if user_lang == 'ru' else f"Date: {created_date}\nClick to read", use_container_width=True):
-                    # Добавляем поле audio при загрузке из библиотеки (там оно отсутствует)
-                    s['audio'] = None
-                    st.session_state['current_story'] = s
+                    record = storage.get_story(s['id'], namespace=library_namespace)
+                    if record is not None:
+                        full_story = Story.from_dict(record)
+                        # Озвучка берётся с диска по ссылке audio_key — без повторного TTS
+                        full_story.audio = audio_store.get_audio(full_story.audio_key) if full_story.audio_key else None
+                        st.session_state['current_story'] = full_story
                     st.rerun()
             with tc2:
                 if st.button("🗑️", key=f"del_{s['id']}", help="Удалить сказку" if user_lang == 'ru' else "Delete story", type="secondary"):
-                    storage.delete_story(s['id'])
+                    storage.delete_story(s['id'], namespace=library_namespace)
                     st.rerun()
     
+    if not library_query and (next_cursor or len(st.session_state['library_cursors']) > 1):
+        pc1, pc2 = st.columns(2)
+        with pc1:
+            if st.button(t('library_prev', user_lang), key="library_prev", disabled=len(st.session_state['library_cursors']) == 1, use_container_width=True):
+                st.session_state['library_cursors'].pop()
+                st.rerun()
+        with pc2:
+            if st.button(t('library_next', user_lang), key="library_next", disabled=next_cursor is None, use_container_width=True):
+                st.session_state['library_cursors'].append(next_cursor)
+                st.rerun()
+    
     st.divider()
     
     # 2. Длительность (Фаза 1)
@@ -651,6 +769,7 @@ with st.form("story_form"):
         )
 
     st.markdown("---")
+    fresh_story = GENERATION_CACHE and st.checkbox(t('fresh_story_label', user_lang), help=t('fresh_story_help', user_lang))
     submit_btn = st.form_submit_button(t('submit_btn', user_lang), type="primary", use_container_width=True)
 
 # Логика обработки
@@ -686,143 +805,60 @@ if submit_btn:
         # Определение длины из настроек сайдбара
         target_word_count = STORY_LENGTH_MAP.get(story_length, DEFAULT_STORY_LENGTH)
 
+        if gender == t('gender_boy', user_lang):
+            gender_code = 'boy'
+        elif gender == t('gender_girl', user_lang):
+            gender_code = 'girl'
+        else:
+            gender_code = 'auto'
+
+        # Промпт один на все модели каскада (prompts.py, с кэшем по полям формы)
+        prompt = build_story_prompt(name, gender_code, age, age_selection, genre, hobbies, user_lang, target_word_count)
+
+        # Такой же запрос уже генерировали — ответ берётся из кэша без обращения к Gemini
+        generation_cache = GenerationCache(GENERATION_CACHE_FILE) if GENERATION_CACHE else None
+        prompt_key = cache_key(prompt)
+        if generation_cache is not None and not fresh_story:
+            try:
+                cached = generation_cache.get(prompt_key)
+            except sqlite3.Error as e:
+                logger.warning(f"Generation cache lookup failed: {e}")
+                cached = None
+            if cached is not None:
+                response_text, used_model_name = cached
+                logger.info(f"Story served from generation cache ({used_model_name})")
+
         with st.spinner(t('generating', user_lang)):
             last_error = None
-            for model_name in GEMINI_MODEL_CASCADE:
+            if response_text is None:
+                # Сказка появляется по мере генерации; после ответа её заменяет обычное отображение
+                stream_placeholder = st.empty()
+
+                def render_partial(text):
+                    partial_title, partial_body = split_story(text)
+                    if partial_title is None:
+                        partial_title, partial_body = clean_title(partial_body), ""
+                    stream_placeholder.markdown(story_html(partial_title, partial_body), unsafe_allow_html=True)
+
                 try:
-                    logger.info(f"Attempting generation with model: {model_name}")
-                    
-                    # --- Логика генерации промпта (Prompt Engineering 3.0 - Expanded Ages & Genres) ---
-                    
-                    # Инструкция по полу
-                    if user_lang == 'en':
-                        if gender == t('gender_boy', user_lang):
-                            gender_instruction = f"The main character is a boy named {name}. Use masculine pronouns."
-                        elif gender == t('gender_girl', user_lang):
-                            gender_instruction = f"The main character is a girl named {name}. Use feminine pronouns."
-                        else:
-                            gender_instruction = f"The main character is {name}. Determine gender from the name automatically."
-                    else:
-                        if gender == t('gender_boy', user_lang):
-                            gender_instruction = f"Главный герой - мальчик по имени {name}. Используй мужской род."
-                        elif gender == t('gender_girl', user_lang):
-                            gender_instruction = f"Главный герой - девочка по имени {name}. Используй женский род."
-                        else:
-                            gender_instruction = f"Главный герой - {name}. Определи пол по имени автоматически."
-                    
-                    if age < 1:
-                        # 0-12 мес (Babies)
-                        role_instruction = "Ты — нежный, любящий голос родителя."
-                        style_instruction = f"""
-                        Стиль: Колыбельная, ритмичная, очень простая. Много повторов, звукоподражаний.
-                        Атмосфера: Тепло, уют, защита, сон.
-                        Сюжет: Очень простой (герой пошел спать, звезды светят).
-                        Лексика: Ультра-простая. 
-                        Жанр: {genre} (в адаптации для младенца).
-                        Длина: Короткая, около 50-100 слов.
-                        """
-                        structure_instruction = "Структура: Убаюкивающее начало -> Плавное наблюдение -> Сонный финал."
-                        ending_instruction = "Финал: 'Баю-бай, спи, малыш'."
-
-                    elif 1 <= age <= 3:
-                        # 1-3 года (Toddlers)
-                        role_instruction = "Ты — веселый воспитатель в детском саду."
-                        style_instruction = f"""
-                        Стиль: Игривый, понятный, сенсорный (цвета, звуки, тактильность).
-                        Герой: {name}. Совершает простые действия (поел, погулял, нашел друга).
-                        Жанр: {genre}.
-                        Избегать: Сложных слов, страшных моментов.
-                        Длина: Около 150 слов.
-                        """
-                        structure_instruction = "Структура: Приветствие -> Маленькое приключение -> Радостный вывод."
-                        ending_instruction = "Финал: Позитивный и понятный."
-
-                    elif 4 <= age <= 7:
-                        # Дошкольники 4-7 (Preschool)
-                        role_instruction = "Ты — сказочник Disney."
-                        style_instruction = f"""
-                        Стиль: Волшебный, добрый, с моралью (но не скучной).
-                        Сюжет: Классическое приключение с преодолением небольшого препятствия.
-                        Жанр: {genre}.
-                        Длина: Около {target_word_count} слов.
-                        """
-                        structure_instruction = "Структура: Завязка -> Испытание -> Помощь друзей -> Победа добра."
-                        ending_instruction = "Финал: Счастливый и поучительный."
-
-                    elif 8 <= age <= 12:
-                        # Школьники 8-12 (School)
-                        role_instruction = "Ты — автор приключенческих книг для детей."
-                        style_instruction = f"""
-                        Стиль: Динамичный, увлекательный, с диалогами и шутками.
-                        Сюжет: Более сложный, с загадками или активными действиями.
-                        Жанр: {genre}.
-                        Длина: Около {target_word_count} слов.
-                        """
-                        structure_instruction = "Структура: Интрига -> Развитие событий -> Кульминация -> Развязка."
-                        ending_instruction = "Финал: Вдохновляющий."
-
-                    elif 13 <= age <= 17:
-                        # Подростки 13-17 (Teens)
-                        role_instruction = "Ты — автор популярных Young Adult романов."
-                        style_instruction = f"""
-                        Стиль: Современный, эмоциональный, искренний. Без нравоучений.
-                        Темы: Дружба, поиск себя, смелость, выбор.
-                        Жанр: {genre}.
-                        Длина: Около {target_word_count} слов.
-                        """
-                        structure_instruction = "Структура: Проблема героя -> Сложный выбор -> Решение -> Новый опыт."
-                        ending_instruction = "Финал: Открытый или глубокий."
-
-                    else: 
-                        # Взрослые 18+ (Adults)
-                        role_instruction = "Ты — мастер короткого рассказа (уровень Чехова, О. Генри или Брэдбери)."
-                        style_instruction = f"""
-                        ВАЖНО: Это история для ВЗРОСЛОГО ({age} лет).
-                        Жанр: {genre}.
-                        Контент: Строго Safe For Work (без эротики/насилия), но интеллектуально взрослый.
-                        Темы: Психология, философия, ирония, ностальгия, поиск смысла, отношения (эмоциональные).
-                        Стиль: Литературный, метафоричный, богатый язык.
-                        Длина: Около {target_word_count} слов.
-                        """
-                        structure_instruction = "Структура: Атмосферное погружение -> Конфликт (внутренний или внешний) -> Катарсис/Осознание."
-                        ending_instruction = "Финал: Эмоционально сильный, оставляющий послевкусие."
-
-                    prompt = f"""
-                    {role_instruction}
-                    Задача: Напиши историю в жанре "{genre}" для читателя возраста {age} лет (категория: {age_selection}).
-                    
-                    ГЛАВНЫЙ ГЕРОЙ: {name}.
-                    ВАЖНО ПРО ИМЯ: Используй имя героя естественно и разнообразно. Склоняй его по падежам, используй уменьшительно-ласкательные формы (если уместно для возраста/ситуации), полные или сокращенные варианты. Имя должно звучать органично в тексте, как в хорошей книге.
-                    
-                    {gender_instruction}
-                    Интегрируй интересы/детали: {hobbies}.
-                    Язык: Русский.
-                    
-                    Требования:
-                    1. **Название**: Креативное заглавие в первой строке.
-                    2. **Жанр**: Строго соответствуй выбранному жанру ({genre}).
-                    3. **Аудитория**: Учитывай возраст {age} лет ({age_selection}). Для детей - проще, для взрослых - глубже.
-                    4. **Качество**: Логичный сюжет, живой язык, эмоции.
-                    
-                    {style_instruction}
-                    {structure_instruction}
-                    
-                    Технические детали:
-                    - Начни с Названия.
-                    - Используй абзацы.
-                    - {ending_instruction}
-                    """
-                    
-                    # Вызов API
-                    model = genai.GenerativeModel(model_name)
-                    response = model.generate_content(prompt)
-                    response_text = response.text
-                    used_model_name = model_name
-                    break 
-                except Exception as e:
-                    logger.exception(f"Model {model_name} failed: {e}")
-                    last_error = e
-                    continue
+                    result = stream_story(
+                        prompt, GEMINI_MODEL_CASCADE, genai.GenerativeModel,
+                        on_text=render_partial, hedging=GENERATION_HEDGING,
+                        breakers=model_breakers if GENERATION_BREAKER else None
+                    )
+                    response_text = result.text
+                    used_model_name = result.model
+                    if GENERATION_HEDGING:
+                        logger.info(f"Hedge metrics: {hedge_stats()}")
+                except GenerationError as e:
+                    last_error = e.last_error
+                stream_placeholder.empty()
+
+                if response_text and generation_cache is not None:
+                    try:
+                        generation_cache.put(prompt_key, response_text, used_model_name)
+                    except sqlite3.Error as e:
+                        logger.warning(f"Generation cache store failed: {e}")
             
             if not response_text:
                 st.error("❌ " + ("Не удалось создать сказку." if user_lang == 'ru' else "Could not create the story."))
@@ -834,21 +870,24 @@ if submit_btn:
             logger.info(f"Story generated successfully with model: {used_model_name}")
             
             # Обработка ответа
-            full_text = response_text.strip()
-
-            if '\n' in full_text:
-                title, story_body = full_text.split('\n', 1)
-                title = title.strip().lstrip('#').replace('*', '').strip()
-            else:
+            title, story_body = split_story(response_text)
+            if title is None:
                 title = f"Сказка для {name}" if user_lang == 'ru' else f"A Story for {name}"
-                story_body = full_text
 
             # Сохранение в сессии
-            st.session_state['current_story'] = {
-                'title': title,
-                'body': story_body,
-                'audio': None
-            }
+            # Параметры генерации сохраняются вместе со сказкой (фильтры библиотеки)
+            st.session_state['current_story'] = Story(
+                title=title,
+                body=story_body,
+                lang=user_lang,
+                child=name,
+                gender=gender_code,
+                age_group=age,
+                genre=get_genre_key(genre, user_lang) or genre,
+                hobbies=hobbies or None,
+                voice=selected_voice,
+                model=used_model_name
+            )
 
     except Exception as e:
         if "429" in str(e):
@@ -862,36 +901,10 @@ if 'current_story' in st.session_state:
         story = st.session_state['current_story']
         
         st.divider()
-        st.markdown(f"<h2 style='text-align: center; margin-bottom: 1rem;'>{story['title']}</h2>", unsafe_allow_html=True)
-        
-        # Контейнер для текста
-        def format_paragraph(text):
-            # Заменяет **text** на <strong>text</strong> для рендеринга в HTML
-            formatted = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', text.strip())
-            return f'<p style="text-indent: 1.5em; margin-bottom: 0.8em; text-align: justify;">{formatted}</p>'
-
-        formatted_body = "".join([format_paragraph(para) for para in story['body'].split('\n') if para.strip()])
-        
-        st.markdown(
-            f"""
-            <div style="
-                background: rgba(255,255,255,0.05); 
-                padding: 30px; 
-                border-radius: 12px; 
-                font-family: 'Georgia', 'Times New Roman', serif; 
-                font-size: 1.15em; 
-                line-height: 1.6; 
-                color: #e8eaed;
-                margin-bottom: 1.5rem;
-            ">
-            {formatted_body}
-            </div>
-            """, 
-            unsafe_allow_html=True
-        )
+        st.markdown(story_html(story.title, story.body), unsafe_allow_html=True)
 
         # Скачивание Текста (Перенесено по запросу: под текст, над линией)
-        story_text_export = f"{story['title']}\n\n{story['body']}\n\n---\n{'Сгенерировано Fairy Tale Generator' if user_lang == 'ru' else 'Generated by Fairy Tale Generator'}"
+        story_text_export = f"{story.title}\n\n{story.body}\n\n---\n{'Сгенерировано Fairy Tale Generator' if user_lang == 'ru' else 'Generated by Fairy Tale Generator'}"
         st.download_button(
             label=t('download_txt', user_lang),
             data=story_text_export,
@@ -922,11 +935,26 @@ if 'current_story' in st.session_state:
                 voice_btn_placeholder.button(processing_text, disabled=True, key="voice_gen_btn_processing")
                 
                 # Затем выполняем работу (без st.spinner, так как кнопка сама говорит о процессе)
-                audio_text = re.sub(r'[^\w\s,.!?;:—\-\(\)\[\]а-яА-ЯёЁa-zA-Z0-9]', '', story['body'])
+                audio_text = re.sub(r'[^\w\s,.!?;:—\-\(\)\[\]а-яА-ЯёЁa-zA-Z0-9]', '', story.body)
                 try:
-                    # Используем run_in_executor или просто await, так как это async
-                    audio_fp = asyncio.run(generate_audio_stream(audio_text, selected_voice))
-                    st.session_state['current_story']['audio'] = audio_fp
+                    # Тот же текст тем же голосом уже озвучивали — берём MP3 с диска
+                    audio_key = audio_store.audio_key(audio_text, selected_voice)
+                    audio_fp = audio_store.get_audio(audio_key)
+                    if audio_fp is None:
+                        # Используем run_in_executor или просто await, так как это async
+                        audio_fp = asyncio.run(generate_audio_stream(audio_text, selected_voice))
+                        audio_store.put_audio(audio_key, audio_fp.getvalue())
+                    else:
+                        logger.info(f"Audio served from store: {audio_key}")
+                    story.audio = audio_fp
+                    story.audio_key = audio_key
+                    story.voice = selected_voice
+                    # Сказка уже в библиотеке — сохраняем ссылку на озвучку
+                    if story.id is not None:
+                        try:
+                            storage.save_story(story, namespace=library_namespace)
+                        except storage.QuotaExceededError as e:
+                            logger.warning(f"Audio link not saved: {e}")
                     st.rerun() # Перезагрузка для обновления UI (показать плеер и вернуть кнопку)
                 except Exception as e_tts:
                     st.error(f"Ошибка озвучки: {e_tts}" if user_lang == 'ru' else f"Narration error: {e_tts}")
@@ -938,14 +966,23 @@ if 'current_story' in st.session_state:
             save_btn_text = "💾 В библиотеку" if user_lang == 'ru' else "💾 To Library"
             save_help = "Сохранить сказку в Мои сказки" if user_lang == 'ru' else "Save story to My Stories"
             if st.button(save_btn_text, key="save_story_btn", help=save_help):
-                storage.save_story(story)
-                st.toast("Сказка сохранена в библиотеку! 📚" if user_lang == 'ru' else "Story saved to library! 📚")
+                try:
+                    duplicate = storage.save_story(story, namespace=library_namespace)
+                except storage.QuotaExceededError as e:
+                    # Сверх квоты сказка не сохраняется — старые сказки никогда не удаляются молча
+                    st.warning(t('library_quota_exceeded', user_lang, stories=e.max_stories or "∞",
+                                 mb=round(e.max_bytes / (1024 * 1024), 1) if e.max_bytes else "∞"))
+                else:
+                    if duplicate is None or DUPLICATE_POLICY == "warn":
+                        st.toast("Сказка сохранена в библиотеку! 📚" if user_lang == 'ru' else "Story saved to library! 📚")
+                    if duplicate is not None:
+                        st.toast(t(f'library_duplicate_{DUPLICATE_POLICY}', user_lang, title=duplicate['title']))
 
         # Показываем плеер
-        if st.session_state['current_story'].get('audio'):
+        if story.audio:
             st.success("Аудио готово! ⬇️" if user_lang == 'ru' else "Audio ready! ⬇️")
             player_label = "🎧 Плеер (MP3 можно скачать в плеере)" if user_lang == 'ru' else "🎧 Player (MP3 downloadable in player)"
-            display_audio_player(st.session_state['current_story']['audio'], player_label)
+            display_audio_player(story.audio, player_label)
             
     except Exception as e_render:
         logger.error(f"Error rendering story result: {e_render}")
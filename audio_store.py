@@ -0,0 +1,149 @@
+"""
+Контентно-адресуемое хранилище озвучек сказок.
+
+MP3 хранится на диске под ключом sha256(голос + текст) в шардированной
+структуре `audio_store/ab/cd/<ключ>.mp3`. Одинаковый текст тем же голосом
+сохраняется один раз, а сказка из библиотеки хранит только ссылку
+(`audio_key`) — повторное открытие не требует обращения к Edge TTS.
+Общий размер ограничен AUDIO_STORE_MAX_BYTES: при превышении удаляются
+давно не использованные файлы (LRU по времени последнего доступа).
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import logging
+from typing import Dict, Optional
+
+from config import AUDIO_STORE_DIR, AUDIO_STORE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# После вытеснения хранилище заполнено не более чем на эту долю лимита,
+# чтобы не запускать сканирование на каждой следующей записи
+EVICTION_TARGET_RATIO = 0.9
+
+# Известный процессу суммарный размер хранилища: каталог -> байты.
+# Считается одним сканированием при первой записи и далее ведётся инкрементально.
+_total_bytes: Dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def audio_key(text: str, voice: str) -> str:
+    """Возвращает ключ озвучки: sha256 от голоса и текста."""
+    return hashlib.sha256(f"{voice}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _blob_path(key: str) -> str:
+    return os.path.join(AUDIO_STORE_DIR, key[:2], key[2:4], f"{key}.mp3")
+
+
+def _scan_total() -> int:
+    total = 0
+    for root, _, files in os.walk(AUDIO_STORE_DIR):
+        for name in files:
+            if name.endswith(".mp3"):
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+    return total
+
+
+def has_audio(key: str) -> bool:
+    """Проверяет, есть ли озвучка с таким ключом."""
+    return os.path.exists(_blob_path(key))
+
+
+def get_audio(key: str) -> Optional[io.BytesIO]:
+    """
+    Возвращает озвучку по ключу или None, если её нет (не было или вытеснена).
+    Обновляет время доступа файла для LRU-вытеснения.
+    """
+    path = _blob_path(key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+    except OSError:
+        return None
+    return io.BytesIO(data)
+
+
+def put_audio(key: str, data: bytes) -> None:
+    """
+    Сохраняет озвучку под ключом. Повторная запись того же ключа только
+    обновляет время доступа (дедупликация). При превышении лимита размера
+    вытесняет давно не использованные файлы.
+    """
+    path = _blob_path(key)
+    if os.path.exists(path):
+        os.utime(path)
+        return
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Атомарная запись: другие процессы никогда не увидят недописанный MP3
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    key_dir = os.path.abspath(AUDIO_STORE_DIR)
+    with _lock:
+        if key_dir not in _total_bytes:
+            _total_bytes[key_dir] = _scan_total()
+        else:
+            _total_bytes[key_dir] += len(data)
+        over_limit = _total_bytes[key_dir] > AUDIO_STORE_MAX_BYTES
+    if over_limit:
+        evict()
+
+
+def evict(max_bytes: Optional[int] = None) -> int:
+    """
+    Удаляет давно не использованные озвучки, пока размер хранилища не станет
+    не больше EVICTION_TARGET_RATIO от лимита.
+
+    Returns:
+        int: Количество освобождённых байт.
+    """
+    limit = AUDIO_STORE_MAX_BYTES if max_bytes is None else max_bytes
+    target = int(limit * EVICTION_TARGET_RATIO)
+
+    blobs = []
+    for root, _, files in os.walk(AUDIO_STORE_DIR):
+        for name in files:
+            if not name.endswith(".mp3"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st_result = os.stat(path)
+            except OSError:
+                continue
+            blobs.append((st_result.st_mtime, st_result.st_size, path))
+
+    total = sum(size for _, size, _ in blobs)
+    freed = 0
+    for _, size, path in sorted(blobs):
+        if total - freed <= target:
+            break
+        try:
+            os.remove(path)
+            freed += size
+        except OSError:
+            continue
+
+    with _lock:
+        _total_bytes[os.path.abspath(AUDIO_STORE_DIR)] = total - freed
+    if freed:
+        logger.info(f"Audio store eviction freed {freed} bytes ({AUDIO_STORE_DIR})")
+    return freed
@@ -6,6 +6,7 @@
 import streamlit as st
 import logging
 import re
+import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -143,6 +144,24 @@ def get_current_user():
     return st.session_state.get('user', None)
 
 
+def get_library_namespace() -> str:
+    """
+    Возвращает пространство имён личной библиотеки (см. storage.py).
+
+    Авторизованный пользователь — "user:<id>", библиотека общая для всех его
+    сессий. Гость — "guest:<uuid>", своя библиотека на время сессии браузера
+    (удаляется через config.GUEST_LIBRARY_TTL без изменений, см.
+    storage.sweep_guest_libraries).
+    """
+    user = get_current_user()
+    user_id = user.get('id') if isinstance(user, dict) else getattr(user, 'id', None)
+    if user_id:
+        return f"user:{user_id}"
+    if not st.session_state.get('guest_namespace'):
+        st.session_state.guest_namespace = f"guest:{uuid.uuid4().hex}"
+    return st.session_state.guest_namespace
+
+
 def is_authenticated() -> bool:
     """Проверяет, авторизован ли пользователь."""
     return st.session_state.get('user') is not None
@@ -0,0 +1,192 @@
+"""
+Автоматические выключатели (circuit breaker) моделей каскада.
+
+Выключатель на имя модели общий для процесса. Пока он замкнут (closed),
+запросы к модели идут как обычно, а их исходы копятся в окне последних
+`window` вызовов. Когда в окне не меньше `min_calls` вызовов и доля ошибок
+достигла `failure_rate`, выключатель размыкается (open): каскад пропускает
+модель сразу, не тратя на неё запрос, который всё равно кончится 429/5xx.
+Через `cooldown` секунд выключатель переходит в полуоткрытое состояние
+(half-open) и пропускает ровно один пробный запрос: успех замыкает его с
+чистым окном, ошибка снова размыкает на `cooldown`.
+
+Ошибкой модели считаются только отказы сервиса (is_model_failure): лимит
+(429), 5xx и таймауты. Заблокированный фильтром или пустой ответ, 400 и
+ошибки в нашем коде выключатель не двигают — иначе серия заблокированных
+промптов отключила бы исправную модель.
+"""
+import re
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict
+
+from config import (
+    GENERATION_BREAKER_WINDOW,
+    GENERATION_BREAKER_MIN_CALLS,
+    GENERATION_BREAKER_FAILURE_RATE,
+    GENERATION_BREAKER_COOLDOWN,
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Модель пропущена: её выключатель разомкнут (или пробный запрос уже идёт)."""
+
+    def __init__(self, name: str):
+        super().__init__(f"Circuit open for model {name}")
+        self.name = name
+
+
+# Имена классов исключений SDK (google.api_core, requests, httpx) для 429/5xx и таймаутов:
+# сверяем по имени, чтобы не зависеть от установленных библиотек
+_FAILURE_EXCEPTIONS = {
+    "ResourceExhausted", "TooManyRequests",
+    "ServerError", "InternalServerError", "BadGateway", "ServiceUnavailable", "GatewayTimeout",
+    "DeadlineExceeded", "Timeout", "TimeoutException",
+}
+_FAILURE_STATUS = re.compile(r"^\s*(429|5\d\d)\b")
+
+
+def _is_failure_status(code) -> bool:
+    return isinstance(code, int) and (code == 429 or 500 <= code < 600)
+
+
+def is_model_failure(error: BaseException) -> bool:
+    """
+    Говорит ли ошибка о недоступности модели (429, 5xx, таймаут), а не о
+    конкретном запросе (блокировка, пустой ответ, 400) или ошибке в коде.
+    """
+    if isinstance(error, TimeoutError):
+        return True
+    if any(cls.__name__ in _FAILURE_EXCEPTIONS for cls in type(error).__mro__):
+        return True
+    for attr in ("code", "status_code"):
+        if _is_failure_status(getattr(error, attr, None)):
+            return True
+    return bool(_FAILURE_STATUS.match(str(error)))
+
+
+class CircuitBreaker:
+    """Выключатель одной модели."""
+
+    def __init__(self, name: str, window: int = GENERATION_BREAKER_WINDOW,
+                 min_calls: int = GENERATION_BREAKER_MIN_CALLS,
+                 failure_rate: float = GENERATION_BREAKER_FAILURE_RATE,
+                 cooldown: float = GENERATION_BREAKER_COOLDOWN,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # True — успех, False — ошибка
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.cooldown:
+            self._state = HALF_OPEN
+            self._probing = False
+            logger.info(f"Circuit half-open for model {self.name}: next request is a probe")
+        return self._state
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._probing = False
+
+    def allow(self) -> bool:
+        """
+        Можно ли отправить запрос к модели. В полуоткрытом состоянии True
+        получает только один вызывающий — до исхода его пробного запроса.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._current_state() == HALF_OPEN:
+                self._state = CLOSED
+                self._outcomes.clear()
+                self._probing = False
+                logger.info(f"Circuit closed for model {self.name}: probe succeeded")
+            self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            state = self._current_state()
+            if state == HALF_OPEN:
+                self._open()
+                logger.warning(f"Circuit re-opened for model {self.name}: probe failed")
+                return
+            if state == OPEN:
+                return  # Запрос, начатый до размыкания
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open()
+                logger.warning(
+                    f"Circuit opened for model {self.name}: {failures}/{len(self._outcomes)} recent calls failed"
+                )
+
+    def release(self) -> None:
+        """
+        Запрос завершился без исхода для модели (проиграл хеджированной попытке
+        или упал не по её вине): в окно не идёт, пробу можно повторить.
+        """
+        with self._lock:
+            self._probing = False
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "calls": len(self._outcomes),
+                "failures": self._outcomes.count(False),
+            }
+
+
+class BreakerRegistry:
+    """Выключатели по именам моделей; создаются при первом обращении."""
+
+    def __init__(self, **settings):
+        self._settings = settings
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, **self._settings)
+            return breaker
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        """Состояние, число вызовов и ошибок в окне по каждой модели."""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+# Общие для процесса: ошибки модели в одной сессии избавляют от них остальные
+model_breakers = BreakerRegistry()
@@ -0,0 +1,200 @@
+"""
+Холодный слой библиотеки: сжатые тела давно не открывавшихся сказок.
+
+Тела хранятся в отдельной SQLite-базе рядом с библиотекой (`stories.cold.db`),
+сжатые zlib с общим словарём (`zdict`) — короткие тексты сказок сжимаются
+заметно лучше, чем без словаря, потому что частые слова и обороты уже есть
+в словаре. В самой библиотеке вместо тела остаётся заглушка с `"tier": "cold"`;
+storage.get_story() распаковывает тело прозрачно.
+
+Здесь же хранится время последнего открытия сказок: по нему фоновый проход
+(storage.sweep_cold_tier) возвращает холодные сказки в горячий слой, а квоты
+библиотеки (storage.enforce_quota) вытесняют давно не открывавшиеся.
+"""
+import sqlite3
+import zlib
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Общие словари сжатия по версиям. Версия записывается рядом с каждым телом,
+# поэтому опубликованный словарь нельзя менять — только добавлять новую версию.
+# Самые частые фрагменты стоят в конце: zlib кодирует ближние совпадения дешевле.
+_ZDICTS = {
+    1: (
+        "The End. Good night, sleep tight and sweet dreams. "
+        "and they lived happily ever after. Once upon a time, in a faraway kingdom, "
+        "there lived a little girl who loved the forest, the river and the stars. "
+        "a little boy, a kind dragon, a brave knight, a wise owl, a clever fox, a bunny, "
+        "a princess, a magic castle, friends, adventure, moon, sun, night, morning, "
+        "said softly, smiled and whispered, looked around, suddenly, together, "
+        "Конец. Спокойной ночи, сладких снов. "
+        "И жили они долго и счастливо. В некотором царстве, в некотором государстве "
+        "жила-была маленькая девочка, которая любила лес, речку и звёзды. "
+        "маленький мальчик, добрый дракон, храбрый рыцарь, мудрая сова, хитрая лиса, зайчик, "
+        "принцесса, волшебный замок, друзья, приключение, луна, солнце, ночь, утро, "
+        "тихо сказал, улыбнулась и прошептала, огляделся, вдруг, вместе, "
+        "Жил-был однажды, Жила-была однажды, Однажды "
+    ).encode("utf-8"),
+}
+CURRENT_ZDICT = max(_ZDICTS)
+COMPRESSION_LEVEL = 9
+
+
+def compress(text: str, dict_version: int = CURRENT_ZDICT) -> bytes:
+    """Сжимает текст с общим словарём указанной версии."""
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=_ZDICTS[dict_version])
+    return compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+
+def decompress(data: bytes, dict_version: int) -> str:
+    decompressor = zlib.decompressobj(zdict=_ZDICTS[dict_version])
+    return (decompressor.decompress(data) + decompressor.flush()).decode("utf-8")
+
+
+class ColdStore:
+    """
+    Сжатые тела сказок (`cold_bodies`) и время их последнего открытия (`story_access`).
+
+    Запись о доступе переживает возврат сказки в горячий слой — иначе она
+    снова стала бы холодной на следующем же проходе.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cold_bodies (
+            id TEXT PRIMARY KEY,
+            dict_version INTEGER NOT NULL,
+            raw_size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS story_access (
+            id TEXT PRIMARY KEY,
+            accessed_at TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.executescript(self._SCHEMA)
+        return conn
+
+    def put_many(self, bodies: Iterable[Tuple[str, str]]) -> None:
+        """Сжимает и сохраняет тела (id, текст) одной транзакцией."""
+        rows = [
+            (story_id, CURRENT_ZDICT, len(body.encode("utf-8")), compress(body))
+            for story_id, body in bodies
+        ]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO cold_bodies (id, dict_version, raw_size, data) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+        finally:
+            conn.close()
+
+    def get_many(self, story_ids: List[str]) -> Dict[str, str]:
+        """Возвращает распакованные тела найденных сказок: id -> текст."""
+        if not story_ids:
+            return {}
+        bodies = {}
+        conn = self._connect()
+        try:
+            for start in range(0, len(story_ids), 500):
+                batch = story_ids[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT id, dict_version, data FROM cold_bodies WHERE id IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for story_id, dict_version, data in rows:
+                    bodies[story_id] = decompress(data, dict_version)
+        finally:
+            conn.close()
+        return bodies
+
+    def get(self, story_id: str) -> Optional[str]:
+        """Возвращает тело сказки и отмечает время её открытия."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT dict_version, data FROM cold_bodies WHERE id = ?", (story_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO story_access (id, accessed_at) VALUES (?, ?)",
+                    (story_id, datetime.now().isoformat()),
+                )
+        finally:
+            conn.close()
+        return decompress(row[1], row[0])
+
+    def delete_many(self, story_ids: Iterable[str], forget_access: bool = False) -> None:
+        """Удаляет сжатые тела (и, при forget_access, историю открытий)."""
+        ids = [(story_id,) for story_id in story_ids]
+        if not ids:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("DELETE FROM cold_bodies WHERE id = ?", ids)
+                if forget_access:
+                    conn.executemany("DELETE FROM story_access WHERE id = ?", ids)
+        finally:
+            conn.close()
+
+    def ids(self) -> List[str]:
+        conn = self._connect()
+        try:
+            return [row[0] for row in conn.execute("SELECT id FROM cold_bodies")]
+        finally:
+            conn.close()
+
+    def record_access(self, times: Dict[str, str]) -> None:
+        """Запоминает время открытия сказок (id -> ISO-время); более позднее время не затирается."""
+        if not times:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO story_access (id, accessed_at) VALUES (?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET accessed_at = MAX(accessed_at, excluded.accessed_at)",
+                    list(times.items()),
+                )
+        finally:
+            conn.close()
+
+    def access_times(self) -> Dict[str, str]:
+        """Время последнего открытия холодных (и возвращённых из холода) сказок."""
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT id, accessed_at FROM story_access"))
+        finally:
+            conn.close()
+
+    def raw_sizes(self) -> Dict[str, int]:
+        """Исходный размер (байт UTF-8) каждого сжатого тела."""
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT id, raw_size FROM cold_bodies"))
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        """Количество сказок в холодном слое и сэкономленные байты."""
+        conn = self._connect()
+        try:
+            count, raw, stored = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(raw_size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM cold_bodies"
+            ).fetchone()
+        finally:
+            conn.close()
+        return {"stories": count, "raw_bytes": raw, "stored_bytes": stored, "saved_bytes": raw - stored}
@@ -46,8 +46,124 @@ IP_API_URL = 'https://ipapi.co/json/'
 
 # === ФАЙЛЫ ===
 STORIES_FILE = "stories.json"
+STORIES_DB_FILE = "stories.db"  # SQLite-база библиотеки (STORAGE_BACKEND = "sqlite")
+STORIES_INDEX_FILE = "stories.index.json"  # Компактный индекс библиотеки (id, title, created_at)
+STORIES_SEARCH_FILE = "stories.search.db"  # Полнотекстовый индекс библиотеки (SQLite FTS5)
+STORIES_COLD_FILE = "stories.cold.db"  # Сжатые тела давно не открывавшихся сказок
+STORIES_SNAPSHOT_BODIES_FILE = "stories.snapshot.bin"  # mmap-снимок библиотеки: тела и поля сказок
+STORIES_SNAPSHOT_INDEX_FILE = "stories.snapshot.idx"  # mmap-снимок библиотеки: смещения фиксированной ширины
+STORIES_ACCESS_LOG_FILE = "stories.access.log"  # NDJSON-журнал открытий сказок (для LRU-вытеснения и холодного слоя)
+STORIES_PLAN_FILE = "stories.plan.json"  # Тариф владельца библиотеки (квота, см. PLAN_QUOTAS)
+STORIES_VERSION_FILE = "stories.version"  # Счётчик изменений библиотеки, общий для процессов (LIBRARY_CHANGE_FEED)
+STORIES_NAMESPACE_FILE = "stories.namespace"  # Пространство имён гостевой библиотеки (для удаления её строк в Supabase)
+STORIES_JOURNAL_FILE = "stories.journal"  # NDJSON-журнал изменений (STORAGE_BACKEND = "journal")
+GENERATION_CACHE_FILE = "generation_cache.db"  # Кэш ответов Gemini (GENERATION_CACHE)
+LIBRARIES_DIR = "libraries"  # Личные библиотеки пользователей: libraries/ab/<hash>/stories.json
 LOG_FILE = "app.log"
 
+# === ХРАНИЛИЩЕ БИБЛИОТЕКИ ===
+# "json" — один файл stories.json, "sqlite" — база stories.db (UPSERT одной строки на сохранение),
+# "journal" — снимок stories.json + дозапись изменений в stories.journal,
+# "supabase" — таблица Supabase через REST (SUPABASE_URL / SUPABASE_KEY из secrets или окружения)
+STORAGE_BACKEND = "json"
+SUPABASE_STORIES_TABLE = "stories"  # Таблица библиотеки в Supabase (общая для всех пространств имён)
+SUPABASE_TIMEOUT = 10  # Таймаут REST-запроса к Supabase (секунды)
+SUPABASE_PAGE_SIZE = 1000  # Строк на один запрос (лимит PostgREST по умолчанию)
+LIBRARY_PAGE_SIZE = 10  # Сказок на одной странице библиотеки в сайдбаре
+
+# Гостевые библиотеки (guest:<uuid>, см. auth.get_library_namespace) лежат в libraries/guests/:
+# после конца сессии гость до них не доберётся, поэтому давно не менявшиеся удаляются
+GUEST_LIBRARY_TTL = 24 * 60 * 60  # Секунд без изменений, после которых гостевая библиотека удаляется
+GUEST_LIBRARY_SWEEP_INTERVAL = 60 * 60  # Секунд между фоновыми проходами по гостевым библиотекам
+LIBRARY_CACHE_SIZE = 128  # Библиотек в каждом кэше процесса (разобранные записи, журналы, снимки)
+
+# Снимок только для чтения (snapshot.py): get_story/load_stories читают его через mmap,
+# пока он соответствует библиотеке. Пересобирается при записи (json), при компактизации
+# журнала (journal) и вызовом storage.build_snapshot() (любой движок)
+LIBRARY_SNAPSHOT = False
+
+# Лента изменений для нескольких процессов за балансировщиком: каждая запись через API
+# увеличивает счётчик в stories.version, а страницы, сводки, поиск и фильтры кэшируются
+# в процессе до следующего изменения. Включать во всех процессах сразу; правки в обход
+# API становятся видны после storage.mark_library_changed()
+LIBRARY_CHANGE_FEED = False
+LIBRARY_VIEW_CACHE_SIZE = 256  # Закэшированных ответов на процесс
+
+# Отложенная запись: save_story/delete_story только ставят изменение в очередь,
+# фоновый поток сохраняет накопленное за окно одной операцией (и при выходе)
+WRITE_BEHIND = False
+WRITE_BEHIND_WINDOW = 0.2  # Секунд ожидания следующих записей перед сохранением пакета
+
+# Почти-дубликаты при сохранении (SimHash тела, см. fingerprint.py):
+# "allow" — не проверять, "warn" — сохранить и сообщить, "skip" — не сохранять,
+# "merge" — заменить найденную сказку новой версией (ID прежней сказки сохраняется)
+DUPLICATE_POLICY = "warn"
+DUPLICATE_MAX_DISTANCE = 5  # Бит различия отпечатков; меньше fingerprint.BANDS — поиск без пропусков
+
+# Версия формата записи сказки: старые библиотеки обновляет storage.migrate_library()
+STORY_SCHEMA_VERSION = 3
+MIGRATION_CHECKPOINT_RECORDS = 1000  # Записей между точками возобновления миграции
+
+# Пороги фоновой компактизации журнала (в байтах)
+JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024  # Журнал больше 4 МБ сворачивается всегда
+JOURNAL_COMPACT_MIN_BYTES = 64 * 1024  # Меньше 64 КБ — никогда
+JOURNAL_COMPACT_RATIO = 0.5  # Между порогами — если журнал >= 50% размера снимка
+
+# === ХРАНИЛИЩЕ ОЗВУЧЕК ===
+AUDIO_STORE_DIR = "audio_store"  # MP3 по ключу sha256(голос + текст), шарды ab/cd/
+AUDIO_STORE_MAX_BYTES = 512 * 1024 * 1024  # Лимит размера; сверх него — LRU-вытеснение
+
+# === КЭШ ГЕНЕРАЦИИ ===
+# Одинаковые запросы (тот же промпт) отдаются из кэша без обращения к Gemini
+# (generation_cache.py); флажок «Новая сказка» генерирует заново
+GENERATION_CACHE = False
+GENERATION_CACHE_TTL = 7 * 24 * 60 * 60  # Секунд жизни сохранённого ответа
+GENERATION_CACHE_MAX_ENTRIES = 1000  # Запросов в кэше; сверх — вытесняются давно не запрошенные
+GENERATION_CACHE_VARIANTS = 3  # Разных сказок на один запрос (отдаются по очереди)
+
+# === ХЕДЖИРОВАНИЕ ЗАПРОСОВ ===
+# Если модель каскада не начала отвечать дольше обычного (перцентиль задержки
+# до первого фрагмента), параллельно запускается следующая (generation.py)
+GENERATION_HEDGING = False
+GENERATION_HEDGE_PERCENTILE = 95  # Перцентиль задержки модели, после которого запускается следующая
+GENERATION_HEDGE_DEFAULT_DELAY = 8.0  # Секунд ожидания, пока замеров модели меньше минимума
+GENERATION_HEDGE_MIN_DELAY = 1.0  # Нижняя граница задержки хеджирования, секунд
+GENERATION_HEDGE_MIN_SAMPLES = 10  # Замеров модели, после которых задержка считается по перцентилю
+GENERATION_HEDGE_WINDOW = 100  # Последних замеров на модель в расчёте перцентиля
+
+# === ВЫКЛЮЧАТЕЛИ МОДЕЛЕЙ ===
+# Модель с высокой долей ошибок (429/5xx, таймауты) каскад пропускает без запроса, пока
+# не пройдёт пауза; затем один пробный запрос решает, вернуть ли её (circuit_breaker.py).
+# Блокировки, пустые ответы и 400 ошибками модели не считаются
+GENERATION_BREAKER = True
+GENERATION_BREAKER_WINDOW = 20  # Последних вызовов модели в расчёте доли ошибок
+GENERATION_BREAKER_MIN_CALLS = 5  # Вызовов в окне, начиная с которых выключатель может разомкнуться
+GENERATION_BREAKER_FAILURE_RATE = 0.5  # Доля ошибок в окне, при которой модель отключается
+GENERATION_BREAKER_COOLDOWN = 60.0  # Секунд до пробного запроса к отключённой модели
+
+# === ХОЛОДНЫЙ СЛОЙ БИБЛИОТЕКИ ===
+# Давно не открывавшиеся сказки сжимаются в stories.cold.db (cold_store.py): get_story дописывает
+# открытие в stories.access.log, списки библиотеки раз в интервал запускают фоновый проход.
+# Выключен — ни журнала, ни проходов; уже сжатые сказки читаются как обычно, sweep_cold_tier() работает
+LIBRARY_COLD_TIER = False
+COLD_TIER_AGE_DAYS = 30  # Сказки, не открывавшиеся дольше, хранятся сжатыми
+COLD_TIER_SWEEP_INTERVAL = 60 * 60  # Секунд между фоновыми проходами по библиотеке
+
+# === КВОТЫ БИБЛИОТЕКИ ===
+# Лимиты личной библиотеки по тарифам (ROADMAP.md); None — без ограничения.
+# Библиотека без тарифа (storage.set_library_plan не вызывался) не ограничена.
+PLAN_QUOTAS = {
+    "free": {"stories": 30, "bytes": 2 * 1024 * 1024},
+    "pro": {"stories": 500, "bytes": 50 * 1024 * 1024},
+    "family": {"stories": 2000, "bytes": 200 * 1024 * 1024},
+}
+# Без QUOTA_AUTO_EVICT сохранение сверх квоты отклоняется (storage.QuotaExceededError,
+# приложение показывает предупреждение); с ним — сохраняется, а лишние сказки удаляет фоновый поток
+QUOTA_AUTO_EVICT = False
+QUOTA_EVICTION = "oldest"  # "oldest" — сначала самые старые, "lru" — давно не открывавшиеся
+QUOTA_REAP_DELAY = 5  # Секунд от сохранения до фоновой проверки квоты (сохранения за это время проверяются разом)
+QUOTA_REAP_BATCH = 20  # Удалений за один проход; остальное — в следующих проходах
+
 # === ВАЛИДАЦИЯ ===
 MAX_NAME_LENGTH = 50
 MIN_NAME_LENGTH = 1
@@ -0,0 +1,63 @@
+"""
+Отпечатки текстов сказок для поиска почти-дубликатов.
+
+SimHash по словным шинглам: похожие тексты получают 64-битные отпечатки,
+различающиеся в немногих битах, поэтому «почти тот же текст» — это
+отпечаток на расстоянии Хэмминга не больше порога.
+
+Чтобы не сравнивать отпечаток со всей библиотекой, он режется на BANDS
+полос по 10–11 бит (LSH). Если отпечатки различаются не больше чем в
+BANDS - 1 битах, хотя бы одна полоса у них совпадает целиком — кандидаты
+находятся точным поиском по индексу полос (см. SearchIndex.find_similar).
+"""
+import hashlib
+from collections import Counter
+from typing import List, Optional
+
+FINGERPRINT_BITS = 64
+BANDS = 6
+SHINGLE_SIZE = 2  # Слов в шингле: чем короче, тем меньше отпечаток реагирует на замену слова
+MIN_WORDS = 20  # Тексты короче не получают отпечатка — на них SimHash слишком шумный
+
+
+def _hash64(shingle: str) -> int:
+    # Встроенный hash() строк меняется от процесса к процессу, а отпечатки хранятся на диске
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(words: List[str]) -> Optional[int]:
+    """
+    Вычисляет 64-битный SimHash текста (None для слишком коротких текстов).
+
+    Args:
+        words: Нормализованные слова текста (search_index.tokenize).
+
+    Шинглы — SHINGLE_SIZE подряд идущих слов; повторяющиеся шинглы весят больше.
+    """
+    if len(words) < MIN_WORDS:
+        return None
+    shingles = Counter(
+        " ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)
+    )
+    weights = [0] * FINGERPRINT_BITS
+    for shingle, count in shingles.items():
+        value = _hash64(shingle)
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += count if value >> bit & 1 else -count
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Число различающихся бит двух отпечатков."""
+    return bin(a ^ b).count("1")
+
+
+def bands(fingerprint: int) -> List[int]:
+    """Режет отпечаток на BANDS полос почти равной ширины (младшие биты — полоса 0)."""
+    width, extra = divmod(FINGERPRINT_BITS, BANDS)
+    values, shift = [], 0
+    for band in range(BANDS):
+        bits = width + (band < extra)
+        values.append(fingerprint >> shift & ((1 << bits) - 1))
+        shift += bits
+    return values
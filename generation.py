@@ -0,0 +1,348 @@
+"""
+Потоковая генерация сказки по каскаду моделей.
+
+Модели каскада опрашиваются с `stream=True`: текст приходит фрагментами, и
+накопленный ответ сразу передаётся в `on_text` — приложение рисует
+заголовок и готовые абзацы, не дожидаясь конца сказки.
+
+Переход к следующей модели возможен, только пока ни одна модель не прислала
+ни одного фрагмента (ошибка запроса, лимит, пустой ответ). Если поток
+оборвался посреди сказки, пользователь уже видит её начало — тогда генерация
+завершается ошибкой StreamInterrupted с частичным текстом, а не подменяет
+сказку ответом другой модели.
+
+Хеджирование (`hedging=True`): если запущенная модель не прислала первый
+фрагмент за обычное для неё время (GENERATION_HEDGE_PERCENTILE задержки до
+первого фрагмента по последним замерам), параллельно запускается следующая
+модель каскада. Побеждает попытка, первой приславшая текст, остальные
+отменяются. Без хеджирования следующая модель запускается только после
+ошибки предыдущей. Доля хеджированных запросов и сэкономленное время —
+hedge_stats().
+
+С выключателями (`breakers`, circuit_breaker.py) модель с разомкнутым
+выключателем пропускается без запроса; первый фрагмент или пустой ответ
+считаются успехом модели, ошибка до первого фрагмента или обрыв — ошибкой,
+если это отказ сервиса (circuit_breaker.is_model_failure); прочие ошибки
+исхода для выключателя не имеют.
+
+Каждая попытка читает поток в своём потоке (threading) и передаёт фрагменты
+в очередь; `on_text` вызывается в потоке, вызвавшем stream_story. Модель
+создаётся фабрикой `model_factory(model_name)` (в приложении —
+genai.GenerativeModel), поэтому модуль не зависит от SDK Gemini.
+"""
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from circuit_breaker import BreakerRegistry, CircuitOpenError, is_model_failure
+from config import (
+    GENERATION_HEDGE_PERCENTILE,
+    GENERATION_HEDGE_DEFAULT_DELAY,
+    GENERATION_HEDGE_MIN_DELAY,
+    GENERATION_HEDGE_MIN_SAMPLES,
+    GENERATION_HEDGE_WINDOW,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class GenerationResult:
+    """Ответ модели и задержки от начала перебора каскада, в секундах."""
+
+    text: str
+    model: str
+    first_paragraph: float  # До первого законченного абзаца (или до конца, если абзац один)
+    total: float
+
+
+class GenerationError(Exception):
+    """Ни одна модель каскада не дала ответа; last_error — ошибка последней попытки."""
+
+    def __init__(self, last_error: Optional[BaseException] = None):
+        super().__init__(str(last_error) if last_error is not None else "No models to try")
+        self.last_error = last_error
+
+
+class StreamInterrupted(GenerationError):
+    """Поток модели оборвался после первого фрагмента; partial — полученный текст."""
+
+    def __init__(self, model: str, partial: str, last_error: BaseException):
+        super().__init__(last_error)
+        self.model = model
+        self.partial = partial
+
+
+def clean_title(line: str) -> str:
+    """Заголовок из первой строки ответа: без markdown-разметки (# и **)."""
+    return line.strip().lstrip('#').replace('*', '').strip()
+
+
+def split_story(text: str) -> Tuple[Optional[str], str]:
+    """(заголовок, тело) ответа модели; заголовок None, если в ответе одна строка."""
+    text = text.strip()
+    if '\n' not in text:
+        return None, text
+    title, body = text.split('\n', 1)
+    return clean_title(title), body
+
+
+def first_paragraph_ready(text: str) -> bool:
+    """Получены заголовок и хотя бы один законченный (с переводом строки) абзац."""
+    complete = text.lstrip().split('\n')[:-1]
+    return sum(1 for line in complete if line.strip()) >= 2
+
+
+class FirstChunkLatency:
+    """Последние задержки до первого фрагмента по моделям и задержка хеджирования по ним."""
+
+    def __init__(self, percentile: float = GENERATION_HEDGE_PERCENTILE, window: int = GENERATION_HEDGE_WINDOW,
+                 min_samples: int = GENERATION_HEDGE_MIN_SAMPLES, default: float = GENERATION_HEDGE_DEFAULT_DELAY,
+                 floor: float = GENERATION_HEDGE_MIN_DELAY):
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.default = default
+        self.floor = floor
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(model)
+            if samples is None:
+                samples = self._samples[model] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def hedge_delay(self, model: str) -> float:
+        """Секунд ожидания первого фрагмента модели, после которых запускается следующая."""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < self.min_samples:
+            return self.default
+        rank = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return max(self.floor, samples[rank])
+
+
+class HedgeStats:
+    """Счётчики хеджирования процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0  # Запросов, где запускалась хотя бы одна параллельная попытка
+        self.hedge_wins = 0  # ...и победила параллельная попытка
+        self.saved = 0.0  # Секунд до первого фрагмента, сэкономленных против последовательного перебора
+
+    def record(self, hedged: bool, hedge_won: bool, saved: float) -> None:
+        with self._lock:
+            self.requests += 1
+            self.hedged += hedged
+            self.hedge_wins += hedge_won
+            self.saved += saved
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "saved_latency_total": self.saved,
+                "saved_latency_avg": self.saved / self.hedged if self.hedged else 0.0,
+            }
+
+
+# Общие для процесса: задержки моделей копятся между запросами всех сессий
+first_chunk_latency = FirstChunkLatency()
+_hedge_stats = HedgeStats()
+
+
+def hedge_stats() -> Dict[str, float]:
+    """
+    Метрики хеджирования: запросы (requests), хеджированные запросы (hedged) и
+    их доля (hedge_rate), победы параллельных попыток (hedge_wins),
+    сэкономленные секунды до первого фрагмента — всего и на хеджированный запрос.
+    """
+    return _hedge_stats.snapshot()
+
+
+@dataclass
+class _Attempt:
+    model: str
+    started: float
+    hedge: bool  # Запущена по таймеру хеджирования, а не после ошибки предыдущей
+    cancel: threading.Event = field(default_factory=threading.Event)
+    failed_at: Optional[float] = None
+
+
+def _read_stream(index: int, attempt: _Attempt, prompt: str, model_factory: Callable[[str], Any],
+                 events: "queue.Queue[Tuple[str, int, Any]]") -> None:
+    """Читает поток попытки и кладёт в очередь ("chunk", i, текст), ("error", i, e) и ("done", i, None)."""
+    stream = None
+    lead = ""  # Пробельные фрагменты до первого текста: ответ из одних пробелов — пустой
+    try:
+        stream = model_factory(attempt.model).generate_content(prompt, stream=True)
+        for chunk in stream:
+            if attempt.cancel.is_set():
+                break
+            piece = chunk.text
+            if not piece:
+                continue
+            if lead is not None:
+                lead += piece
+                if not lead.strip():
+                    continue
+                piece, lead = lead, None
+            events.put(("chunk", index, piece))
+    except Exception as e:
+        events.put(("error", index, e))
+        return
+    finally:
+        if attempt.cancel.is_set() and hasattr(stream, "close"):
+            stream.close()
+    events.put(("done", index, None))
+
+
+def stream_story(prompt: str, models: Sequence[str], model_factory: Callable[[str], Any],
+                 on_text: Optional[Callable[[str], None]] = None,
+                 clock: Callable[[], float] = time.monotonic, hedging: bool = False,
+                 latency: Optional[FirstChunkLatency] = None,
+                 breakers: Optional[BreakerRegistry] = None) -> GenerationResult:
+    """
+    Генерирует сказку первой ответившей моделью каскада.
+
+    Args:
+        prompt: Промпт (prompts.build_story_prompt).
+        models: Имена моделей в порядке перебора (GEMINI_MODEL_CASCADE).
+        model_factory: Создаёт модель по имени; у модели есть generate_content(prompt, stream=True).
+        on_text: Вызывается с накопленным текстом после каждого непустого фрагмента.
+        clock: Источник времени (секунды) для замеров задержки и таймера хеджирования.
+        hedging: Запускать следующую модель параллельно, если текущая отвечает дольше обычного.
+        latency: Замеры задержек моделей (по умолчанию общие для процесса).
+        breakers: Выключатели моделей; None — модели не отключаются.
+
+    Raises:
+        StreamInterrupted: Поток оборвался после первого фрагмента.
+        GenerationError: Все модели завершились ошибкой до первого фрагмента
+            (или пропущены: last_error — CircuitOpenError).
+    """
+    latency = first_chunk_latency if latency is None else latency
+    events: "queue.Queue[Tuple[str, int, Any]]" = queue.Queue()
+    attempts: List[_Attempt] = []
+    next_model = 0
+    last_error: Optional[BaseException] = None
+    start = clock()
+
+    def launch(hedge: bool) -> bool:
+        """Запускает следующую модель, чей выключатель пропускает запрос; False — таких не осталось."""
+        nonlocal next_model, last_error
+        while next_model < len(models):
+            model_name = models[next_model]
+            next_model += 1
+            if breakers is not None and not breakers.get(model_name).allow():
+                logger.warning(f"Skipping model {model_name}: circuit open")
+                last_error = CircuitOpenError(model_name)
+                continue
+            attempt = _Attempt(model_name, clock(), hedge)
+            attempts.append(attempt)
+            if hedge:
+                logger.info(f"Hedging: starting {model_name} alongside slow {attempts[-2].model}")
+            else:
+                logger.info(f"Attempting generation with model: {model_name}")
+            threading.Thread(
+                target=_read_stream, args=(len(attempts) - 1, attempt, prompt, model_factory, events), daemon=True
+            ).start()
+            return True
+        return False
+
+    def record(attempt: _Attempt, error: Optional[BaseException] = None) -> None:
+        if breakers is None:
+            return
+        breaker = breakers.get(attempt.model)
+        if error is None:
+            breaker.record_success()
+        elif is_model_failure(error):
+            breaker.record_failure()
+        else:
+            breaker.release()  # Блокировка, 400, ошибка в коде: модель тут ни при чём
+
+    def pending() -> bool:
+        return any(a.failed_at is None for a in attempts)
+
+    winner = None
+    text = ""
+    first_paragraph = None
+    if not launch(False):
+        raise GenerationError(last_error)
+    while True:
+        timeout = None
+        if hedging and winner is None and next_model < len(models):
+            last = attempts[-1]
+            timeout = max(0.0, last.started + latency.hedge_delay(last.model) - clock())
+        try:
+            kind, index, payload = events.get(timeout=timeout)
+        except queue.Empty:
+            launch(True)
+            continue
+        if winner is not None and index != winner:
+            continue  # Отменённые попытки могут успеть прислать ещё что-то
+        attempt = attempts[index]
+        if kind == "chunk":
+            if winner is None:
+                winner = index
+                now = clock()
+                latency.observe(attempt.model, now - attempt.started)
+                record(attempt)
+                for other in attempts:
+                    if other is not attempt and other.failed_at is None:
+                        other.cancel.set()
+                        if breakers is not None:
+                            breakers.get(other.model).release()
+                # Последовательный перебор запустил бы победителя, только когда все
+                # предыдущие модели завершились ошибкой (а незавершённые — не раньше, чем сейчас)
+                earlier = attempts[:index]
+                sequential_start = max(
+                    [a.failed_at if a.failed_at is not None else now for a in earlier], default=attempt.started
+                )
+                _hedge_stats.record(
+                    any(a.hedge for a in attempts), attempt.hedge, max(0.0, sequential_start - attempt.started)
+                )
+            text += payload
+            if first_paragraph is None and first_paragraph_ready(text):
+                first_paragraph = clock() - start
+            if on_text is not None:
+                on_text(text)
+            continue
+        if index == winner:
+            if kind == "error":
+                record(attempt, payload)
+                logger.error(
+                    f"Model {attempt.model} stream interrupted after {len(text)} chars: {payload}", exc_info=payload
+                )
+                raise StreamInterrupted(attempt.model, text, payload) from payload
+            total = clock() - start
+            if first_paragraph is None:
+                first_paragraph = total
+            logger.info(
+                f"Story generated with model {attempt.model}: "
+                f"first paragraph {first_paragraph:.2f}s, total {total:.2f}s"
+            )
+            return GenerationResult(text, attempt.model, first_paragraph, total)
+        # Попытка завершилась без текста: ошибка или пустой ответ (модель при этом доступна)
+        if kind == "error":
+            logger.error(f"Model {attempt.model} failed: {payload}", exc_info=payload)
+            last_error = payload
+            record(attempt, payload)
+        else:
+            logger.warning(f"Model {attempt.model} returned an empty response")
+            last_error = ValueError(f"Model {attempt.model} returned an empty response")
+            record(attempt)
+        attempt.failed_at = clock()
+        if not pending() and not launch(False):
+            _hedge_stats.record(any(a.hedge for a in attempts), False, 0.0)
+            raise GenerationError(last_error)
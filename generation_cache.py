@@ -0,0 +1,140 @@
+"""
+Кэш ответов генерации сказок.
+
+Одинаковый запрос (те же имя, пол, возраст, жанр, интересы, длина и язык)
+даёт тот же промпт (prompts.build_story_prompt нормализует поля формы),
+поэтому ключ кэша — sha256 промпта: повторная отправка формы или типовой
+демо-запрос не обращаются к Gemini. Смена текста промпта меняет ключ, и
+старые ответы просто перестают находиться.
+
+На один ключ хранится до `variants` разных сказок: «новая сказка» (fresh)
+всегда генерирует заново и добавляет вариант, а обычный запрос отдаёт
+варианты по очереди. Записи старше `ttl` секунд не отдаются; при превышении
+`max_entries` ключей вытесняются давно не запрошенные (LRU). Счётчики
+попаданий и промахов хранятся в той же SQLite-базе и общие для процессов.
+"""
+import hashlib
+import sqlite3
+import time
+import logging
+from typing import Dict, Optional, Tuple
+
+from config import GENERATION_CACHE_TTL, GENERATION_CACHE_MAX_ENTRIES, GENERATION_CACHE_VARIANTS
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(prompt: str) -> str:
+    """Ключ кэша: sha256 текста промпта."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """Варианты ответов (`responses`) по ключу запроса и счётчики (`counters`)."""
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT NOT NULL,
+            variant INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            model TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            used_at REAL NOT NULL,
+            PRIMARY KEY (key, variant)
+        );
+        CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at);
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path: str, ttl: float = GENERATION_CACHE_TTL,
+                 max_entries: int = GENERATION_CACHE_MAX_ENTRIES, variants: int = GENERATION_CACHE_VARIANTS):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.variants = variants
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.executescript(self._SCHEMA)
+        return conn
+
+    @staticmethod
+    def _count(conn: sqlite3.Connection, name: str) -> None:
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def get(self, key: str, now: Optional[float] = None) -> Optional[Tuple[str, str]]:
+        """
+        Возвращает (текст, модель) одного из свежих вариантов или None.
+
+        Отдаётся вариант, который дольше всех не отдавали, — повторные
+        запросы получают сохранённые варианты по очереди.
+        """
+        now = time.time() if now is None else now
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute(
+                    "SELECT variant, text, model FROM responses WHERE key = ? AND created_at > ? "
+                    "ORDER BY used_at, variant LIMIT 1",
+                    (key, now - self.ttl),
+                ).fetchone()
+                if row is None:
+                    self._count(conn, "misses")
+                    return None
+                conn.execute("UPDATE responses SET used_at = ? WHERE key = ? AND variant = ?", (now, key, row[0]))
+                self._count(conn, "hits")
+        finally:
+            conn.close()
+        return row[1], row[2]
+
+    def put(self, key: str, text: str, model: str, now: Optional[float] = None) -> None:
+        """
+        Добавляет вариант ответа. Сверх `variants` вариантов ключа удаляются
+        самые старые; заодно удаляются просроченные записи и давно не
+        запрошенные ключи сверх `max_entries`.
+        """
+        now = time.time() if now is None else now
+        conn = self._connect()
+        try:
+            with conn:
+                variant = conn.execute(
+                    "SELECT COALESCE(MAX(variant), 0) + 1 FROM responses WHERE key = ?", (key,)
+                ).fetchone()[0]
+                conn.execute(
+                    "INSERT INTO responses (key, variant, text, model, created_at, used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, variant, text, model, now, now),
+                )
+                conn.execute(
+                    "DELETE FROM responses WHERE key = ? AND variant NOT IN "
+                    "(SELECT variant FROM responses WHERE key = ? ORDER BY created_at DESC, variant DESC LIMIT ?)",
+                    (key, key, self.variants),
+                )
+                conn.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses GROUP BY key "
+                    "ORDER BY MAX(used_at) DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        """Ключей и вариантов в кэше, попаданий и промахов за всё время."""
+        conn = self._connect()
+        try:
+            entries, variants = conn.execute("SELECT COUNT(DISTINCT key), COUNT(*) FROM responses").fetchone()
+            counters = dict(conn.execute("SELECT name, value FROM counters"))
+        finally:
+            conn.close()
+        return {
+            "entries": entries,
+            "variants": variants,
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+        }
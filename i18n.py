@@ -3,7 +3,7 @@
 Содержит переводы UI для всех поддерживаемых языков.
 """
 
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 # === ПЕРЕВОДЫ UI ===
 TRANSLATIONS: Dict[str, Dict[str, Any]] = {
@@ -27,6 +27,16 @@ TRANSLATIONS: Dict[str, Dict[str, Any]] = {
         'preview_btn': "🔊",
         'library_title': "📚 Мои сказки",
         'library_empty': "Пока пусто. Создайте и сохраните сказку!",
+        'library_search_placeholder': "🔍 Поиск по сказкам",
+        'library_search_empty': "Ничего не найдено",
+        'library_prev': "← Новее",
+        'library_next': "Старее →",
+        'library_filter_all_children': "👶 Все дети",
+        'library_filter_all_genres': "📖 Все жанры",
+        'library_duplicate_warn': "⚠️ В библиотеке уже есть похожая сказка: «{title}»",
+        'library_duplicate_skip': "📚 Почти такая же сказка уже сохранена: «{title}»",
+        'library_duplicate_merge': "📚 Похожая сказка «{title}» заменена новой версией",
+        'library_quota_exceeded': "📦 Библиотека заполнена (тариф: до {stories} сказок, {mb} МБ). Удалите старые сказки, чтобы сохранить новую.",
         'duration_label': "⏱️ Длительность сказки",
         'duration_short': "🐇 Короткая (~1 мин)",
         'duration_medium': "⭐ Средняя (~3 мин)",
@@ -51,6 +61,8 @@ TRANSLATIONS: Dict[str, Dict[str, Any]] = {
         'hobbies_placeholder': "Например: любит динозавров, боится темноты, хочет найти клад...",
         'hobbies_help': "Любые пожелания к сюжету или характеру героя",
         'submit_btn': "✨ Придумать сказку",
+        'fresh_story_label': "Новая сказка (не из кэша)",
+        'fresh_story_help': "Такой же запрос уже был — отметьте, чтобы Gemini придумал другую сказку",
         
         # Сообщения
         'api_key_warning': "⚠️ API ключ Google не найден в secrets.toml",
@@ -112,6 +124,16 @@ TRANSLATIONS: Dict[str, Dict[str, Any]] = {
         'preview_btn': "🔊",
         'library_title': "📚 My Stories",
         'library_empty': "Nothing yet. Create and save a story!",
+        'library_search_placeholder': "🔍 Search stories",
+        'library_search_empty': "Nothing found",
+        'library_prev': "← Newer",
+        'library_next': "Older →",
+        'library_filter_all_children': "👶 All children",
+        'library_filter_all_genres': "📖 All genres",
+        'library_duplicate_warn': "⚠️ A similar story is already in your library: “{title}”",
+        'library_duplicate_skip': "📚 An almost identical story is already saved: “{title}”",
+        'library_duplicate_merge': "📚 Similar story “{title}” was replaced with the new version",
+        'library_quota_exceeded': "📦 Your library is full (plan: up to {stories} stories, {mb} MB). Delete older stories to save this one.",
         'duration_label': "⏱️ Story Duration",
         'duration_short': "🐇 Short (~1 min)",
         'duration_medium': "⭐ Medium (~3 min)",
@@ -136,6 +158,8 @@ TRANSLATIONS: Dict[str, Dict[str, Any]] = {
         'hobbies_placeholder': "e.g., loves dinosaurs, afraid of the dark, wants to find treasure...",
         'hobbies_help': "Any wishes for the plot or character traits",
         'submit_btn': "✨ Create a Story",
+        'fresh_story_label': "New story (skip cache)",
+        'fresh_story_help': "Tick to have Gemini write a different story for a request it has already seen",
         
         # Messages
         'api_key_warning': "⚠️ Google API key not found in secrets.toml",
@@ -262,6 +286,25 @@ def get_genre_list(lang: str = 'ru') -> list:
     return []
 
 
+def get_genre_key(genre: str, lang: str = 'ru') -> Optional[str]:
+    """
+    Получить ключ жанра (например, 'fairytale') по его названию на указанном языке.
+    
+    Args:
+        genre: Название жанра из get_genre_list()
+        lang: Код языка ('ru', 'en')
+    
+    Returns:
+        Optional[str]: Ключ жанра или None, если название не найдено
+    """
+    if lang not in TRANSLATIONS:
+        lang = 'ru'
+    for key, label in TRANSLATIONS.get(lang, {}).get('genres', {}).items():
+        if label == genre:
+            return key
+    return None
+
+
 def get_age_ranges(lang: str = 'ru') -> Dict[str, float]:
     """
     Получить возрастные группы на указанном языке.
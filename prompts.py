@@ -0,0 +1,198 @@
+"""
+Промпт генерации сказки.
+
+Текст промпта собран из статичных частей, которые зависят только от языка
+интерфейса, возрастной группы и пола героя (роль, стиль, структура, финал,
+инструкция по полу), и немногих полей формы (имя, жанр, возраст, интересы,
+длина). Статичные части склеиваются в шаблон один раз на комбинацию
+(_template), а готовые промпты кэшируются по нормализованным полям формы:
+повторная генерация с теми же параметрами и перебор моделей каскада
+не собирают строку заново.
+"""
+import textwrap
+from functools import lru_cache
+from typing import Optional, Union
+
+# Возрастные группы промпта: (возраст, с которого начинается следующая группа; группа)
+AGE_BUCKETS = (
+    (1, "baby"),  # 0-12 мес
+    (4, "toddler"),  # 1-3 года
+    (8, "preschool"),  # 4-7 лет
+    (13, "school"),  # 8-12 лет
+    (18, "teen"),  # 13-17 лет
+)
+ADULT_BUCKET = "adult"  # 18+
+
+PROMPT_CACHE_SIZE = 256  # Готовых промптов в кэше процесса
+
+_GENDER_INSTRUCTIONS = {
+    "en": {
+        "boy": "The main character is a boy named {name}. Use masculine pronouns.",
+        "girl": "The main character is a girl named {name}. Use feminine pronouns.",
+        "auto": "The main character is {name}. Determine gender from the name automatically.",
+    },
+    "ru": {
+        "boy": "Главный герой - мальчик по имени {name}. Используй мужской род.",
+        "girl": "Главный герой - девочка по имени {name}. Используй женский род.",
+        "auto": "Главный герой - {name}. Определи пол по имени автоматически.",
+    },
+}
+
+# Группа -> (роль, стиль, структура, финал)
+_AGE_INSTRUCTIONS = {
+    "baby": (
+        "Ты — нежный, любящий голос родителя.",
+        """
+        Стиль: Колыбельная, ритмичная, очень простая. Много повторов, звукоподражаний.
+        Атмосфера: Тепло, уют, защита, сон.
+        Сюжет: Очень простой (герой пошел спать, звезды светят).
+        Лексика: Ультра-простая.
+        Жанр: {genre} (в адаптации для младенца).
+        Длина: Короткая, около 50-100 слов.
+        """,
+        "Структура: Убаюкивающее начало -> Плавное наблюдение -> Сонный финал.",
+        "Финал: 'Баю-бай, спи, малыш'.",
+    ),
+    "toddler": (
+        "Ты — веселый воспитатель в детском саду.",
+        """
+        Стиль: Игривый, понятный, сенсорный (цвета, звуки, тактильность).
+        Герой: {name}. Совершает простые действия (поел, погулял, нашел друга).
+        Жанр: {genre}.
+        Избегать: Сложных слов, страшных моментов.
+        Длина: Около 150 слов.
+        """,
+        "Структура: Приветствие -> Маленькое приключение -> Радостный вывод.",
+        "Финал: Позитивный и понятный.",
+    ),
+    "preschool": (
+        "Ты — сказочник Disney.",
+        """
+        Стиль: Волшебный, добрый, с моралью (но не скучной).
+        Сюжет: Классическое приключение с преодолением небольшого препятствия.
+        Жанр: {genre}.
+        Длина: Около {words} слов.
+        """,
+        "Структура: Завязка -> Испытание -> Помощь друзей -> Победа добра.",
+        "Финал: Счастливый и поучительный.",
+    ),
+    "school": (
+        "Ты — автор приключенческих книг для детей.",
+        """
+        Стиль: Динамичный, увлекательный, с диалогами и шутками.
+        Сюжет: Более сложный, с загадками или активными действиями.
+        Жанр: {genre}.
+        Длина: Около {words} слов.
+        """,
+        "Структура: Интрига -> Развитие событий -> Кульминация -> Развязка.",
+        "Финал: Вдохновляющий.",
+    ),
+    "teen": (
+        "Ты — автор популярных Young Adult романов.",
+        """
+        Стиль: Современный, эмоциональный, искренний. Без нравоучений.
+        Темы: Дружба, поиск себя, смелость, выбор.
+        Жанр: {genre}.
+        Длина: Около {words} слов.
+        """,
+        "Структура: Проблема героя -> Сложный выбор -> Решение -> Новый опыт.",
+        "Финал: Открытый или глубокий.",
+    ),
+    "adult": (
+        "Ты — мастер короткого рассказа (уровень Чехова, О. Генри или Брэдбери).",
+        """
+        ВАЖНО: Это история для ВЗРОСЛОГО ({age} лет).
+        Жанр: {genre}.
+        Контент: Строго Safe For Work (без эротики/насилия), но интеллектуально взрослый.
+        Темы: Психология, философия, ирония, ностальгия, поиск смысла, отношения (эмоциональные).
+        Стиль: Литературный, метафоричный, богатый язык.
+        Длина: Около {words} слов.
+        """,
+        "Структура: Атмосферное погружение -> Конфликт (внутренний или внешний) -> Катарсис/Осознание.",
+        "Финал: Эмоционально сильный, оставляющий послевкусие.",
+    ),
+}
+
+# Статичные части подставляются как <role> и т.п., поля формы — как {name}
+_BASE_TEMPLATE = """\
+<role>
+Задача: Напиши историю в жанре "{genre}" для читателя возраста {age} лет (категория: {age_label}).
+
+ГЛАВНЫЙ ГЕРОЙ: {name}.
+ВАЖНО ПРО ИМЯ: Используй имя героя естественно и разнообразно. Склоняй его по падежам, используй уменьшительно-ласкательные формы (если уместно для возраста/ситуации), полные или сокращенные варианты. Имя должно звучать органично в тексте, как в хорошей книге.
+
+<gender>
+Интегрируй интересы/детали: {hobbies}.
+Язык: Русский.
+
+Требования:
+1. **Название**: Креативное заглавие в первой строке.
+2. **Жанр**: Строго соответствуй выбранному жанру ({genre}).
+3. **Аудитория**: Учитывай возраст {age} лет ({age_label}). Для детей - проще, для взрослых - глубже.
+4. **Качество**: Логичный сюжет, живой язык, эмоции.
+
+<style>
+<structure>
+
+Технические детали:
+- Начни с Названия.
+- Используй абзацы.
+- <ending>
+"""
+
+
+def age_bucket(age: Union[int, float]) -> str:
+    """Возрастная группа промпта (AGE_BUCKETS) для возраста в годах."""
+    for upper, bucket in AGE_BUCKETS:
+        if age < upper:
+            return bucket
+    return ADULT_BUCKET
+
+
+@lru_cache(maxsize=None)
+def _template(lang: str, bucket: str, gender: str) -> str:
+    """Шаблон с подставленными статичными частями; остаются только поля формы."""
+    role, style, structure, ending = _AGE_INSTRUCTIONS[bucket]
+    parts = {
+        "<role>": role,
+        "<gender>": _GENDER_INSTRUCTIONS[lang][gender],
+        "<style>": textwrap.dedent(style).strip(),
+        "<structure>": structure,
+        "<ending>": ending,
+    }
+    template = _BASE_TEMPLATE
+    for marker, text in parts.items():
+        template = template.replace(marker, text)
+    return template
+
+
+@lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def _build(lang: str, bucket: str, gender: str, name: str, genre: str,
+           age: Union[int, float], age_label: str, hobbies: str, words: int) -> str:
+    return _template(lang, bucket, gender).format(
+        name=name, genre=genre, age=age, age_label=age_label, hobbies=hobbies, words=words
+    )
+
+
+def build_story_prompt(name: str, gender: str, age: Union[int, float], age_label: str, genre: str,
+                       hobbies: Optional[str], lang: str, words: int) -> str:
+    """
+    Промпт генерации сказки.
+
+    Args:
+        name: Имя героя.
+        gender: Код пола: "boy", "girl" или "auto" (любое другое значение — "auto").
+        age: Возраст читателя в годах (значение из AGE_RANGES).
+        age_label: Подпись возрастной группы из формы (например, "🧒 4-7 лет").
+        genre: Жанр, как его выбрал пользователь.
+        hobbies: Интересы героя (может быть пустым).
+        lang: Язык интерфейса: "en" — английская инструкция по полу, иначе русская.
+        words: Целевая длина сказки в словах (STORY_LENGTH_MAP).
+    """
+    lang = "en" if lang == "en" else "ru"
+    gender = gender if gender in ("boy", "girl") else "auto"
+    # Поля нормализуются до обращения к кэшу: лишние пробелы не дают промаха
+    return _build(
+        lang, age_bucket(age), gender, " ".join(name.split()), genre.strip(),
+        age, age_label, " ".join((hobbies or "").split()), words,
+    )
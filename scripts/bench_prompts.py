@@ -0,0 +1,96 @@
+"""
+Микро-бенчмарк сборки промпта (prompts.py).
+
+Измеряет три режима на полях формы для каждой возрастной группы:
+- `cold` — без кэшей: шаблон склеивается и заполняется на каждый вызов;
+- `compiled` — шаблон уже собран, заполняются только поля формы;
+- `memoized` — повтор с теми же полями (перебор моделей каскада, повторная генерация).
+
+Время — в микросекундах на вызов (медиана по повторам). Результаты
+пишутся в JSON-файл, чтобы сравнивать релизы.
+
+Запуск:
+    python scripts/bench_prompts.py
+    python scripts/bench_prompts.py --iterations 20000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import prompts  # noqa: E402
+from config import AGE_RANGES  # noqa: E402
+
+REPEATS = 5
+
+
+def _fields(age: int, i: int) -> tuple:
+    # Разные имена на каждой итерации: промахи кэша готовых промптов
+    return (f"Маша{i}", "girl", age, "🧒 4-7 лет", "Сказка", "кошки, космос", "ru", 500)
+
+
+def _per_call_us(fn, iterations: int) -> float:
+    samples = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for i in range(iterations):
+            fn(i)
+        samples.append((time.perf_counter() - start) * 1_000_000 / iterations)
+    return round(statistics.median(samples), 3)
+
+
+def measure(iterations: int) -> dict:
+    results = {}
+    for age in sorted(set(AGE_RANGES.values())):
+        bucket = prompts.age_bucket(age)
+
+        def cold(i):
+            prompts._template.cache_clear()
+            prompts._build.cache_clear()
+            prompts.build_story_prompt(*_fields(age, i))
+
+        def compiled(i):
+            prompts.build_story_prompt(*_fields(age, i))
+
+        fixed = _fields(age, 0)
+        results[bucket] = {
+            "age": age,
+            "cold_us": _per_call_us(cold, iterations),
+            "compiled_us": _per_call_us(compiled, iterations),
+            "memoized_us": _per_call_us(lambda i: prompts.build_story_prompt(*fixed), iterations),
+        }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prompt construction micro-benchmark")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--output", default="bench_prompts.json")
+    args = parser.parse_args()
+
+    results = measure(args.iterations)
+    for bucket, row in results.items():
+        print(f"{bucket:>10}: cold {row['cold_us']:.2f}us compiled {row['compiled_us']:.2f}us "
+              f"memoized {row['memoized_us']:.2f}us")
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Бенчмарк хранилища библиотеки сказок.
+
+Генерирует синтетические библиотеки (по умолчанию 1k, 10k и 100k сказок;
+1M — через --sizes) с текстами реалистичной длины из STORY_LENGTH_MAP на
+русском и английском, и для каждого бэкенда (`json`, `journal`, `sqlite`,
+`supabase` — на локальной FakeSupabase с задержкой --supabase-latency-ms)
+измеряет задержку load / list / page / get / save / delete / search и пиковый
+RSS процесса. Результаты пишутся в JSON-файл, чтобы сравнивать релизы.
+
+Каждое измерение выполняется в отдельном процессе: генерация данных не
+влияет на пиковый RSS, а кэши процесса изначально пусты.
+
+Запуск:
+    python scripts/bench_storage.py
+    python scripts/bench_storage.py --sizes 1000 1000000 --backends sqlite --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import storage  # noqa: E402
+from supabase_fake import FakeSupabase  # noqa: E402
+from config import STORY_LENGTH_MAP, STORIES_FILE, STORIES_DB_FILE  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BACKENDS = tuple(sorted(storage._BACKENDS))
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+SEED = 42
+BATCH_SIZE = 5_000  # Сказок на одну вставку при генерации SQLite-базы
+
+_RU_WORDS = (
+    "жил был однажды маленький дракон лес река солнце луна звезда принцесса "
+    "мальчик девочка кот лиса медведь заяц волшебный замок дорога друг сказка "
+    "ночь утро тихо весело добрый смелый искал нашёл улыбнулся полетел домой"
+).split()
+_EN_WORDS = (
+    "once upon a time little dragon forest river sun moon star princess boy "
+    "girl cat fox bear rabbit magic castle road friend story night morning "
+    "quietly happily kind brave looked found smiled flew home"
+).split()
+
+
+def _story(rng: random.Random, index: int, created_at: datetime) -> dict:
+    words = _RU_WORDS if index % 2 == 0 else _EN_WORDS
+    word_count = int(rng.choice(list(STORY_LENGTH_MAP.values())) * rng.uniform(0.8, 1.2))
+    return {
+        "id": f"bench-{index:08d}",
+        "title": " ".join(rng.choice(words) for _ in range(3)).capitalize(),
+        "body": " ".join(rng.choice(words) for _ in range(word_count)),
+        "created_at": created_at.isoformat(),
+    }
+
+
+def _generate(count: int, seed: int = SEED):
+    """Генерирует сказки от старых к новым (по минуте на сказку)."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        yield _story(rng, i, start + timedelta(minutes=i))
+
+
+def _generate_key(index: int) -> dict:
+    """Ключ сортировки сказки с номером index (без генерации текста)."""
+    return {
+        "id": f"bench-{index:08d}",
+        "created_at": (datetime(2024, 1, 1) + timedelta(minutes=index)).isoformat(),
+    }
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def prepare(backend: str, size: int) -> None:
+    """Записывает синтетическую библиотеку в текущий каталог (потоково, без загрузки в память)."""
+    if backend == "supabase":
+        # FakeSupabase живёт в памяти процесса — заполняется в measure()
+        return
+    if backend == "sqlite":
+        conn = sqlite3.connect(STORIES_DB_FILE)
+        try:
+            conn.executescript(storage._SQLiteStorage._SCHEMA)
+            batch = []
+            with conn:
+                for story in _generate(size):
+                    batch.append(story)
+                    if len(batch) == BATCH_SIZE:
+                        storage._import_records(conn, batch)
+                        batch = []
+                storage._import_records(conn, batch)
+        finally:
+            conn.close()
+        return
+
+    # json и journal: снимок stories.json (журнал изначально пуст)
+    with open(STORIES_FILE, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, story in enumerate(_generate(size)):
+            if i:
+                f.write(",")
+            json.dump(story, f, ensure_ascii=False)
+        f.write("]")
+
+
+def _reset_caches() -> None:
+    storage._stories_cache.clear()
+    storage._summaries_cache.clear()
+    storage._journal_states.clear()
+
+
+def _timed(fn, iterations: int, before=None) -> dict:
+    samples = []
+    for i in range(iterations):
+        if before:
+            before(i)
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "min_ms": round(samples[0], 3),
+        "iterations": iterations,
+    }
+
+
+def _fill_supabase(size: int, latency_ms: float) -> None:
+    os.environ.setdefault("SUPABASE_URL", "http://supabase.bench")
+    os.environ.setdefault("SUPABASE_KEY", "bench")
+    storage._supabase_http = FakeSupabase()
+    engine = storage._get_engine(create=True)
+    batch = []
+    for story in _generate(size):
+        batch.append(story)
+        if len(batch) == BATCH_SIZE:
+            engine._upsert_rows(batch)
+            batch = []
+    engine._upsert_rows(batch)
+    # Задержка включается только на время замеров
+    storage._supabase_http.latency = latency_ms / 1000
+
+
+def measure(backend: str, size: int, iterations: int, supabase_latency_ms: float = 0.0) -> dict:
+    """Измеряет операции над подготовленной библиотекой в текущем каталоге."""
+    storage.STORAGE_BACKEND = backend
+    if backend == "supabase":
+        _fill_supabase(size, supabase_latency_ms)
+    rss_start = _peak_rss_mb()
+    rng = random.Random(SEED + 1)
+    ids = [f"bench-{rng.randrange(size):08d}" for _ in range(iterations)]
+    middle = _generate_key(size // 2)
+    deep_cursor = storage._encode_cursor(middle)
+    new_stories = [_story(rng, size + i, datetime(2030, 1, 1) + timedelta(minutes=i)) for i in range(iterations)]
+
+    ops = {}
+    # Первая загрузка в процессе: разбор файла / чтение базы
+    ops["load_cold"] = _timed(lambda i: storage.load_stories(), iterations, before=lambda i: _reset_caches())
+    ops["load_warm"] = _timed(lambda i: storage.load_stories(), iterations)
+    ops["list_summaries"] = _timed(lambda i: storage.list_story_summaries(), iterations)
+    ops["list_first_page"] = _timed(lambda i: storage.list_stories(10), iterations)
+    ops["list_deep_page"] = _timed(lambda i: storage.list_stories(10, deep_cursor), iterations)
+    ops["get"] = _timed(lambda i: storage.get_story(ids[i]), iterations)
+
+    # Первый поиск строит FTS-индекс — отдельная разовая стоимость
+    start = time.perf_counter()
+    storage.search("дракон")
+    ops["search_index_build"] = {"median_ms": round((time.perf_counter() - start) * 1000, 3), "iterations": 1}
+    ops["search"] = _timed(lambda i: storage.search("дракон" if i % 2 == 0 else "dragon"), iterations)
+
+    ops["save_new"] = _timed(lambda i: storage.save_story(dict(new_stories[i])), iterations)
+    ops["save_update"] = _timed(
+        lambda i: storage.save_story({**new_stories[i], "title": "Updated"}), iterations
+    )
+    ops["delete"] = _timed(lambda i: storage.delete_story(new_stories[i]["id"]), iterations)
+
+    return {
+        "backend": backend,
+        "size": size,
+        "ops": ops,
+        "peak_rss_mb_start": rss_start,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _run_child(mode: str, backend: str, size: int, args, workdir: str) -> str:
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), f"--{mode}", backend, str(size),
+         "--iterations", str(args.iterations), "--supabase-latency-ms", str(args.supabase_latency_ms)],
+        cwd=workdir,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Storage benchmark for the story library")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--output", default="bench_storage.json")
+    parser.add_argument("--supabase-latency-ms", type=float, default=0.0,
+                        help="Simulated network latency per Supabase request")
+    parser.add_argument("--prepare", nargs=2, metavar=("BACKEND", "SIZE"), help=argparse.SUPPRESS)
+    parser.add_argument("--measure", nargs=2, metavar=("BACKEND", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Режимы дочерних процессов: работают в текущем (временном) каталоге
+    if args.prepare:
+        prepare(args.prepare[0], int(args.prepare[1]))
+        return
+    if args.measure:
+        print(json.dumps(measure(args.measure[0], int(args.measure[1]), args.iterations, args.supabase_latency_ms)))
+        return
+
+    results = []
+    for size in args.sizes:
+        for backend in args.backends:
+            workdir = tempfile.mkdtemp(prefix=f"bench_{backend}_{size}_")
+            try:
+                start = time.perf_counter()
+                _run_child("prepare", backend, size, args, workdir)
+                prepare_s = time.perf_counter() - start
+                result = json.loads(_run_child("measure", backend, size, args, workdir))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            result["prepare_s"] = round(prepare_s, 2)
+            results.append(result)
+            ops = result["ops"]
+            print(
+                f"{backend:>8} {size:>9,}: load {ops['load_cold']['median_ms']:.1f}ms "
+                f"page {ops['list_first_page']['median_ms']:.2f}ms "
+                f"get {ops['get']['median_ms']:.2f}ms "
+                f"save {ops['save_new']['median_ms']:.1f}ms "
+                f"delete {ops['delete']['median_ms']:.1f}ms "
+                f"rss {result['peak_rss_mb']}MB"
+            )
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "supabase_latency_ms": args.supabase_latency_ms,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Перенос общей библиотеки прежних версий (stories.json / stories.db в корне
+проекта) в личную библиотеку пользователя.
+
+С появлением пространств имён приложение читает только личные библиотеки
+(libraries/...), поэтому сказки из корня нужно один раз перенести владельцу.
+
+Запуск (из корня проекта, бэкенд берётся из config.STORAGE_BACKEND):
+    python scripts/import_legacy_library.py --namespace user:42
+
+Повторный запуск безопасен: сказки с уже существующими ID пропускаются.
+Корневая библиотека не удаляется.
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import the shared root library into a personal library")
+    parser.add_argument("--namespace", required=True, help="Target library namespace, e.g. user:<id>")
+    parser.add_argument("--overwrite", action="store_true", help="Replace stories whose IDs already exist")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    imported = storage.import_legacy_library(args.namespace, overwrite=args.overwrite)
+    print(f"Imported {imported} stories into {args.namespace}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Обновление формата сказок в библиотеке до STORY_SCHEMA_VERSION.
+
+Запуск (из корня проекта, бэкенд берётся из config.STORAGE_BACKEND):
+    python scripts/migrate_library.py
+    python scripts/migrate_library.py --namespace user:42
+
+Прерванную миграцию JSON-библиотеки достаточно запустить повторно —
+она продолжится с последней точки возобновления.
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+from config import STORY_SCHEMA_VERSION  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrate the story library to the current schema")
+    parser.add_argument("--namespace", default=None, help="Library namespace (default: shared root library)")
+    parser.add_argument("--target-version", type=int, default=STORY_SCHEMA_VERSION)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    migrated = storage.migrate_library(args.namespace, args.target_version)
+    print(f"Updated {migrated} stories to schema v{args.target_version}")
+
+
+if __name__ == "__main__":
+    main()
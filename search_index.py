@@ -0,0 +1,388 @@
+"""
+Полнотекстовый поиск по личной библиотеке сказок.
+
+Инвертированный индекс хранится в отдельной SQLite-базе (FTS5) рядом с
+библиотекой и обновляется инкрементально при каждом сохранении/удалении.
+Запрос не сканирует тела сказок: слова запроса приводятся к простой основе
+(русские и английские окончания) и ищутся как префиксы терминов индекса.
+
+Там же хранятся SimHash-отпечатки тел (fingerprint.py) с индексом по
+полосам — для поиска почти-дубликатов при сохранении, и вторичные индексы по
+параметрам генерации (INDEXED_FIELDS) — для фильтров библиотеки.
+"""
+import json
+import re
+import sqlite3
+import logging
+from typing import List, Dict, Optional, Iterable, Tuple
+
+from fingerprint import bands, hamming_distance, simhash
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_CYRILLIC_RE = re.compile(r"[а-я]")
+
+# Окончания, отбрасываемые при построении основы (длинные проверяются первыми)
+_RU_ENDINGS = sorted(
+    [
+        "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ых", "их",
+        "ая", "яя", "ое", "ее", "ие", "ые", "ой", "ей", "ий", "ый", "ую", "юю",
+        "ом", "ем", "ах", "ях", "ов", "ев", "ам", "ям", "ть", "ся", "сь",
+        "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+    ],
+    key=len,
+    reverse=True,
+)
+_EN_ENDINGS = ("ing", "ies", "es", "ed", "ly", "s")
+
+MIN_STEM_LENGTH = 3  # Основа короче не обрезается — иначе префикс совпадёт почти со всем
+MIN_TOKEN_LENGTH = 2  # Однобуквенные слова запроса игнорируются
+
+# Поля записи сказки с вторичным индексом (фильтры storage.query)
+INDEXED_FIELDS = ("child", "gender", "age_group", "genre", "lang", "voice", "model")
+
+
+def normalize(text: str) -> str:
+    """Приводит текст к виду, в котором он хранится в индексе."""
+    return text.lower().replace("ё", "е")
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на нормализованные слова."""
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def stem(token: str) -> str:
+    """
+    Лёгкий стеммер для русского и английского: отбрасывает одно окончание,
+    оставляя основу не короче MIN_STEM_LENGTH.
+
+    Примеры:
+    - stem('дракону') -> 'дракон'
+    - stem('dragons') -> 'dragon'
+    """
+    endings = _RU_ENDINGS if _CYRILLIC_RE.search(token) else _EN_ENDINGS
+    for ending in endings:
+        if token.endswith(ending) and len(token) - len(ending) >= MIN_STEM_LENGTH:
+            return token[:-len(ending)]
+    return token
+
+
+def tag_value(value) -> str:
+    """Значение поля в виде, в котором оно хранится во вторичном индексе."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return normalize(str(value)).strip()
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    Строит FTS5-выражение: все слова запроса (AND), каждое — как префикс основы.
+    Возвращает None, если в запросе нет пригодных слов.
+    """
+    terms = [stem(token) for token in tokenize(query) if len(token) >= MIN_TOKEN_LENGTH]
+    if not terms:
+        return None
+    # Токены состоят только из \w, поэтому кавычки внутри невозможны
+    return " AND ".join(f'"{term}"*' for term in terms)
+
+
+class SearchIndex:
+    """
+    FTS5-индекс по названию и телу сказок.
+
+    `story_docs` сопоставляет ID сказки с rowid в `story_fts`, чтобы обновление
+    и удаление одной сказки не требовали сканирования индекса. В `search_meta`
+    хранится сигнатура библиотеки, по которой индекс был построен.
+
+    `story_fingerprints` и `story_bands` — отпечатки тел и их полосы: поиск
+    почти-дубликата читает по индексу только сказки с совпавшей полосой.
+    `story_tags` — вторичный индекс (поле, значение) -> ID по INDEXED_FIELDS.
+
+    Ранжирование дешёвое и не зависит от числа совпадений: сначала сказки с
+    совпадением в названии, затем — в тексте; внутри группы новые сверху
+    (rowid растёт с каждой индексацией). Префиксный индекс FTS5 (`prefix`)
+    делает префиксные запросы такими же быстрыми, как точные.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS story_docs (
+            rowid INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            title TEXT NOT NULL DEFAULT '',
+            created_at TEXT NOT NULL DEFAULT ''
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS story_fts USING fts5(
+            title, body,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3 4 5 6 7 8'
+        );
+        CREATE TABLE IF NOT EXISTS search_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS story_fingerprints (
+            id TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS story_bands (
+            band INTEGER NOT NULL,
+            value INTEGER NOT NULL,
+            id TEXT NOT NULL,
+            PRIMARY KEY (band, value, id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS story_tags (
+            field TEXT NOT NULL,
+            value TEXT NOT NULL,
+            id TEXT NOT NULL,
+            PRIMARY KEY (field, value, id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_story_tags_id ON story_tags (id);
+        CREATE INDEX IF NOT EXISTS idx_story_docs_order ON story_docs (created_at, id);
+    """
+    # Версия структуры индекса: индекс старой версии перестраивается целиком
+    # (так у сказок из прежних версий появляются отпечатки)
+    VERSION = 3
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.executescript(self._SCHEMA)
+        return conn
+
+    def is_synced(self, source_signature) -> bool:
+        """
+        Проверяет, построен ли индекс по библиотеке с указанной сигнатурой.
+        Сигнатура None (библиотека недоступна) актуальной не считается никогда.
+        """
+        if source_signature is None:
+            return False
+        conn = self._connect()
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM search_meta"))
+        finally:
+            conn.close()
+        return meta.get("source") == json.dumps(source_signature) and meta.get("version") == str(self.VERSION)
+
+    def upsert(self, story: Dict, source_signature) -> None:
+        """Индексирует (или переиндексирует) одну сказку."""
+        conn = self._connect()
+        try:
+            with conn:
+                self._delete(conn, story["id"])
+                self._insert(conn, story)
+                self._set_source(conn, source_signature)
+        finally:
+            conn.close()
+
+    def delete(self, story_id: str, source_signature) -> None:
+        """Удаляет сказку из индекса."""
+        conn = self._connect()
+        try:
+            with conn:
+                self._delete(conn, story_id)
+                self._set_source(conn, source_signature)
+        finally:
+            conn.close()
+
+    def touch(self, source_signature) -> None:
+        """Отмечает индекс актуальным для новой сигнатуры (тексты сказок не менялись)."""
+        conn = self._connect()
+        try:
+            with conn:
+                self._set_source(conn, source_signature)
+        finally:
+            conn.close()
+
+    def rebuild(self, stories: Iterable[Dict], source_signature) -> None:
+        """Полностью перестраивает индекс по списку сказок."""
+        # Старые сказки индексируются первыми, чтобы у новых был больший rowid
+        ordered = sorted(stories, key=lambda x: x.get("created_at", ""))
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM story_docs")
+                conn.execute("DELETE FROM story_fts")
+                conn.execute("DELETE FROM story_fingerprints")
+                conn.execute("DELETE FROM story_bands")
+                conn.execute("DELETE FROM story_tags")
+                count = 0
+                for story in ordered:
+                    if story.get("id"):
+                        self._insert(conn, story)
+                        count += 1
+                self._set_source(conn, source_signature)
+                conn.execute(
+                    "INSERT OR REPLACE INTO search_meta (key, value) VALUES ('version', ?)", (str(self.VERSION),)
+                )
+        finally:
+            conn.close()
+        logger.info(f"Rebuilt search index {self.path}: {count} stories")
+
+    def search(self, query: str, limit: int = 20) -> List[Dict]:
+        """
+        Ищет сказки, содержащие все слова запроса (по префиксу основы).
+        Возвращает метаданные (id, title, created_at), лучшие совпадения сверху.
+        """
+        match = build_match_query(query)
+        if match is None:
+            return []
+        conn = self._connect()
+        try:
+            # Сначала совпадения в названии, затем добор совпадениями в тексте
+            rows = self._match(conn, f"{{title}} : ({match})", limit)
+            if len(rows) < limit:
+                seen = {r[0] for r in rows}
+                rows += [r for r in self._match(conn, match, limit + len(rows)) if r[0] not in seen]
+        finally:
+            conn.close()
+        return [{"id": r[0], "title": r[1], "created_at": r[2]} for r in rows[:limit]]
+
+    def find_similar(self, fingerprint: int, max_distance: int,
+                     exclude: Optional[str] = None) -> List[Dict]:
+        """
+        Ищет сказки, отпечаток которых отличается не больше чем в max_distance битах.
+
+        Кандидаты — сказки хотя бы с одной совпавшей полосой, поэтому все
+        совпадения гарантированно находятся при max_distance < fingerprint.BANDS.
+        Возвращает метаданные (id, title, created_at, distance), ближайшие сверху.
+        """
+        conn = self._connect()
+        try:
+            candidates = {}
+            for band, value in enumerate(bands(fingerprint)):
+                for story_id, stored in conn.execute(
+                    """
+                    SELECT f.id, f.fingerprint
+                    FROM story_bands b
+                    JOIN story_fingerprints f ON f.id = b.id
+                    WHERE b.band = ? AND b.value = ?
+                    """,
+                    (band, value),
+                ):
+                    candidates[story_id] = int(stored, 16)
+            close = {
+                story_id: hamming_distance(fingerprint, stored)
+                for story_id, stored in candidates.items() if story_id != exclude
+            }
+            close = {story_id: d for story_id, d in close.items() if d <= max_distance}
+            rows = [
+                conn.execute("SELECT id, title, created_at FROM story_docs WHERE id = ?", (story_id,)).fetchone()
+                for story_id in close
+            ]
+        finally:
+            conn.close()
+        matches = [
+            {"id": row[0], "title": row[1], "created_at": row[2], "distance": close[row[0]]}
+            for row in rows if row is not None
+        ]
+        matches.sort(key=lambda m: (m["distance"], m["created_at"]))
+        return matches
+
+    def query(self, filters: Dict[str, str], limit: int,
+              after: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        """
+        Сказки, у которых все поля filters равны заданным значениям (новые сверху).
+
+        Каждое условие — поиск по первичному ключу `story_tags`; тела и
+        остальные сказки не читаются. after — ключ (created_at, id) последней
+        сказки предыдущей страницы.
+
+        Returns:
+            List[Dict]: Метаданные (id, title, created_at), не больше limit.
+        """
+        conditions, params = [], []
+        for field, value in filters.items():
+            conditions.append("d.id IN (SELECT id FROM story_tags WHERE field = ? AND value = ?)")
+            params += [field, tag_value(value)]
+        if after is not None:
+            conditions.append("(d.created_at, d.id) < (?, ?)")
+            params += list(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT d.id, d.title, d.created_at FROM story_docs d {where} "
+                "ORDER BY d.created_at DESC, d.id DESC LIMIT ?",
+                params + [limit],
+            ).fetchall()
+        finally:
+            conn.close()
+        return [{"id": r[0], "title": r[1], "created_at": r[2]} for r in rows]
+
+    def facets(self, field: str) -> Dict[str, int]:
+        """Значения поля в библиотеке и число сказок с каждым (для фильтров)."""
+        conn = self._connect()
+        try:
+            return dict(conn.execute(
+                "SELECT value, COUNT(*) FROM story_tags WHERE field = ? GROUP BY value ORDER BY value", (field,)
+            ))
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _match(conn: sqlite3.Connection, match: str, limit: int) -> List[tuple]:
+        return conn.execute(
+            """
+            SELECT d.id, d.title, d.created_at
+            FROM story_fts
+            JOIN story_docs d ON d.rowid = story_fts.rowid
+            WHERE story_fts MATCH ?
+            ORDER BY story_fts.rowid DESC
+            LIMIT ?
+            """,
+            (match, limit),
+        ).fetchall()
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, story: Dict) -> None:
+        cursor = conn.execute(
+            "INSERT INTO story_docs (id, title, created_at) VALUES (?, ?, ?)",
+            (story["id"], story.get("title", ""), story.get("created_at", "")),
+        )
+        conn.execute(
+            "INSERT INTO story_fts (rowid, title, body) VALUES (?, ?, ?)",
+            (cursor.lastrowid, normalize(story.get("title", "")), normalize(story.get("body", ""))),
+        )
+        tags = [
+            (field, tag_value(story[field]), story["id"])
+            for field in INDEXED_FIELDS if story.get(field) not in (None, "")
+        ]
+        conn.executemany("INSERT INTO story_tags (field, value, id) VALUES (?, ?, ?)", tags)
+        fingerprint = simhash(tokenize(story.get("body", "")))
+        if fingerprint is not None:
+            # TEXT: 64-битный отпечаток не помещается в знаковый INTEGER SQLite
+            conn.execute(
+                "INSERT INTO story_fingerprints (id, fingerprint) VALUES (?, ?)",
+                (story["id"], format(fingerprint, "016x")),
+            )
+            conn.executemany(
+                "INSERT INTO story_bands (band, value, id) VALUES (?, ?, ?)",
+                [(band, value, story["id"]) for band, value in enumerate(bands(fingerprint))],
+            )
+
+    @staticmethod
+    def _delete(conn: sqlite3.Connection, story_id: str) -> None:
+        row = conn.execute("SELECT rowid FROM story_docs WHERE id = ?", (story_id,)).fetchone()
+        if row:
+            conn.execute("DELETE FROM story_fts WHERE rowid = ?", (row[0],))
+            conn.execute("DELETE FROM story_docs WHERE rowid = ?", (row[0],))
+        conn.execute("DELETE FROM story_tags WHERE id = ?", (story_id,))
+        stored = conn.execute("SELECT fingerprint FROM story_fingerprints WHERE id = ?", (story_id,)).fetchone()
+        if stored:
+            conn.execute("DELETE FROM story_fingerprints WHERE id = ?", (story_id,))
+            conn.executemany(
+                "DELETE FROM story_bands WHERE band = ? AND value = ? AND id = ?",
+                [(band, value, story_id) for band, value in enumerate(bands(int(stored[0], 16)))],
+            )
+
+    @staticmethod
+    def _set_source(conn: sqlite3.Connection, source_signature) -> None:
+        conn.execute(
+            "INSERT INTO search_meta (key, value) VALUES ('source', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (json.dumps(source_signature),),
+        )
@@ -0,0 +1,138 @@
+"""
+Снимок библиотеки только для чтения, открываемый через mmap.
+
+Два файла рядом с библиотекой:
+- `stories.snapshot.bin` — идентификатор сборки и подряд записанные
+  UTF-8 тела сказок и JSON их остальных полей;
+- `stories.snapshot.idx` — заголовок и записи фиксированной ширины:
+  смещения/длины в порядке библиотеки (новые сверху) и отсортированная
+  по хэшу ID таблица поиска.
+
+get() находит сказку двоичным поиском по таблице и вырезает байты одной
+записи из mmap, не разбирая остальные. Файлы отображаются в память только
+для чтения, поэтому несколько процессов-воркеров делят одни страницы
+page cache. Снимок помнит сигнатуру библиотеки, из которой собран:
+storage использует его, только пока сигнатура совпадает.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"STSN"
+_FORMAT_VERSION = 1
+# magic, версия формата, число сказок, размер .bin, ID сборки, sha256 сигнатуры источника
+_HEADER = struct.Struct("<4sHxxIQ16s32s")
+# Смещение и длина JSON полей, смещение и длина тела
+_ENTRY = struct.Struct("<QIQI")
+# Хэш ID, номер записи
+_LOOKUP = struct.Struct("<QI")
+
+
+def source_digest(source_signature) -> bytes:
+    """sha256 сигнатуры библиотеки (любое JSON-сериализуемое значение)."""
+    return hashlib.sha256(json.dumps(source_signature).encode("utf-8")).digest()
+
+
+def _id_hash(story_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(story_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def encode_snapshot(records: List[Dict], source_signature) -> Tuple[bytes, bytes]:
+    """
+    Содержимое файлов снимка (.bin, .idx) для записей (в порядке библиотеки)
+    и сигнатуры источника.
+
+    Файлы записывает storage (атомарной заменой каждого); .bin и .idx связаны
+    ID сборки, поэтому читатель, заставший новый .idx со старым .bin, просто
+    не использует снимок.
+    """
+    build_id = os.urandom(16)
+    data, entries, offset = [build_id], [], len(build_id)
+    for record in records:
+        meta = json.dumps({k: v for k, v in record.items() if k != "body"}, ensure_ascii=False).encode("utf-8")
+        body = (record.get("body") or "").encode("utf-8")
+        entries.append(_ENTRY.pack(offset, len(meta), offset + len(meta), len(body)))
+        data += [meta, body]
+        offset += len(meta) + len(body)
+    lookup = sorted((_id_hash(r.get("id", "")), i) for i, r in enumerate(records))
+    header = _HEADER.pack(_MAGIC, _FORMAT_VERSION, len(records), offset, build_id, source_digest(source_signature))
+    return b"".join(data), b"".join([header] + entries + [_LOOKUP.pack(h, i) for h, i in lookup])
+
+
+class LibrarySnapshot:
+    """Открытый снимок: mmap обоих файлов и методы чтения без полного разбора."""
+
+    def __init__(self, bodies: mmap.mmap, index: mmap.mmap, count: int, source: bytes):
+        self._bodies = bodies
+        self._index = index
+        self.count = count
+        self.source = source
+        self._lookup_start = _HEADER.size + count * _ENTRY.size
+
+    @classmethod
+    def open(cls, bodies_path: str, index_path: str) -> Optional["LibrarySnapshot"]:
+        """Открывает снимок; None, если его нет или файлы от разных сборок."""
+        try:
+            with open(index_path, "rb") as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            with open(bodies_path, "rb") as f:
+                bodies = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            magic, version, count, size, build_id, source = _HEADER.unpack_from(index, 0)
+        except struct.error:
+            magic = None
+        if (
+            magic != _MAGIC or version != _FORMAT_VERSION or len(bodies) != size
+            or bodies[:16] != build_id
+            or len(index) != _HEADER.size + count * (_ENTRY.size + _LOOKUP.size)
+        ):
+            logger.warning(f"Ignoring inconsistent library snapshot {index_path}")
+            bodies.close()
+            index.close()
+            return None
+        return cls(bodies, index, count, source)
+
+    def close(self) -> None:
+        self._bodies.close()
+        self._index.close()
+
+    def _record(self, position: int) -> Dict:
+        meta_offset, meta_length, body_offset, body_length = _ENTRY.unpack_from(
+            self._index, _HEADER.size + position * _ENTRY.size
+        )
+        record = json.loads(self._bodies[meta_offset:meta_offset + meta_length])
+        record["body"] = self._bodies[body_offset:body_offset + body_length].decode("utf-8")
+        return record
+
+    def get(self, story_id: str) -> Optional[Dict]:
+        """Сказка по ID: двоичный поиск по таблице хэшей и разбор одной записи."""
+        target = _id_hash(story_id)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if _LOOKUP.unpack_from(self._index, self._lookup_start + middle * _LOOKUP.size)[0] < target:
+                low = middle + 1
+            else:
+                high = middle
+        # Соседние записи с тем же хэшем — коллизии, сверяем сам ID
+        while low < self.count:
+            value, position = _LOOKUP.unpack_from(self._index, self._lookup_start + low * _LOOKUP.size)
+            if value != target:
+                break
+            record = self._record(position)
+            if record.get("id") == story_id:
+                return record
+            low += 1
+        return None
+
+    def load_all(self) -> List[Dict]:
+        """Все сказки в порядке библиотеки (новые сверху)."""
+        return [self._record(position) for position in range(self.count)]
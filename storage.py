@@ -1,68 +1,2678 @@
+import atexit
+import base64
+import codecs
+import copy
+import hashlib
 import json
 import os
-from datetime import datetime
+import sqlite3
+import logging
+import re
+import shutil
+import threading
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import uuid
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Protocol, Tuple, Union, runtime_checkable
+import requests
 import streamlit as st
 
-from config import STORIES_FILE
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
-def load_stories() -> List[Dict]:
-    """Загружает список сохраненных сказок из локального JSON файла."""
-    if not os.path.exists(STORIES_FILE):
-        return []
+from search_index import INDEXED_FIELDS, SearchIndex, tokenize
+from cold_store import ColdStore
+from fingerprint import hamming_distance, simhash
+from snapshot import LibrarySnapshot, encode_snapshot, source_digest
+from story import Story
+from config import (
+    STORIES_FILE,
+    STORIES_DB_FILE,
+    STORIES_JOURNAL_FILE,
+    STORIES_INDEX_FILE,
+    STORIES_SEARCH_FILE,
+    STORIES_COLD_FILE,
+    STORIES_ACCESS_LOG_FILE,
+    STORIES_PLAN_FILE,
+    STORIES_SNAPSHOT_BODIES_FILE,
+    STORIES_SNAPSHOT_INDEX_FILE,
+    STORIES_VERSION_FILE,
+    STORIES_NAMESPACE_FILE,
+    LIBRARIES_DIR,
+    GUEST_LIBRARY_TTL,
+    GUEST_LIBRARY_SWEEP_INTERVAL,
+    STORAGE_BACKEND,
+    JOURNAL_COMPACT_BYTES,
+    JOURNAL_COMPACT_MIN_BYTES,
+    JOURNAL_COMPACT_RATIO,
+    STORY_SCHEMA_VERSION,
+    MIGRATION_CHECKPOINT_RECORDS,
+    LIBRARY_COLD_TIER,
+    COLD_TIER_AGE_DAYS,
+    COLD_TIER_SWEEP_INTERVAL,
+    SUPABASE_STORIES_TABLE,
+    SUPABASE_TIMEOUT,
+    SUPABASE_PAGE_SIZE,
+    WRITE_BEHIND,
+    WRITE_BEHIND_WINDOW,
+    LIBRARY_SNAPSHOT,
+    LIBRARY_CHANGE_FEED,
+    LIBRARY_VIEW_CACHE_SIZE,
+    LIBRARY_CACHE_SIZE,
+    DUPLICATE_POLICY,
+    DUPLICATE_MAX_DISTANCE,
+    PLAN_QUOTAS,
+    QUOTA_AUTO_EVICT,
+    QUOTA_EVICTION,
+    QUOTA_REAP_DELAY,
+    QUOTA_REAP_BATCH,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Кэш распарсенных JSON-библиотек, общий для всех сессий процесса:
+# путь -> ((mtime_ns, size, inode), отсортированный список сказок Story).
+# Пока файл не менялся, повторный load_stories() стоит одного stat().
+_stories_cache: Dict[str, Tuple[Tuple[int, int, int], List[Story]]] = {}
+_stories_cache_lock = threading.Lock()
+
+
+# Кэши процесса по библиотекам — LRU на обычном dict (порядок вставки):
+# у каждого пользователя и гостя своя библиотека, и без предела кэши росли бы
+# вместе с их числом. Вызывать под блокировкой кэша.
+
+def _cache_get(cache: Dict, key):
+    """Значение из кэша (None — нет); найденное становится самым свежим."""
+    value = cache.pop(key, None)
+    if value is not None:
+        cache[key] = value
+    return value
+
+
+def _cache_put(cache: Dict, key, value, limit: Optional[int] = None) -> None:
+    """Кладёт значение и вытесняет самые давние записи сверх limit (по умолчанию LIBRARY_CACHE_SIZE)."""
+    limit = LIBRARY_CACHE_SIZE if limit is None else limit
+    cache.pop(key, None)
+    cache[key] = value
+    while len(cache) > limit:
+        del cache[next(iter(cache))]
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """Возвращает (mtime_ns, size, inode) файла или None, если файла нет."""
     try:
-        with open(STORIES_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            # Сортировка по дате создания (новые сверху)
-            data.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-            return data
-    except (json.JSONDecodeError, OSError):
-        return []
+        st_result = os.stat(path)
+    except OSError:
+        return None
+    return (st_result.st_mtime_ns, st_result.st_size, st_result.st_ino)
+
+
+def _invalidate_cache(path: str) -> None:
+    """Сбрасывает закэшированную библиотеку для указанного файла."""
+    with _stories_cache_lock:
+        _stories_cache.pop(os.path.abspath(path), None)
+
+
+def _fsync_dir(path: str) -> None:
+    """Сбрасывает на диск запись каталога (переименование файла) — только POSIX."""
+    if fcntl is None:
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    """
+    Атомарно заменяет файл: запись во временный файл рядом, fsync, rename.
+    Читатели видят либо старую, либо новую версию целиком — никогда не «рваную».
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(path)
+
+
+def _atomic_write_json(path: str, data, **dump_kwargs) -> None:
+    _atomic_write(path, json.dumps(data, ensure_ascii=False, **dump_kwargs).encode("utf-8"))
+
+
+@contextmanager
+def _file_lock(path: str):
+    """
+    Эксклюзивная advisory-блокировка `<path>.lock` на время read-modify-write.
+
+    Работает между процессами (и между потоками: каждый вызов открывает свой
+    дескриптор). Читатели блокировку не берут — они полагаются на атомарную замену.
+    """
+    with open(path + ".lock", "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Поля, которых достаточно для списка в сайдбаре (без тела сказки)
+SUMMARY_FIELDS = ("id", "title", "created_at")
+
+# Кэш компактных индексов JSON-библиотек (LRU): путь stories.json -> (сигнатура stories.json, сводки)
+_summaries_cache: Dict[str, Tuple[Tuple[int, int, int], List[Dict]]] = {}
+
+
+def _summary(record: Dict) -> Dict:
+    """Возвращает метаданные сказки без тела."""
+    return {k: record.get(k, "") for k in SUMMARY_FIELDS}
+
+
+def _sort_key(record: Dict) -> Tuple[str, str]:
+    """Порядок библиотеки: по дате создания, при равенстве — по ID (новые сверху)."""
+    return (record.get("created_at", ""), record.get("id", ""))
+
+
+def _encode_cursor(record: Dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(_sort_key(record))).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        created_at, story_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid library cursor: {cursor!r}") from e
+    return (created_at, story_id)
+
+
+def _page_after(items: List, limit: int, after: Optional[Tuple[str, str]], key=_sort_key) -> List:
+    """
+    Возвращает до `limit` элементов, идущих строго после ключа `after`.
+    `items` отсортированы по убыванию key (_sort_key для словарей,
+    Story.sort_key для Story) — позиция ищется бинарным поиском.
+    """
+    start = 0
+    if after is not None:
+        lo, hi = 0, len(items)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key(items[mid]) < after:
+                hi = mid
+            else:
+                lo = mid + 1
+        start = lo
+    return items[start:start + limit]
+
+
+@runtime_checkable
+class StorageBackend(Protocol):
+    """
+    Движок хранения библиотеки одного пространства имён.
+
+    Реализации выбираются по config.STORAGE_BACKEND (см. _BACKENDS):
+    _JsonStorage, _JournalStorage, _SQLiteStorage и _SupabaseStorage.
+    Публичные функции модуля работают только через этот интерфейс, а
+    поисковый индекс и холодный слой хранятся рядом и от движка не зависят.
+    """
+
+    def load_all(self) -> List[Dict]:
+        """Все сказки, новые сверху (копии — их можно изменять)."""
+
+    def get(self, story_id: str) -> Optional[Dict]:
+        """Сказка по ID или None."""
+
+    def list_summaries(self) -> List[Dict]:
+        """SUMMARY_FIELDS всех сказок, новые сверху."""
+
+    def list_page(self, limit: int, after: Optional[Tuple[str, str]]) -> List[Dict]:
+        """До limit сводок строго после ключа after = (created_at, id)."""
+
+    def signature(self):
+        """
+        Значение, меняющееся при любой записи (JSON-сериализуемое);
+        None — хранилище недоступно и состояние библиотеки неизвестно.
+        """
+
+    def upsert(self, record: Dict) -> None:
+        """Сохраняет запись (новую или с существующим ID)."""
+
+    def delete(self, story_id: str) -> None:
+        """Удаляет запись; отсутствующий ID — не ошибка."""
+
+    def write_batch(self, upserts: List[Dict], deletes: List[str]) -> None:
+        """Сохраняет и удаляет пакет записей одной операцией; ошибки пробрасываются."""
+
+    def rewrite(self, update: Callable[[Dict], Optional[Dict]]) -> int:
+        """Применяет update ко всем записям, сохраняет изменённые; возвращает их число."""
+
+    def migrate(self, target_version: int) -> int:
+        """Приводит все записи к target_version; возвращает число обновлённых."""
+
+
+class _JsonStorage:
+    """
+    Хранилище сказок в одном JSON файле (исходный формат библиотеки).
+
+    Рядом с ним ведётся компактный индекс `stories.index.json` (только
+    SUMMARY_FIELDS), чтобы список библиотеки не требовал разбора тел.
+    Индекс помнит сигнатуру stories.json, из которой построен, и
+    перестраивается, если файл изменили в обход API.
+    """
+
+    def __init__(self, path: str, index_path: Optional[str] = None):
+        self.path = path
+        self.index_path = index_path
+
+    def _read_cached(self, strict: bool = False) -> List[Story]:
+        """
+        Возвращает список сказок (Story) из кэша процесса, перечитывая файл
+        только при изменении его сигнатуры. Результат разделяется между
+        сессиями — не изменять на месте.
+
+        При strict=True повреждённый файл вызывает исключение вместо пустого
+        списка: пути записи не должны затирать библиотеку, которую не смогли прочитать.
+        """
+        key = os.path.abspath(self.path)
+        signature = _file_signature(self.path)
+        if signature is None:
+            _invalidate_cache(self.path)
+            return []
+
+        with _stories_cache_lock:
+            cached = _cache_get(_stories_cache, key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Failed to read stories from {self.path}: {e}")
+            if strict:
+                raise
+            return []
+        # Story со __slots__ вместо словарей: кэш большой библиотеки в разы компактнее
+        data = sorted((Story.from_dict(record) for record in data), key=Story.sort_key, reverse=True)
+
+        with _stories_cache_lock:
+            _cache_put(_stories_cache, key, (signature, data))
+        return data
+
+    def load_all(self) -> List[Dict]:
+        # Новые словари: вызывающий код дописывает поля (например, audio)
+        return [s.to_dict() for s in self._read_cached()]
+
+    def get(self, story_id: str) -> Optional[Dict]:
+        found = next((s for s in self._read_cached() if s.id == story_id), None)
+        return found.to_dict() if found is not None else None
+
+    def signature(self):
+        """Сигнатура содержимого библиотеки: меняется при любой записи."""
+        return _file_signature(self.path)
+
+    def _summaries_cached(self) -> List[Dict]:
+        """Сводки из кэша процесса (общие для всех сессий — не изменять)."""
+        source_signature = _file_signature(self.path)
+        if source_signature is None:
+            return []
+        key = os.path.abspath(self.path)
+        with _stories_cache_lock:
+            cached = _cache_get(_summaries_cache, key)
+        if cached is not None and cached[0] == source_signature:
+            return cached[1]
+
+        summaries = self._read_index(source_signature)
+        if summaries is None:
+            # Индекса нет или он устарел — строим заново из полного файла
+            summaries = [s.summary() for s in self._read_cached()]
+            if self.index_path:
+                self._write_index(summaries, source_signature)
+
+        with _stories_cache_lock:
+            _cache_put(_summaries_cache, key, (source_signature, summaries))
+        return summaries
+
+    def list_summaries(self) -> List[Dict]:
+        return [dict(s) for s in self._summaries_cached()]
+
+    def list_page(self, limit: int, after: Optional[Tuple[str, str]]) -> List[Dict]:
+        return [dict(s) for s in _page_after(self._summaries_cached(), limit, after)]
+
+    def _read_index(self, source_signature) -> Optional[List[Dict]]:
+        if not self.index_path or not os.path.exists(self.index_path):
+            return None
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return None
+        if index.get("source") != list(source_signature):
+            return None
+        return index.get("stories", [])
+
+    def _write_index(self, summaries: List[Dict], source_signature) -> None:
+        try:
+            _atomic_write_json(self.index_path, {"source": list(source_signature), "stories": summaries})
+        except OSError as e:
+            # Индекс вторичен: при следующем чтении он будет перестроен
+            logger.warning(f"Failed to write library index {self.index_path}: {e}")
+
+    def upsert(self, record: Dict) -> None:
+        try:
+            # Блокировка на весь read-modify-write: параллельные сохранения не теряют сказки
+            with _file_lock(self.path):
+                stories = [s.to_dict() for s in self._read_cached(strict=True)]
+
+                # Проверка на существование (обновление)
+                existing_index = next((i for i, s in enumerate(stories) if s.get("id") == record["id"]), -1)
+
+                if existing_index >= 0:
+                    stories[existing_index] = record
+                else:
+                    stories.insert(0, record)  # Добавляем в начало
+
+                self._write(stories)
+        except (OSError, ValueError) as e:
+            st.error(f"Ошибка сохранения: {e}")
+
+    def delete(self, story_id: str) -> None:
+        try:
+            with _file_lock(self.path):
+                stories = self._read_cached(strict=True)
+                remaining = [s.to_dict() for s in stories if s.id != story_id]
+
+                if len(remaining) < len(stories):
+                    self._write(remaining)
+        except (OSError, ValueError) as e:
+            st.error(f"Ошибка удаления: {e}")
+
+    def write_batch(self, upserts: List[Dict], deletes: List[str]) -> None:
+        with _file_lock(self.path):
+            changed = {r["id"]: r for r in upserts}
+            doomed = set(deletes)
+            stories = [
+                changed.pop(s.id) if s.id in changed else s.to_dict()
+                for s in self._read_cached(strict=True) if s.id not in doomed
+            ]
+            # Оставшиеся в changed — новые сказки, они идут в начало
+            self._write(list(changed.values()) + stories)
+
+    def rewrite(self, update) -> int:
+        """
+        Применяет update(запись) -> новая запись или None (без изменений) ко
+        всей библиотеке под блокировкой и сохраняет изменения одной записью файла.
+        """
+        with _file_lock(self.path):
+            stories = [s.to_dict() for s in self._read_cached(strict=True)]
+            changed = 0
+            for i, record in enumerate(stories):
+                updated = update(record)
+                if updated is not None:
+                    stories[i] = updated
+                    changed += 1
+            if changed:
+                self._write(stories)
+        return changed
+
+    def migrate(self, target_version: int) -> int:
+        with _file_lock(self.path):
+            try:
+                return _migrate_json_file(self.path, target_version)
+            finally:
+                _invalidate_cache(self.path)
+
+    def _write(self, stories: List[Dict]) -> None:
+        try:
+            _atomic_write_json(self.path, stories, indent=4)
+        finally:
+            _invalidate_cache(self.path)
+        if self.index_path:
+            summaries = sorted((_summary(s) for s in stories), key=_sort_key, reverse=True)
+            self._write_index(summaries, _file_signature(self.path))
+        if LIBRARY_SNAPSHOT:
+            _write_library_snapshot(os.path.dirname(self.path),
+                                    sorted(stories, key=_sort_key, reverse=True), self.signature())
+
+
+class _JournalState:
+    """Библиотека, восстановленная из снимка и прочитанной части журнала."""
+
+    def __init__(self, snapshot_signature, journal_inode: Optional[int], records: Dict[str, Story]):
+        self.snapshot_signature = snapshot_signature
+        self.journal_inode = journal_inode
+        self.offset = 0  # Байт журнала, до которого записи уже применены
+        self.records = records
+        self.sorted: Optional[List[Story]] = None
+
+
+# Состояние журнальных библиотек процесса: путь журнала -> _JournalState (LRU).
+# Защищено одной блокировкой вместе с дозаписью и компактизацией.
+_journal_states: Dict[str, _JournalState] = {}
+_journal_lock = threading.RLock()
+_compacting: set = set()
+
+
+class _JournalStorage:
+    """
+    Журнальный режим: снимок `stories.json` + NDJSON-журнал изменений.
+
+    `upsert`/`delete` дописывают одну строку (`{"op": "upsert", "story": ...}`
+    или `{"op": "delete", "id": ...}`) и делают fsync — запись стоит O(1)
+    и переживает падение процесса. Библиотека = снимок + воспроизведение
+    журнала; недописанная последняя строка игнорируется. Когда журнал
+    разрастается, фоновый поток сворачивает его в новый снимок.
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: str):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+
+    def _state(self) -> _JournalState:
+        """Возвращает актуальное состояние, дочитывая журнал с последнего смещения."""
+        key = os.path.abspath(self.journal_path)
+        snapshot = _JsonStorage(self.snapshot_path)
+        with _journal_lock:
+            snapshot_signature = _file_signature(self.snapshot_path)
+            journal_signature = _file_signature(self.journal_path)
+            journal_inode = journal_signature[2] if journal_signature else None
+            journal_size = journal_signature[1] if journal_signature else 0
+
+            state = _cache_get(_journal_states, key)
+            if (
+                state is None
+                or state.snapshot_signature != snapshot_signature
+                or state.journal_inode != journal_inode
+                or journal_size < state.offset
+            ):
+                records = {s.id: s for s in snapshot._read_cached() if s.id}
+                state = _JournalState(snapshot_signature, journal_inode, records)
+                _cache_put(_journal_states, key, state)
+
+            if journal_size > state.offset:
+                self._replay(state)
+            return state
+
+    def _replay(self, state: _JournalState) -> None:
+        """Применяет к состоянию новые полные строки журнала."""
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(state.offset)
+                chunk = f.read()
+        except OSError as e:
+            logger.error(f"Failed to read journal {self.journal_path}: {e}")
+            return
+
+        # Хвост без перевода строки — недописанная запись, её не трогаем
+        complete = chunk[:chunk.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping corrupt journal record in {self.journal_path}")
+                continue
+            if entry.get("op") == "upsert" and entry.get("story", {}).get("id"):
+                state.records[entry["story"]["id"]] = Story.from_dict(entry["story"])
+            elif entry.get("op") == "delete":
+                state.records.pop(entry.get("id"), None)
+        state.offset += len(complete)
+        state.sorted = None
+
+    def _sorted(self) -> List[Story]:
+        state = self._state()
+        with _journal_lock:
+            if state.sorted is None:
+                state.sorted = sorted(
+                    state.records.values(), key=Story.sort_key, reverse=True
+                )
+            return state.sorted
+
+    def load_all(self) -> List[Dict]:
+        return [s.to_dict() for s in self._sorted()]
+
+    def get(self, story_id: str) -> Optional[Dict]:
+        found = self._state().records.get(story_id)
+        return found.to_dict() if found is not None else None
+
+    def list_summaries(self) -> List[Dict]:
+        return [s.summary() for s in self._sorted()]
+
+    def list_page(self, limit: int, after: Optional[Tuple[str, str]]) -> List[Dict]:
+        return [s.summary() for s in _page_after(self._sorted(), limit, after, key=Story.sort_key)]
+
+    def signature(self):
+        return (_file_signature(self.snapshot_path), _file_signature(self.journal_path))
+
+    def upsert(self, record: Dict) -> None:
+        try:
+            self._append({"op": "upsert", "story": record})
+        except OSError as e:
+            st.error(f"Ошибка сохранения: {e}")
+
+    def delete(self, story_id: str) -> None:
+        if self.get(story_id) is None:
+            return
+        try:
+            self._append({"op": "delete", "id": story_id})
+        except OSError as e:
+            st.error(f"Ошибка удаления: {e}")
 
-def save_story(story: Dict) -> None:
-    """Сохраняет новую сказку в библиотеку."""
-    stories = load_stories()
-    
-    # Генерация ID, если нет
-    if "id" not in story:
-        story["id"] = str(uuid.uuid4())
-    
-    # Добавление даты создания, если нет
-    if "created_at" not in story:
-        story["created_at"] = datetime.now().isoformat()
-    
-    # Создаём копию для сохранения, исключая неп сериализуемые поля (BytesIO audio)
-    story_to_save = {k: v for k, v in story.items() if k != "audio"}
-        
-    # Проверка на существование (обновление)
-    existing_index = next((i for i, s in enumerate(stories) if s.get("id") == story_to_save["id"]), -1)
-    
-    if existing_index >= 0:
-        stories[existing_index] = story_to_save
+    def write_batch(self, upserts: List[Dict], deletes: List[str]) -> None:
+        entries = [{"op": "upsert", "story": r} for r in upserts] + [{"op": "delete", "id": i} for i in deletes]
+        if not entries:
+            return
+        with _journal_lock, _file_lock(self.journal_path):
+            self._write_entries(entries)
+        self._maybe_compact()
+
+    def rewrite(self, update) -> int:
+        """Применяет update(запись) ко всей библиотеке; изменения дописываются в журнал одним блоком."""
+        with _journal_lock, _file_lock(self.journal_path):
+            entries = []
+            for record in list(self._state().records.values()):
+                updated = update(record.to_dict())
+                if updated is not None:
+                    entries.append({"op": "upsert", "story": updated})
+            if entries:
+                self._write_entries(entries)
+        if entries:
+            self._maybe_compact()
+        return len(entries)
+
+    def _append(self, entry: Dict) -> None:
+        with _journal_lock, _file_lock(self.journal_path):
+            self._write_entries([entry])
+        self._maybe_compact()
+
+    def _write_entries(self, entries: List[Dict]) -> None:
+        """Дописывает записи в журнал с fsync. Вызывать под блокировкой журнала."""
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries).encode("utf-8")
+        with open(self.journal_path, "a+b") as f:
+            # Если прошлая запись оборвалась на полуслове, начинаем с новой строки
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    data = b"\n" + data
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _needs_compaction(self) -> bool:
+        journal_signature = _file_signature(self.journal_path)
+        if journal_signature is None:
+            return False
+        journal_size = journal_signature[1]
+        if journal_size >= JOURNAL_COMPACT_BYTES:
+            return True
+        snapshot_signature = _file_signature(self.snapshot_path)
+        snapshot_size = snapshot_signature[1] if snapshot_signature else 0
+        return journal_size >= JOURNAL_COMPACT_MIN_BYTES and journal_size >= snapshot_size * JOURNAL_COMPACT_RATIO
+
+    def _maybe_compact(self) -> None:
+        """Запускает фоновую компактизацию, если журнал превысил порог."""
+        key = os.path.abspath(self.journal_path)
+        with _journal_lock:
+            if key in _compacting or not self._needs_compaction():
+                return
+            _compacting.add(key)
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                logger.exception(f"Journal compaction failed for {self.journal_path}: {e}")
+            finally:
+                with _journal_lock:
+                    _compacting.discard(key)
+
+        threading.Thread(target=run, name="stories-compactor", daemon=True).start()
+
+    def compact(self) -> None:
+        """
+        Сворачивает журнал в новый снимок.
+
+        Сначала атомарно заменяется снимок, затем журнал обрезается до
+        записей, появившихся после свёртки. Падение между шагами безопасно:
+        повторное применение upsert/delete идемпотентно.
+        """
+        with _journal_lock, _file_lock(self.journal_path):
+            state = self._state()
+            folded_offset = state.offset
+            stories = [s.to_dict() for s in self._sorted()]
+
+            _atomic_write_json(self.snapshot_path, stories, indent=4)
+            _invalidate_cache(self.snapshot_path)
+
+            try:
+                with open(self.journal_path, "rb") as f:
+                    f.seek(folded_offset)
+                    tail = f.read()
+            except FileNotFoundError:
+                tail = b""
+            _atomic_write(self.journal_path, tail)
+            _journal_states.pop(os.path.abspath(self.journal_path), None)
+            if LIBRARY_SNAPSHOT and not tail:
+                _write_library_snapshot(os.path.dirname(self.snapshot_path), stories, self.signature())
+        logger.info(f"Compacted journal {self.journal_path}: {len(stories)} stories in snapshot")
+
+    def migrate(self, target_version: int) -> int:
+        # Сначала журнал сворачивается в снимок, затем снимок мигрирует потоково.
+        # Снимок в журнальном режиме пишется под блокировкой журнала.
+        self.compact()
+        with _journal_lock, _file_lock(self.journal_path):
+            try:
+                return _migrate_json_file(self.snapshot_path, target_version)
+            finally:
+                _invalidate_cache(self.snapshot_path)
+                _journal_states.pop(os.path.abspath(self.journal_path), None)
+
+
+class _SQLiteStorage:
+    """
+    Хранилище сказок в SQLite.
+
+    Каждая сказка — одна строка: `id` (PRIMARY KEY), `created_at` (индекс для
+    сортировки), `title` и полная JSON-запись в `data`. Сохранение стоит
+    одного UPSERT вместо перезаписи всей библиотеки.
+    """
+
+    # idx_stories_summary — покрывающий индекс (created_at, id, title): список
+    # библиотеки читается только из него, не касаясь тел в `data`. Он заменяет
+    # прежний idx_stories_created_at, который удаляется в существующих базах.
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS stories (
+            id TEXT PRIMARY KEY,
+            created_at TEXT NOT NULL DEFAULT '',
+            title TEXT NOT NULL DEFAULT '',
+            data TEXT NOT NULL
+        );
+        DROP INDEX IF EXISTS idx_stories_created_at;
+        CREATE INDEX IF NOT EXISTS idx_stories_summary ON stories (created_at, id, title);
+    """
+
+    def __init__(self, path: str, legacy_json_path: Optional[str] = None):
+        self.path = path
+        self.legacy_json_path = legacy_json_path
+
+    def _connect(self) -> sqlite3.Connection:
+        is_new = not os.path.exists(self.path)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.executescript(self._SCHEMA)
+        if is_new and self.legacy_json_path and os.path.exists(self.legacy_json_path):
+            # Первое открытие базы: переносим существующий stories.json
+            imported = _import_records(conn, _JsonStorage(self.legacy_json_path).load_all())
+            logger.info(f"Imported {imported} stories from {self.legacy_json_path} into {self.path}")
+        return conn
+
+    def load_all(self) -> List[Dict]:
+        try:
+            conn = self._connect()
+            try:
+                rows = conn.execute("SELECT data FROM stories ORDER BY created_at DESC, id DESC").fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to load stories from {self.path}: {e}")
+            return []
+        return [json.loads(row[0]) for row in rows]
+
+    def get(self, story_id: str) -> Optional[Dict]:
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT data FROM stories WHERE id = ?", (story_id,)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read story {story_id} from {self.path}: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def signature(self):
+        return _file_signature(self.path)
+
+    def list_summaries(self) -> List[Dict]:
+        try:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT id, title, created_at FROM stories ORDER BY created_at DESC, id DESC"
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to list stories from {self.path}: {e}")
+            return []
+        return [dict(zip(SUMMARY_FIELDS, row)) for row in rows]
+
+    def list_page(self, limit: int, after: Optional[Tuple[str, str]]) -> List[Dict]:
+        # Keyset-пагинация по индексу (created_at, id): стоимость не зависит от номера страницы
+        if after is None:
+            where, params = "", ()
+        else:
+            where, params = "WHERE (created_at, id) < (?, ?)", after
+        try:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    f"SELECT id, title, created_at FROM stories {where} "
+                    "ORDER BY created_at DESC, id DESC LIMIT ?",
+                    (*params, limit),
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to list stories from {self.path}: {e}")
+            return []
+        return [dict(zip(SUMMARY_FIELDS, row)) for row in rows]
+
+    def upsert(self, record: Dict) -> None:
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    _import_records(conn, [record])
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            st.error(f"Ошибка сохранения: {e}")
+
+    def delete(self, story_id: str) -> None:
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM stories WHERE id = ?", (story_id,))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            st.error(f"Ошибка удаления: {e}")
+
+    def write_batch(self, upserts: List[Dict], deletes: List[str]) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                _import_records(conn, upserts)
+                conn.executemany("DELETE FROM stories WHERE id = ?", [(i,) for i in deletes])
+        finally:
+            conn.close()
+
+    def rewrite(self, update) -> int:
+        """Применяет update(запись) ко всей библиотеке в одной транзакции (BEGIN IMMEDIATE)."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute("SELECT data FROM stories").fetchall()
+                updated = [u for u in (update(json.loads(row[0])) for row in rows) if u is not None]
+                _import_records(conn, updated)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        finally:
+            conn.close()
+        return len(updated)
+
+    def migrate(self, target_version: int) -> int:
+        # Пакеты по rowid, каждый — своя транзакция: прерванная миграция
+        # продолжается с места остановки, обновлённые записи пропускаются
+        migrated = 0
+        last_rowid = 0
+        conn = self._connect()
+        try:
+            while True:
+                rows = conn.execute(
+                    "SELECT rowid, data FROM stories WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, MIGRATION_CHECKPOINT_RECORDS),
+                ).fetchall()
+                if not rows:
+                    break
+                updates = []
+                for rowid, data in rows:
+                    record = json.loads(data)
+                    if _schema_version(record) < target_version:
+                        record = _migrate_record(record, target_version)
+                        updates.append((json.dumps(record, ensure_ascii=False), rowid))
+                with conn:
+                    conn.executemany("UPDATE stories SET data = ? WHERE rowid = ?", updates)
+                migrated += len(updates)
+                last_rowid = rows[-1][0]
+        finally:
+            conn.close()
+        return migrated
+
+
+class _SupabaseStorage:
+    """
+    Библиотека в таблице Supabase через REST API (PostgREST).
+
+    Одна таблица на все пространства имён; сказка — строка с полной записью
+    в `data`. `version` выставляет база (триггер с nextval) при каждой
+    вставке и изменении строки; наибольшая версия вместе с числом строк —
+    сигнатура библиотеки для поискового индекса, снимка и квот. Часы
+    клиентов в ней не участвуют: расхождение времени между серверами
+    приложения не может скрыть изменение.
+    Collation "C" нужна, чтобы порядок (created_at, id) совпадал с локальными движками:
+
+        create sequence stories_version;
+        create table stories (
+            namespace text not null,
+            id text collate "C" not null,
+            created_at text collate "C" not null default '',
+            title text not null default '',
+            data jsonb not null,
+            version bigint not null default nextval('stories_version'),
+            primary key (namespace, id)
+        );
+        create index stories_page on stories (namespace, created_at desc, id desc);
+        create index stories_version_idx on stories (namespace, version desc);
+        create function stories_bump_version() returns trigger language plpgsql as $$
+        begin new.version := nextval('stories_version'); return new; end $$;
+        create trigger stories_version before insert or update on stories
+            for each row execute function stories_bump_version();
+
+    Таблицу прежних версий (столбец updated_at от клиента) дополняют
+    столбцом version, индексом и триггером из этой схемы.
+
+    Блокировок между клиентами нет: rewrite/migrate читают и пишут записи
+    отдельными запросами (последняя запись побеждает).
+    """
+
+    _ORDER = "created_at.desc,id.desc"
+
+    def __init__(self, base_url: str, api_key: str, namespace: str, session):
+        self.url = f"{base_url.rstrip('/')}/rest/v1/{SUPABASE_STORIES_TABLE}"
+        self.namespace = namespace
+        self.session = session
+        self.headers = {"apikey": api_key, "Authorization": f"Bearer {api_key}"}
+
+    def _request(self, method: str, params: List[Tuple[str, str]], body=None, prefer: Optional[str] = None):
+        headers = dict(self.headers)
+        if prefer:
+            headers["Prefer"] = prefer
+        if method != "POST":
+            # Вставка берёт namespace из тела строки; чтение и удаление ограничены фильтром
+            params = [("namespace", f"eq.{self.namespace}")] + params
+        response = self.session.request(
+            method, self.url, params=params, json=body, headers=headers, timeout=SUPABASE_TIMEOUT,
+        )
+        response.raise_for_status()
+        return response
+
+    def _select_all(self, columns: str) -> List[Dict]:
+        rows, offset = [], 0
+        while True:
+            page = self._request("GET", [
+                ("select", columns), ("order", self._ORDER),
+                ("limit", str(SUPABASE_PAGE_SIZE)), ("offset", str(offset)),
+            ]).json()
+            rows += page
+            if len(page) < SUPABASE_PAGE_SIZE:
+                return rows
+            offset += SUPABASE_PAGE_SIZE
+
+    def _row(self, record: Dict) -> Dict:
+        return {
+            "namespace": self.namespace,
+            "id": record["id"],
+            "created_at": record.get("created_at", ""),
+            "title": record.get("title", ""),
+            "data": record,
+        }
+
+    def _upsert_rows(self, records: List[Dict]) -> None:
+        for start in range(0, len(records), SUPABASE_PAGE_SIZE):
+            self._request(
+                "POST", [("on_conflict", "namespace,id")],
+                body=[self._row(r) for r in records[start:start + SUPABASE_PAGE_SIZE]],
+                prefer="resolution=merge-duplicates,return=minimal",
+            )
+
+    def load_all(self) -> List[Dict]:
+        try:
+            return [row["data"] for row in self._select_all("data")]
+        except requests.RequestException as e:
+            logger.error(f"Failed to load stories from Supabase: {e}")
+            return []
+
+    def get(self, story_id: str) -> Optional[Dict]:
+        try:
+            rows = self._request("GET", [("select", "data"), ("id", f"eq.{story_id}"), ("limit", "1")]).json()
+        except requests.RequestException as e:
+            logger.error(f"Failed to get story {story_id} from Supabase: {e}")
+            return None
+        return rows[0]["data"] if rows else None
+
+    def list_summaries(self) -> List[Dict]:
+        try:
+            return self._select_all(",".join(SUMMARY_FIELDS))
+        except requests.RequestException as e:
+            logger.error(f"Failed to list stories from Supabase: {e}")
+            return []
+
+    def list_page(self, limit: int, after: Optional[Tuple[str, str]]) -> List[Dict]:
+        params = [("select", ",".join(SUMMARY_FIELDS)), ("order", self._ORDER), ("limit", str(limit))]
+        if after is not None:
+            created_at, story_id = (_postgrest_quote(v) for v in after)
+            params.append(("or", f"(created_at.lt.{created_at},and(created_at.eq.{created_at},id.lt.{story_id}))"))
+        try:
+            return self._request("GET", params).json()
+        except requests.RequestException as e:
+            logger.error(f"Failed to list stories from Supabase: {e}")
+            return []
+
+    def signature(self):
+        """
+        [число строк, наибольшая version] — обе величины считает база; None,
+        если Supabase недоступен — такая сигнатура не совпадает ни с одной
+        сохранённой, и индекс/снимок перечитываются.
+        """
+        try:
+            response = self._request(
+                "GET", [("select", "version"), ("order", "version.desc"), ("limit", "1")],
+                prefer="count=exact",
+            )
+        except requests.RequestException as e:
+            logger.error(f"Failed to read library signature from Supabase: {e}")
+            return None
+        rows = response.json()
+        # Content-Range: "0-0/<всего>" или "*/0"
+        total = response.headers.get("Content-Range", "*/0").rsplit("/", 1)[-1]
+        return [int(total), rows[0]["version"] if rows else 0]
+
+    def upsert(self, record: Dict) -> None:
+        try:
+            self._upsert_rows([record])
+        except requests.RequestException as e:
+            st.error(f"Ошибка сохранения: {e}")
+
+    def delete(self, story_id: str) -> None:
+        try:
+            self._request("DELETE", [("id", f"eq.{story_id}")], prefer="return=minimal")
+        except requests.RequestException as e:
+            st.error(f"Ошибка удаления: {e}")
+
+    def write_batch(self, upserts: List[Dict], deletes: List[str]) -> None:
+        self._upsert_rows(upserts)
+        for start in range(0, len(deletes), SUPABASE_PAGE_SIZE):
+            ids = ",".join(_postgrest_quote(i) for i in deletes[start:start + SUPABASE_PAGE_SIZE])
+            self._request("DELETE", [("id", f"in.({ids})")], prefer="return=minimal")
+
+    def clear(self) -> None:
+        """Удаляет все строки пространства имён (ошибки не глотаются: вызывающий повторит позже)."""
+        self._request("DELETE", [], prefer="return=minimal")
+
+    def rewrite(self, update) -> int:
+        records = [row["data"] for row in self._select_all("data")]
+        updated = [u for u in (update(r) for r in records) if u is not None]
+        self._upsert_rows(updated)
+        return len(updated)
+
+    def migrate(self, target_version: int) -> int:
+        return self.rewrite(
+            lambda r: _migrate_record(r, target_version) if _schema_version(r) < target_version else None
+        )
+
+
+def _postgrest_quote(value: str) -> str:
+    """Значение в фильтре PostgREST: в кавычках, чтобы `.`, `,`, `:` и скобки не разбирались как синтаксис."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _import_records(conn: sqlite3.Connection, records: List[Dict]) -> int:
+    """Вставляет (или обновляет) записи в таблицу stories. Возвращает их количество."""
+    rows = [
+        (r["id"], r.get("created_at", ""), r.get("title", ""), json.dumps(r, ensure_ascii=False))
+        for r in records
+        if r.get("id")
+    ]
+    conn.executemany(
+        """
+        INSERT INTO stories (id, created_at, title, data) VALUES (?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            created_at = excluded.created_at,
+            title = excluded.title,
+            data = excluded.data
+        """,
+        rows,
+    )
+    return len(rows)
+
+
+def import_json_stories(json_path: str = STORIES_FILE, db_path: str = STORIES_DB_FILE) -> int:
+    """
+    Одноразовый импорт существующего stories.json в SQLite-базу.
+
+    Повторный запуск безопасен: записи с теми же ID обновляются.
+
+    Returns:
+        int: Количество импортированных сказок.
+    """
+    records = _JsonStorage(json_path).load_all()
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        conn.executescript(_SQLiteStorage._SCHEMA)
+        with conn:
+            imported = _import_records(conn, records)
+    finally:
+        conn.close()
+    logger.info(f"Imported {imported} stories from {json_path} into {db_path}")
+    return imported
+
+
+# === Миграции формата записи ===
+# Версия записи хранится в поле `schema_version` (нет поля — версия 1).
+# _MIGRATIONS[n] переводит запись версии n в версию n + 1 (изменяет её на месте).
+
+_CYRILLIC_RE = re.compile(r"[а-яё]", re.IGNORECASE)
+
+
+def _migrate_v1_to_v2(record: Dict) -> None:
+    """v2: язык сказки (`lang`) и ссылка на озвучку (`audio_key`) вместо BytesIO."""
+    record.pop("audio", None)
+    if "lang" not in record:
+        text = f"{record.get('title', '')} {record.get('body', '')}"
+        record["lang"] = "ru" if _CYRILLIC_RE.search(text) else "en"
+    record.setdefault("audio_key", None)
+
+
+# Параметры генерации из формы (v3); у сказок прежних версий они неизвестны
+GENERATION_FIELDS = ("child", "gender", "age_group", "genre", "hobbies", "voice", "model")
+
+
+def _migrate_v2_to_v3(record: Dict) -> None:
+    """v3: параметры генерации (GENERATION_FIELDS) для фильтров библиотеки."""
+    for field in GENERATION_FIELDS:
+        record.setdefault(field, None)
+
+
+_MIGRATIONS = {
+    1: _migrate_v1_to_v2,
+    2: _migrate_v2_to_v3,
+}
+
+
+def _schema_version(record: Dict) -> int:
+    return record.get("schema_version", 1)
+
+
+def _migrate_record(record: Dict, target_version: int = STORY_SCHEMA_VERSION) -> Dict:
+    """Возвращает запись, приведённую к target_version (исходная не изменяется)."""
+    version = _schema_version(record)
+    if version >= target_version:
+        return record
+    record = dict(record)
+    while version < target_version:
+        _MIGRATIONS[version](record)
+        version += 1
+        record["schema_version"] = version
+    return record
+
+
+_JSON_CHUNK_BYTES = 1024 * 1024
+
+
+def _iter_json_array(f, offset: int = 0):
+    """
+    Потоково разбирает JSON-массив из бинарного файла, не загружая его целиком.
+
+    Выдаёт пары (элемент, байтовое смещение конца элемента). Разбор можно
+    продолжить с любого такого смещения (offset), не перечитывая начало файла.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    f.seek(offset)
+    buf = ""
+    pos = 0
+    consumed = offset
+    eof = False
+    # "open" — ждём '[', "first" — первый элемент или ']', "next" — ',' или ']'
+    expect = "open" if offset == 0 else "next"
+
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n":
+            pos += 1
+            consumed += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            chunk = f.read(_JSON_CHUNK_BYTES)
+            eof = not chunk
+            buf = buf[pos:] + utf8.decode(chunk, final=eof)
+            pos = 0
+            continue
+
+        char = buf[pos]
+        if expect == "open":
+            if char != "[":
+                raise ValueError("Library file is not a JSON array")
+            pos += 1
+            consumed += 1
+            expect = "first"
+            continue
+        if char == "]":
+            return
+        if expect == "next":
+            if char != ",":
+                raise ValueError(f"Expected ',' at byte {consumed}")
+            pos += 1
+            consumed += 1
+            expect = "first"
+            continue
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Элемент не поместился в буфер — дочитываем следующий блок
+            chunk = f.read(_JSON_CHUNK_BYTES)
+            eof = not chunk
+            buf = buf[pos:] + utf8.decode(chunk, final=eof)
+            pos = 0
+            continue
+        consumed += len(buf[pos:end].encode("utf-8"))
+        pos = end
+        expect = "next"
+        yield item, consumed
+
+
+def _migrate_json_file(path: str, target_version: int) -> int:
+    """
+    Переписывает JSON-библиотеку в формат target_version за один потоковый проход.
+
+    Новый файл пишется рядом (`<path>.migrating`) и атомарно заменяет
+    исходный в конце. Каждые MIGRATION_CHECKPOINT_RECORDS записей в
+    `<path>.migrating.state` сохраняются смещения в обоих файлах: после
+    прерывания миграция продолжается с последней точки, если исходный файл
+    не менялся. Вызывать под блокировкой файла.
+
+    Returns:
+        int: Количество обновлённых записей.
+    """
+    source_signature = _file_signature(path)
+    if source_signature is None:
+        return 0
+    tmp_path = path + ".migrating"
+    state_path = tmp_path + ".state"
+
+    checkpoint = None
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        pass
+    if (
+        checkpoint is None
+        or checkpoint.get("source") != list(source_signature)
+        or checkpoint.get("target_version") != target_version
+        or not os.path.exists(tmp_path)
+    ):
+        checkpoint = {
+            "source": list(source_signature),
+            "target_version": target_version,
+            "input_offset": 0,
+            "output_offset": 0,
+            "count": 0,
+            "migrated": 0,
+        }
     else:
-        stories.insert(0, story_to_save) # Добавляем в начало
-        
+        logger.info(f"Resuming migration of {path} after {checkpoint['count']} records")
+
+    count, migrated = checkpoint["count"], checkpoint["migrated"]
+    with open(path, "rb") as src, open(tmp_path, "r+b" if checkpoint["output_offset"] else "wb") as out:
+        out.seek(checkpoint["output_offset"])
+        out.truncate()
+        if count == 0:
+            out.write(b"[")
+        for record, end in _iter_json_array(src, checkpoint["input_offset"]):
+            upgraded = _migrate_record(record, target_version) if isinstance(record, dict) else record
+            if upgraded is not record:
+                migrated += 1
+            separator = ",\n" if count else "\n"
+            out.write((separator + json.dumps(upgraded, ensure_ascii=False)).encode("utf-8"))
+            count += 1
+            if count % MIGRATION_CHECKPOINT_RECORDS == 0:
+                out.flush()
+                os.fsync(out.fileno())
+                checkpoint.update(input_offset=end, output_offset=out.tell(), count=count, migrated=migrated)
+                _atomic_write_json(state_path, checkpoint)
+        out.write(b"\n]\n")
+        out.flush()
+        os.fsync(out.fileno())
+
+    os.replace(tmp_path, path)
+    _fsync_dir(path)
+    try:
+        os.remove(state_path)
+    except FileNotFoundError:
+        pass
+    logger.info(f"Migrated {path} to schema v{target_version}: {migrated} of {count} records updated")
+    return migrated
+
+
+# === Снимок только для чтения (snapshot.py) ===
+
+# Открытые снимки процесса (LRU): путь .idx -> (сигнатура файла .idx, снимок).
+# Заменённый снимок не закрывается явно: его ещё могут читать другие потоки.
+_snapshots: Dict[str, Tuple[Tuple[int, int, int], LibrarySnapshot]] = {}
+_snapshots_lock = threading.Lock()
+
+
+def _snapshot_paths(directory: str) -> Tuple[str, str]:
+    return (os.path.join(directory, STORIES_SNAPSHOT_BODIES_FILE),
+            os.path.join(directory, STORIES_SNAPSHOT_INDEX_FILE))
+
+
+def _write_snapshot_files(directory: str, records: List[Dict], source_signature) -> None:
+    """Записывает снимок (snapshot.encode_snapshot): каждый файл — атомарной заменой."""
+    bodies, index = encode_snapshot(records, source_signature)
+    bodies_path, index_path = _snapshot_paths(directory)
+    _atomic_write(bodies_path, bodies)
+    _atomic_write(index_path, index)
+
+
+def _write_library_snapshot(directory: str, records: List[Dict], source_signature) -> None:
+    """Пересобирает снимок; ошибки не мешают записи библиотеки (снимок просто устареет)."""
     try:
-        with open(STORIES_FILE, "w", encoding="utf-8") as f:
-            json.dump(stories, f, indent=4, ensure_ascii=False)
+        _write_snapshot_files(directory, records, source_signature)
     except OSError as e:
-        st.error(f"Ошибка сохранения: {e}")
+        logger.warning(f"Failed to write library snapshot in {directory or '.'}: {e}")
+
+
+@contextmanager
+def _write_lock(engine: StorageBackend):
+    """
+    Блокировка, под которой движок записывает библиотеку (json и journal
+    под ней же пересобирают снимок). У sqlite и supabase общей блокировки
+    записи нет — там согласованность проверяется сравнением сигнатур.
+    """
+    if isinstance(engine, _JsonStorage):
+        with _file_lock(engine.path):
+            yield
+    elif isinstance(engine, _JournalStorage):
+        with _journal_lock, _file_lock(engine.journal_path):
+            yield
+    else:
+        yield
+
+
+def _fresh_snapshot(namespace: Optional[str], engine: StorageBackend) -> Optional[LibrarySnapshot]:
+    """Открытый снимок библиотеки, если он включён и собран из её текущего состояния."""
+    if not LIBRARY_SNAPSHOT:
+        return None
+    bodies_path, index_path = _snapshot_paths(_library_dir(namespace))
+    key = os.path.abspath(index_path)
+    signature = _file_signature(index_path)
+    if signature is None:
+        return None
+    with _snapshots_lock:
+        cached = _cache_get(_snapshots, key)
+        if cached is None or cached[0] != signature:
+            snapshot = LibrarySnapshot.open(bodies_path, index_path)
+            if snapshot is None:
+                return None
+            cached = (signature, snapshot)
+            _cache_put(_snapshots, key, cached)
+    snapshot = cached[1]
+    signature = engine.signature()
+    if signature is None:
+        return None  # Библиотека недоступна — не отдаём снимок, который нельзя проверить
+    return snapshot if snapshot.source == source_digest(signature) else None
+
+
+# === Лента изменений между процессами (LIBRARY_CHANGE_FEED) ===
+
+# Ответы чтения процесса: (каталог библиотеки, запрос) -> (версия библиотеки, ответ)
+_views: Dict[Tuple[str, tuple], Tuple[int, object]] = {}
+_views_lock = threading.Lock()
+
+
+def _version_path(namespace: Optional[str]) -> str:
+    return os.path.join(_library_dir(namespace), STORIES_VERSION_FILE)
+
+
+def library_version(namespace: Optional[str] = None) -> int:
+    """
+    Версия библиотеки — счётчик в stories.version, общий для всех процессов.
+
+    Растёт при каждой записи через API (при LIBRARY_CHANGE_FEED); 0 — записей
+    ещё не было. Чтение — один read() восьми байт, без разбора библиотеки.
+    """
+    try:
+        with open(_version_path(namespace), "rb") as f:
+            data = f.read(8)
+    except OSError:
+        return 0
+    return int.from_bytes(data, "little") if len(data) == 8 else 0
+
+
+def mark_library_changed(namespace: Optional[str] = None) -> int:
+    """
+    Увеличивает версию библиотеки: кэши чтения всех процессов устаревают.
+
+    Вызывается после каждой записи через API; вручную — после правок в обход
+    API (например, восстановления stories.json из резервной копии).
+
+    Returns:
+        int: Новая версия (0, если LIBRARY_CHANGE_FEED выключен).
+    """
+    if not LIBRARY_CHANGE_FEED:
+        return 0
+    path = _version_path(namespace)
+    if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        return 0
+    with _file_lock(path):
+        # Время в наносекундах как нижняя граница: версия не повторится,
+        # даже если файл счётчика потеряли или восстановили из старой копии
+        version = max(library_version(namespace) + 1, time.time_ns())
+        _atomic_write(path, version.to_bytes(8, "little"))
+    return version
+
+
+def _cached_view(namespace: Optional[str], key: tuple, read: Callable[[], object]):
+    """
+    Ответ read() из кэша процесса, пока версия библиотеки не изменилась.
+
+    Версия читается до read(): если библиотеку изменили во время чтения,
+    ответ сохранится со старой версией и следующий вызов прочитает заново.
+    """
+    if not LIBRARY_CHANGE_FEED:
+        return read()
+    version = library_version(namespace)
+    cache_key = (os.path.abspath(_library_dir(namespace)), key)
+    with _views_lock:
+        cached = _cache_get(_views, cache_key)
+    if cached is None or cached[0] != version:
+        cached = (version, read())
+        with _views_lock:
+            _cache_put(_views, cache_key, cached, LIBRARY_VIEW_CACHE_SIZE)
+    # Вызывающий может менять ответ — кэш отдаёт копию
+    return copy.deepcopy(cached[1])
+
+
+# Пространства имён гостевых сессий (auth.get_library_namespace) и их общий каталог
+GUEST_NAMESPACE_PREFIX = "guest:"
+GUEST_LIBRARIES_DIR = os.path.join(LIBRARIES_DIR, "guests")
+
+
+def _library_dir(namespace: Optional[str]) -> str:
+    """
+    Каталог библиотеки пространства имён: `libraries/ab/<sha256[:32]>`
+    (гостевые — `libraries/guests/ab/<sha256[:32]>`, см. sweep_guest_libraries).
+    Для namespace=None — корень (общая библиотека прежних версий).
+    ID пользователя хэшируется: в путь не попадают произвольные символы.
+    """
+    if namespace is None:
+        return ""
+    digest = hashlib.sha256(namespace.encode("utf-8")).hexdigest()[:32]
+    root = GUEST_LIBRARIES_DIR if namespace.startswith(GUEST_NAMESPACE_PREFIX) else LIBRARIES_DIR
+    return os.path.join(root, digest[:2], digest)
+
+
+def _last_modified(directory: str) -> float:
+    """Время последнего изменения библиотеки: самый свежий mtime каталога и его файлов."""
+    latest = os.stat(directory).st_mtime
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                latest = max(latest, entry.stat(follow_symlinks=False).st_mtime)
+            except OSError:
+                continue
+    return latest
+
+
+def _forget_library(directory: str) -> None:
+    """Убирает удалённую библиотеку из всех кэшей процесса."""
+    root = os.path.abspath(directory)
+
+    def inside(path: str) -> bool:
+        return path == root or path.startswith(root + os.sep)
+
+    for cache, lock in ((_stories_cache, _stories_cache_lock), (_summaries_cache, _stories_cache_lock),
+                        (_journal_states, _journal_lock), (_snapshots, _snapshots_lock),
+                        (_cold_sweeps, _cold_sweeps_lock), (_usage, _usage_lock)):
+        with lock:
+            for key in [k for k in cache if inside(k)]:
+                del cache[key]
+    with _views_lock:
+        for key in [k for k in _views if inside(k[0])]:
+            del _views[key]
+
+
+def _clear_remote_library(directory: str) -> None:
+    """
+    Удаляет строки гостевой библиотеки в удалённом движке. Пространство имён
+    берётся из stories.namespace (каталог назван по хэшу и его не раскрывает);
+    у библиотек, созданных до появления этого файла, удалить строки нельзя.
+    """
+    if STORAGE_BACKEND not in _REMOTE_BACKENDS:
+        return
+    try:
+        with open(os.path.join(directory, STORIES_NAMESPACE_FILE), encoding="utf-8") as f:
+            namespace = f.read()
+    except OSError:
+        logger.warning(f"Guest library {directory} has no namespace file, its remote rows are kept")
+        return
+    if not namespace.startswith(GUEST_NAMESPACE_PREFIX):
+        return
+    _BACKENDS[STORAGE_BACKEND](directory, namespace).clear()
+
+
+def sweep_guest_libraries(now: Optional[float] = None, ttl: float = GUEST_LIBRARY_TTL) -> int:
+    """
+    Удаляет гостевые библиотеки, которые не менялись дольше `ttl` секунд.
+
+    Гостевое пространство имён живёт одну сессию браузера: после её конца
+    библиотеку никто не прочитает, а каталог иначе остался бы навсегда.
+    Возраст считается по самому свежему mtime каталога и его файлов
+    (сохранения, журнал открытий). У удалённых движков (supabase) сначала
+    удаляются строки библиотеки; если это не удалось, каталог остаётся до
+    следующего прохода.
+
+    Returns:
+        int: Число удалённых библиотек.
+    """
+    now = time.time() if now is None else now
+    removed = 0
+    try:
+        shards = os.listdir(GUEST_LIBRARIES_DIR)
+    except OSError:
+        return 0
+    for shard in shards:
+        shard_dir = os.path.join(GUEST_LIBRARIES_DIR, shard)
+        try:
+            libraries = os.listdir(shard_dir)
+        except OSError:
+            continue
+        for name in libraries:
+            directory = os.path.join(shard_dir, name)
+            try:
+                if now - _last_modified(directory) < ttl:
+                    continue
+                _clear_remote_library(directory)
+                shutil.rmtree(directory)
+                _forget_library(directory)
+            except (OSError, requests.RequestException) as e:
+                logger.warning(f"Failed to remove guest library {directory}: {e}")
+                continue
+            removed += 1
+        try:
+            os.rmdir(shard_dir)  # Только если шард опустел
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"Removed {removed} expired guest libraries")
+    return removed
+
+
+# Время следующего фонового прохода по гостевым библиотекам (time.monotonic()); None — ещё не назначено
+_guest_sweep_due: Optional[float] = None
+_guest_sweep_lock = threading.Lock()
+
+
+def _maybe_sweep_guest_libraries() -> None:
+    """
+    Запускает фоновое удаление устаревших гостевых библиотек не чаще раза в
+    GUEST_LIBRARY_SWEEP_INTERVAL; первый проход — через интервал после
+    первого обращения к библиотекам в процессе.
+    """
+    global _guest_sweep_due
+    now = time.monotonic()
+    with _guest_sweep_lock:
+        due = _guest_sweep_due
+        if due is not None and now < due:
+            return
+        _guest_sweep_due = now + GUEST_LIBRARY_SWEEP_INTERVAL
+        if due is None:
+            return
+
+    def run():
+        try:
+            sweep_guest_libraries()
+        except Exception as e:
+            logger.exception(f"Guest library sweep failed: {e}")
+
+    threading.Thread(target=run, name="guest-library-sweep", daemon=True).start()
+
+
+# HTTP-сессия для Supabase (переиспользует соединения); тесты подменяют её на FakeSupabase
+_supabase_http = None
+
+
+def _supabase_session():
+    global _supabase_http
+    if _supabase_http is None:
+        _supabase_http = requests.Session()
+    return _supabase_http
+
+
+def _supabase_credentials() -> Tuple[str, str]:
+    """SUPABASE_URL и SUPABASE_KEY: из st.secrets (как в auth.py) или из переменных окружения."""
+    try:
+        url, key = st.secrets.get("SUPABASE_URL"), st.secrets.get("SUPABASE_KEY")
+    except Exception:  # secrets.toml отсутствует
+        url = key = None
+    url = url or os.environ.get("SUPABASE_URL")
+    key = key or os.environ.get("SUPABASE_KEY")
+    if not url or not key:
+        raise RuntimeError("SUPABASE_URL and SUPABASE_KEY are required for STORAGE_BACKEND = 'supabase'")
+    return url, key
+
+
+def _json_backend(directory: str, namespace: Optional[str]) -> StorageBackend:
+    return _JsonStorage(os.path.join(directory, STORIES_FILE), index_path=os.path.join(directory, STORIES_INDEX_FILE))
+
+
+def _journal_backend(directory: str, namespace: Optional[str]) -> StorageBackend:
+    return _JournalStorage(os.path.join(directory, STORIES_FILE), os.path.join(directory, STORIES_JOURNAL_FILE))
+
+
+def _sqlite_backend(directory: str, namespace: Optional[str]) -> StorageBackend:
+    return _SQLiteStorage(os.path.join(directory, STORIES_DB_FILE),
+                          legacy_json_path=os.path.join(directory, STORIES_FILE))
+
+
+def _supabase_backend(directory: str, namespace: Optional[str]) -> StorageBackend:
+    url, key = _supabase_credentials()
+    return _SupabaseStorage(url, key, namespace or "", _supabase_session())
+
+
+# Значения config.STORAGE_BACKEND -> фабрика движка (каталог библиотеки, пространство имён)
+_BACKENDS: Dict[str, Callable[[str, Optional[str]], StorageBackend]] = {
+    "json": _json_backend,
+    "journal": _journal_backend,
+    "sqlite": _sqlite_backend,
+    "supabase": _supabase_backend,
+}
+# Удалённым движкам локальный каталог нужен только для поискового индекса и холодного слоя
+_REMOTE_BACKENDS = {"supabase"}
+
+
+def _get_engine(namespace: Optional[str] = None, create: bool = False) -> Optional[StorageBackend]:
+    """
+    Возвращает движок хранения, выбранный в config.STORAGE_BACKEND, для
+    библиотеки указанного пространства имён.
+
+    Каталог пространства имён создаётся только при записи (create=True);
+    для чтения несуществующей локальной библиотеки возвращается None.
+    """
+    factory = _BACKENDS.get(STORAGE_BACKEND)
+    if factory is None:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND!r}")
+
+    directory = _library_dir(namespace)
+    if directory:
+        _maybe_sweep_guest_libraries()
+        _warn_legacy_library()
+        if create or STORAGE_BACKEND in _REMOTE_BACKENDS:
+            os.makedirs(directory, exist_ok=True)
+            if namespace.startswith(GUEST_NAMESPACE_PREFIX):
+                _remember_namespace(directory, namespace)
+        elif not os.path.isdir(directory):
+            return None
+    return factory(directory, namespace)
+
+
+def _remember_namespace(directory: str, namespace: str) -> None:
+    """Записывает пространство имён гостевой библиотеки (см. _clear_remote_library)."""
+    path = os.path.join(directory, STORIES_NAMESPACE_FILE)
+    if not os.path.exists(path):
+        _atomic_write(path, namespace.encode("utf-8"))
+
+
+_legacy_warned = False
+
+
+def _warn_legacy_library() -> None:
+    """
+    Один раз за процесс предупреждает, что в корне лежит общая библиотека
+    прежних версий: личные библиотеки её не читают, перенести её можно
+    import_legacy_library() (scripts/import_legacy_library.py).
+    """
+    global _legacy_warned
+    if _legacy_warned:
+        return
+    _legacy_warned = True
+    if os.path.exists(STORIES_FILE) or os.path.exists(STORIES_DB_FILE):
+        logger.warning(
+            "Found the shared root library of earlier versions; personal libraries do not read it. "
+            "Import it with: python scripts/import_legacy_library.py --namespace user:<id>"
+        )
+
+
+def _search_index(namespace: Optional[str]) -> SearchIndex:
+    return SearchIndex(os.path.join(_library_dir(namespace), STORIES_SEARCH_FILE))
+
+
+def _cold_store(namespace: Optional[str]) -> ColdStore:
+    return ColdStore(os.path.join(_library_dir(namespace), STORIES_COLD_FILE))
+
+
+# Маркер записи, тело которой лежит в холодном слое (cold_store.py)
+COLD_TIER = "cold"
+
+
+def _hydrate(records: List[Dict], namespace: Optional[str]) -> List[Dict]:
+    """Подставляет тела холодных сказок в записи (копии из load_all) на месте."""
+    cold_ids = [r["id"] for r in records if r.get("tier") == COLD_TIER]
+    if not cold_ids:
+        return records
+    bodies = _cold_store(namespace).get_many(cold_ids)
+    for record in records:
+        if record.get("tier") != COLD_TIER:
+            continue
+        if record["id"] not in bodies:
+            logger.error(f"Cold body is missing for story {record['id']}")
+            continue
+        record["body"] = bodies[record["id"]]
+        del record["tier"]
+    return records
+
+
+def _update_search_index(engine, index: SearchIndex, before, apply, namespace: Optional[str]) -> None:
+    """
+    Инкрементально обновляет поисковый индекс после записи в библиотеку.
+
+    Если до записи индекс не совпадал с библиотекой (её меняли в обход API
+    или индекса ещё нет), вместо инкрементального шага он перестраивается.
+    Ошибки индекса не мешают сохранению — он будет перестроен при поиске.
+    """
+    try:
+        after = engine.signature()
+        if after is None:
+            return  # Библиотека недоступна: индекс перестроится при следующем чтении
+        if index.is_synced(before):
+            apply(index, after)
+        else:
+            index.rebuild(_hydrate(engine.load_all(), namespace), after)
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to update search index {index.path}: {e}")
+
+
+def compact_journal(namespace: Optional[str] = None) -> None:
+    """Принудительно сворачивает журнал в снимок (только для STORAGE_BACKEND = "journal")."""
+    flush_writes(namespace)
+    engine = _get_engine(namespace)
+    if isinstance(engine, _JournalStorage):
+        engine.compact()
+
+
+def build_snapshot(namespace: Optional[str] = None) -> int:
+    """
+    Собирает mmap-снимок библиотеки (snapshot.py) из её текущего состояния.
+
+    Для json и journal снимок пересобирается и при записи/компактизации;
+    для sqlite и supabase — только этим вызовом (например, по расписанию
+    в read-mostly развёртываниях). Если библиотеку изменили во время сборки,
+    снимок не записывается.
+
+    Returns:
+        int: Число сказок в снимке (-1, если сборку пришлось пропустить).
+    """
+    flush_writes(namespace)
+    engine = _get_engine(namespace)
+    if engine is None:
+        return 0
+    # Под блокировкой записи: сохранение не вклинится между чтением и записью
+    # снимка и не будет перезаписано снимком прежнего состояния
+    with _write_lock(engine):
+        before = engine.signature()
+        if before is None:
+            logger.warning("Library signature is unavailable, skipping snapshot")
+            return -1
+        records = engine.load_all()
+        if engine.signature() != before:
+            logger.info("Library changed while building snapshot, skipping")
+            return -1
+        _write_snapshot_files(_library_dir(namespace), records, before)
+    return len(records)
+
+
+def migrate_library(namespace: Optional[str] = None,
+                    target_version: int = STORY_SCHEMA_VERSION) -> int:
+    """
+    Обновляет все записи библиотеки до формата target_version.
+
+    JSON-библиотека (и снимок журнала) переписывается за один потоковый
+    проход без загрузки в память и продолжается с точки возобновления после
+    прерывания; в SQLite записи обновляются пакетами. Пока идёт миграция
+    JSON-библиотеки, сохранения ждут блокировку — запускайте её в окно обслуживания.
+
+    Returns:
+        int: Количество обновлённых записей.
+    """
+    flush_writes(namespace)
+    engine = _get_engine(namespace)
+    if engine is None:
+        return 0
+    migrated = engine.migrate(target_version)
+    if migrated:
+        mark_library_changed(namespace)
+    return migrated
+
+
+def import_legacy_library(namespace: str, overwrite: bool = False) -> int:
+    """
+    Копирует общую библиотеку прежних версий (namespace=None, корень проекта)
+    в библиотеку пространства имён — например, владельца приложения
+    "user:<id>". Сказки с уже занятыми ID пропускаются (overwrite=True —
+    заменяются), поэтому повторный запуск ничего не дублирует. Корневая
+    библиотека не удаляется. Квота и политика дубликатов не применяются.
+
+    Returns:
+        int: Количество перенесённых сказок.
+    """
+    if namespace is None:
+        raise ValueError("Target namespace is required")
+    flush_writes()
+    source = _get_engine(None)
+    records = _hydrate(source.load_all(), None) if source is not None else []
+    target = _get_engine(namespace, create=True)
+    existing = set() if overwrite else {s["id"] for s in target.list_summaries()}
+    ops = {r["id"]: _migrate_record(r) for r in records if r.get("id") and r["id"] not in existing}
+    if ops:
+        _persist_batch(namespace, ops)
+    logger.info(f"Imported {len(ops)} stories from the root library into {namespace!r}")
+    return len(ops)
+
+
+class _WriteBehind:
+    """
+    Очередь отложенной записи библиотеки (WRITE_BEHIND = True).
+
+    save_story/delete_story кладут изменение в `_pending` и сразу
+    возвращаются. Фоновый поток ждёт WRITE_BEHIND_WINDOW, собирая следующие
+    записи (повторные сохранения одной сказки схлопываются в последнее), и
+    сохраняет всё накопленное для пространства имён одним write_batch.
+    Пока пакет пишется, он лежит в `_inflight`, поэтому чтения этого процесса
+    всегда видят собственные записи (см. _pending_writes). При ошибке пакет
+    возвращается в очередь и повторяется в следующем окне; при выходе
+    процесса очередь сбрасывается на диск (atexit).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()  # Пакеты пишутся строго по одному
+        self._wakeup = threading.Event()
+        # Пространство имён -> ID сказки -> запись (None — удаление)
+        self._pending: Dict[Optional[str], Dict[str, Optional[Dict]]] = {}
+        self._inflight: Dict[Optional[str], Dict[str, Optional[Dict]]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def enqueue(self, namespace: Optional[str], story_id: str, record: Optional[Dict]) -> None:
+        with self._lock:
+            self._pending.setdefault(namespace, {})[story_id] = record
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stories-write-behind", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def overlay(self, namespace: Optional[str]) -> Dict[str, Optional[Dict]]:
+        """Ещё не сохранённые изменения пространства имён (новые поверх пишущихся)."""
+        with self._lock:
+            if namespace not in self._pending and namespace not in self._inflight:
+                return {}
+            merged = dict(self._inflight.get(namespace, {}))
+            merged.update(self._pending.get(namespace, {}))
+        return merged
+
+    def flush(self, namespace: Optional[str] = None, everything: bool = True) -> None:
+        """Синхронно сохраняет очередь (всю или одного пространства имён)."""
+        with self._persist_lock:
+            with self._lock:
+                namespaces = list(self._pending) if everything else [n for n in self._pending if n == namespace]
+                batches = {n: self._pending.pop(n) for n in namespaces}
+                self._inflight.update(batches)
+            for ns, ops in batches.items():
+                try:
+                    _persist_batch(ns, ops)
+                    with self._lock:
+                        self._inflight.pop(ns, None)
+                except Exception as e:
+                    logger.exception(f"Write-behind flush failed, will retry: {e}")
+                    with self._lock:
+                        # Более новые изменения из очереди важнее повторяемых
+                        ops.update(self._pending.get(ns, {}))
+                        self._pending[ns] = ops
+                        self._inflight.pop(ns, None)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait()
+            time.sleep(WRITE_BEHIND_WINDOW)
+            self._wakeup.clear()
+            self.flush()
+            with self._lock:
+                if self._pending:
+                    # Неудавшиеся пакеты повторяются в следующем окне
+                    self._wakeup.set()
+
+
+def _persist_batch(namespace: Optional[str], ops: Dict[str, Optional[Dict]]) -> None:
+    """Сохраняет пакет изменений одной операцией движка и обновляет поисковый индекс."""
+    upserts = [record for record in ops.values() if record is not None]
+    deletes = [story_id for story_id, record in ops.items() if record is None]
+    engine = _get_engine(namespace, create=True)
+    before = engine.signature()
+    engine.write_batch(upserts, deletes)
+
+    def apply(index: SearchIndex, after) -> None:
+        for record in upserts:
+            index.upsert(record, after)
+        for story_id in deletes:
+            index.delete(story_id, after)
+
+    _update_search_index(engine, _search_index(namespace), before, apply, namespace)
+    _track_usage(namespace, ops, engine, before)
+    mark_library_changed(namespace)
+    cold = _cold_store(namespace)
+    if deletes and os.path.exists(cold.path):
+        cold.delete_many(deletes, forget_access=True)
+
+
+_write_behind = _WriteBehind()
+atexit.register(lambda: _write_behind.flush())
+
+
+def flush_writes(namespace: Optional[str] = None) -> None:
+    """
+    Дожидается сохранения отложенных записей (WRITE_BEHIND).
+    namespace=None — все пространства имён.
+    """
+    if namespace is None:
+        _write_behind.flush()
+    else:
+        _write_behind.flush(namespace, everything=False)
+
+
+def _pending_writes(namespace: Optional[str]) -> Dict[str, Optional[Dict]]:
+    return _write_behind.overlay(namespace)
 
-def delete_story(story_id: str) -> None:
+
+def _apply_pending(records: List[Dict], pending: Dict[str, Optional[Dict]], view,
+                   after: Optional[Tuple[str, str]] = None) -> List[Dict]:
+    """
+    Накладывает несохранённые изменения на записи движка (новые сверху).
+    view превращает запись очереди в нужный вид (копию или сводку); при
+    заданном after добавляются только записи, идущие после курсора.
+    """
+    if not pending:
+        return records
+    merged = [r for r in records if r.get("id") not in pending]
+    merged += [
+        view(r) for r in pending.values()
+        if r is not None and (after is None or _sort_key(r) < after)
+    ]
+    merged.sort(key=_sort_key, reverse=True)
+    return merged
+
+
+# Функции чтения ниже возвращают записи-словари (формат на диске); Story
+# (story.py) принимает save_story и хранят кэши json- и журнальной библиотеки.
+#
+# Все функции ниже принимают namespace — пространство имён библиотеки
+# (например, "user:<id>" или "guest:<session>", см. auth.get_library_namespace).
+# Каждое пространство хранится в своём каталоге, поэтому запрос затрагивает
+# только небольшую библиотеку одного пользователя. namespace=None — общая
+# библиотека в корне проекта (формат прежних версий).
+
+def load_stories(namespace: Optional[str] = None) -> List[Dict]:
+    """Загружает список сохраненных сказок (новые сверху)."""
+    engine = _get_engine(namespace)
+    stories = []
+    if engine is not None:
+        snapshot = _fresh_snapshot(namespace, engine)
+        stories = _hydrate(snapshot.load_all() if snapshot else engine.load_all(), namespace)
+    return _apply_pending(stories, _pending_writes(namespace), dict)
+
+def list_story_summaries(namespace: Optional[str] = None) -> List[Dict]:
+    """
+    Возвращает метаданные сказок (id, title, created_at) без тел, новые сверху.
+    Тело загружается отдельно через get_story() при открытии сказки.
+    """
+    engine = _get_engine(namespace)
+    if engine is None:
+        return _apply_pending([], _pending_writes(namespace), _summary)
+    _maybe_sweep_cold_tier(namespace)
+    summaries = _cached_view(namespace, ("summaries",), engine.list_summaries)
+    return _apply_pending(summaries, _pending_writes(namespace), _summary)
+
+def list_stories(limit: int, after_cursor: Optional[str] = None,
+                 namespace: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Постраничный список метаданных сказок (новые сверху).
+
+    Пагинация по ключу (created_at, id): страница стабильна при добавлении
+    и удалении сказок и не требует пропуска предыдущих страниц.
+
+    Args:
+        limit: Размер страницы.
+        after_cursor: Курсор из предыдущего вызова (None — первая страница).
+
+    Returns:
+        Tuple[List[Dict], Optional[str]]: Сводки страницы и курсор следующей
+        страницы (None, если это последняя).
+    """
+    engine = _get_engine(namespace)
+    after = _decode_cursor(after_cursor) if after_cursor else None
+    pending = _pending_writes(namespace)
+    # Запрашиваем на одну запись больше, чтобы узнать, есть ли следующая страница,
+    # и ещё по одной на каждое несохранённое изменение: они могут заменить записи страницы
+    page = []
+    if engine is not None:
+        _maybe_sweep_cold_tier(namespace)
+        size = limit + 1 + len(pending)
+        page = _cached_view(namespace, ("page", size, after), lambda: engine.list_page(size, after))
+    page = _apply_pending(page, pending, _summary, after)[:limit + 1]
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, _encode_cursor(page[-1])
+
+def find_near_duplicate(story: Dict, namespace: Optional[str] = None) -> Optional[Dict]:
+    """
+    Ищет в библиотеке почти такую же сказку (сама сказка с тем же ID не в счёт).
+
+    Сравниваются SimHash-отпечатки тел: кандидаты берутся из индекса полос
+    отпечатков (не зависит от размера библиотеки), несохранённые изменения
+    WRITE_BEHIND проверяются напрямую.
+
+    Returns:
+        Optional[Dict]: Метаданные ближайшей сказки (id, title, created_at,
+        distance — число различающихся бит) или None.
+    """
+    fingerprint = simhash(tokenize(story.get("body", "")))
+    if fingerprint is None:
+        return None
+    pending = _pending_writes(namespace)
+    matches = []
+    engine = _get_engine(namespace)
+    if engine is not None:
+        index = _search_index(namespace)
+        try:
+            signature = engine.signature()
+            # Сигнатура None — библиотека недоступна: проверяем только очередь записи
+            if signature is not None:
+                if not index.is_synced(signature):
+                    index.rebuild(_hydrate(engine.load_all(), namespace), signature)
+                matches = index.find_similar(fingerprint, DUPLICATE_MAX_DISTANCE, exclude=story.get("id"))
+        except sqlite3.Error as e:
+            logger.warning(f"Near-duplicate lookup failed: {e}")
+    # Сохранённая версия изменённой в очереди сказки устарела — её заменяет версия из очереди
+    matches = [m for m in matches if m["id"] not in pending]
+    for record in pending.values():
+        if record is None or record["id"] == story.get("id"):
+            continue
+        other = simhash(tokenize(record.get("body", "")))
+        if other is not None and hamming_distance(fingerprint, other) <= DUPLICATE_MAX_DISTANCE:
+            matches.append({**_summary(record), "distance": hamming_distance(fingerprint, other)})
+    return min(matches, key=lambda m: (m["distance"], m["created_at"]), default=None)
+
+def save_story(story: Union[Story, Dict], namespace: Optional[str] = None) -> Optional[Dict]:
+    """
+    Сохраняет новую сказку в библиотеку.
+
+    Принимает Story или запись-словарь; поля проверяются (Story.validate),
+    ValueError — при неверных типах. ID и дата создания, если их не было,
+    проставляются в переданный объект.
+
+    Если в библиотеке есть почти такая же сказка, поступает по
+    config.DUPLICATE_POLICY: "warn" — сохраняет, "skip" — не сохраняет,
+    "merge" — сохраняет новую версию под ID найденной сказки.
+
+    Returns:
+        Optional[Dict]: Метаданные найденного почти-дубликата (см.
+        find_near_duplicate) или None.
+
+    Raises:
+        QuotaExceededError: Сказка не помещается в квоту тарифа библиотеки
+            (только без QUOTA_AUTO_EVICT).
+    """
+    typed = story if isinstance(story, Story) else Story.from_dict(story)
+    typed.validate()
+    if typed.id is None:
+        typed.id = str(uuid.uuid4())
+    if typed.created_at is None:
+        typed.created_at = datetime.now().isoformat()
+    if not isinstance(story, Story):
+        story["id"], story["created_at"] = typed.id, typed.created_at
+
+    # Запись без озвучки (BytesIO) сразу в актуальном формате
+    story_to_save = _migrate_record(typed.to_dict())
+
+    if DUPLICATE_POLICY not in ("allow", "warn", "skip", "merge"):
+        raise ValueError(f"Unknown DUPLICATE_POLICY: {DUPLICATE_POLICY!r}")
+    duplicate = find_near_duplicate(story_to_save, namespace) if DUPLICATE_POLICY != "allow" else None
+    if duplicate is not None:
+        logger.info(f"Story {story_to_save['id']} is a near-duplicate of {duplicate['id']} "
+                    f"(distance {duplicate['distance']}), policy {DUPLICATE_POLICY}")
+        if DUPLICATE_POLICY == "skip":
+            return duplicate
+        if DUPLICATE_POLICY == "merge":
+            typed.id = story_to_save["id"] = duplicate["id"]
+            if not isinstance(story, Story):
+                story["id"] = typed.id
+
+    _check_quota(namespace, story_to_save)
+
+    if WRITE_BEHIND:
+        _write_behind.enqueue(namespace, story_to_save["id"], story_to_save)
+        _track_usage(namespace, {story_to_save["id"]: story_to_save})
+        _schedule_quota_check(namespace)
+        return duplicate
+
+    engine = _get_engine(namespace, create=True)
+    before = engine.signature()
+    engine.upsert(story_to_save)
+    _update_search_index(engine, _search_index(namespace), before,
+                         lambda index, after: index.upsert(story_to_save, after), namespace)
+    _track_usage(namespace, {story_to_save["id"]: story_to_save}, engine, before)
+    mark_library_changed(namespace)
+    _schedule_quota_check(namespace)
+    return duplicate
+
+def delete_story(story_id: str, namespace: Optional[str] = None) -> None:
     """Удаляет сказку по ID."""
-    stories = load_stories()
-    original_len = len(stories)
-    stories = [s for s in stories if s.get("id") != story_id]
-    
-    if len(stories) < original_len:
-        try:
-            with open(STORIES_FILE, "w", encoding="utf-8") as f:
-                json.dump(stories, f, indent=4, ensure_ascii=False)
-        except OSError as e:
-            st.error(f"Ошибка удаления: {e}")
+    if WRITE_BEHIND:
+        _write_behind.enqueue(namespace, story_id, None)
+        _track_usage(namespace, {story_id: None})
+        return
+    engine = _get_engine(namespace)
+    if engine is None:
+        return
+    before = engine.signature()
+    engine.delete(story_id)
+    _update_search_index(engine, _search_index(namespace), before,
+                         lambda index, after: index.delete(story_id, after), namespace)
+    _track_usage(namespace, {story_id: None}, engine, before)
+    mark_library_changed(namespace)
+    cold = _cold_store(namespace)
+    if os.path.exists(cold.path):
+        cold.delete_many([story_id], forget_access=True)
+
+def get_story(story_id: str, namespace: Optional[str] = None) -> Optional[Dict]:
+    """Возвращает сказку по ID (тело из холодного слоя распаковывается прозрачно)."""
+    pending = _pending_writes(namespace)
+    if story_id in pending:
+        return dict(pending[story_id]) if pending[story_id] is not None else None
+    engine = _get_engine(namespace)
+    story = None
+    if engine is not None:
+        # Свежий снимок отдаёт одну запись из mmap, не разбирая библиотеку
+        snapshot = _fresh_snapshot(namespace, engine)
+        story = snapshot.get(story_id) if snapshot else engine.get(story_id)
+    if story is not None:
+        _record_access(namespace, story_id)
+    if story is not None and story.get("tier") == COLD_TIER:
+        body = _cold_store(namespace).get(story_id)
+        if body is None:
+            logger.error(f"Cold body is missing for story {story_id}")
+        else:
+            story["body"] = body
+            del story["tier"]
+    return story
+
+def search(query: str, limit: int = 20, namespace: Optional[str] = None) -> List[Dict]:
+    """
+    Полнотекстовый поиск по названию и тексту сказок (русский и английский).
+
+    Слова запроса ищутся по основе как префиксы (`дракону` найдёт «драконы»).
+    Возвращает метаданные (id, title, created_at), лучшие совпадения сверху.
+    """
+    try:
+        return _index_read(namespace, ("search", query, limit), lambda index: index.search(query, limit), [])
+    except sqlite3.Error as e:
+        logger.error(f"Library search failed: {e}")
+        return []
+
+
+def _synced_index(namespace: Optional[str]) -> Optional[SearchIndex]:
+    """
+    Поисковый индекс, актуальный для библиотеки (перестраивается при расхождении);
+    None — библиотеки нет или она недоступна.
+    """
+    if _pending_writes(namespace):
+        # Индекс обновляется при сохранении пакета — дожидаемся его
+        flush_writes(namespace)
+    engine = _get_engine(namespace)
+    if engine is None:
+        return None
+    index = _search_index(namespace)
+    signature = engine.signature()
+    if signature is None:
+        return None  # Библиотека недоступна — индекс нельзя ни проверить, ни перестроить
+    if not index.is_synced(signature):
+        index.rebuild(_hydrate(engine.load_all(), namespace), signature)
+    return index
+
+
+def _index_read(namespace: Optional[str], key: tuple, read: Callable[[SearchIndex], object], default):
+    """Чтение из актуального поискового индекса, кэшируемое по версии библиотеки."""
+    if _pending_writes(namespace):
+        # Несохранённые записи ещё не повысили версию — сначала сохраняем их
+        flush_writes(namespace)
+
+    def run():
+        index = _synced_index(namespace)
+        return read(index) if index else default
+
+    return _cached_view(namespace, key, run)
+
+def query(limit: int = 20, after_cursor: Optional[str] = None, namespace: Optional[str] = None,
+          **filters) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Постраничный список сказок с фильтрами по параметрам генерации.
+
+    Пример: query(child="Маша", genre="fairytale", lang="ru").
+    Фильтры — поля из search_index.INDEXED_FIELDS (child, gender, age_group,
+    genre, lang, voice, model); значения сравниваются без учёта регистра.
+    Запрос идёт по вторичным индексам и не читает всю библиотеку.
+
+    Returns:
+        Tuple[List[Dict], Optional[str]]: Сводки страницы и курсор следующей
+        (как у list_stories).
+    """
+    unknown = set(filters) - set(INDEXED_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown query fields: {sorted(unknown)}")
+    after = _decode_cursor(after_cursor) if after_cursor else None
+    try:
+        page = _index_read(namespace, ("query", tuple(sorted(filters.items())), limit, after),
+                           lambda index: index.query(filters, limit + 1, after), [])
+    except sqlite3.Error as e:
+        logger.error(f"Library query failed: {e}")
+        return [], None
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, _encode_cursor(page[-1])
+
+def library_facets(field: str, namespace: Optional[str] = None) -> Dict[str, int]:
+    """Значения поля (из INDEXED_FIELDS) в библиотеке и число сказок с каждым."""
+    if field not in INDEXED_FIELDS:
+        raise ValueError(f"Unknown query field: {field!r}")
+    try:
+        return _index_read(namespace, ("facets", field), lambda index: index.facets(field), {})
+    except sqlite3.Error as e:
+        logger.error(f"Library facets failed: {e}")
+        return {}
+
+
+def sweep_cold_tier(namespace: Optional[str] = None, now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Переносит сказки между слоями библиотеки.
+
+    Сказки, не открывавшиеся дольше COLD_TIER_AGE_DAYS (время открытия — дата
+    создания или последнее get_story из холодного слоя), сжимаются в холодный
+    слой; недавно открытые холодные сказки возвращаются в горячий. Сжатие и
+    распаковка выполняются вне блокировки библиотеки, а под ней заменяются
+    только записи, не изменившиеся за это время.
+
+    Returns:
+        Dict[str, int]: {"demoted": перенесено в холодный слой, "promoted": возвращено}.
+    """
+    flush_writes(namespace)
+    engine = _get_engine(namespace)
+    if engine is None:
+        return {"demoted": 0, "promoted": 0}
+    cold = _cold_store(namespace)
+    cutoff = ((now or datetime.now()) - timedelta(days=COLD_TIER_AGE_DAYS)).isoformat()
+
+    # Проходы одной библиотеки не пересекаются даже между процессами:
+    # иначе очистка одного могла бы удалить тела, только что сжатые другим
+    with _file_lock(cold.path):
+        _fold_access_log(namespace, cold)
+        access = cold.access_times()
+
+        def last_used(record: Dict) -> str:
+            return max(record.get("created_at", ""), access.get(record.get("id"), ""))
+
+        records = engine.load_all()
+        to_demote = {
+            r["id"]: r["body"] for r in records
+            if r.get("id") and r.get("tier") != COLD_TIER and r.get("body") and last_used(r) < cutoff
+        }
+        cold.put_many(to_demote.items())
+        to_promote = cold.get_many([
+            r["id"] for r in records if r.get("tier") == COLD_TIER and last_used(r) >= cutoff
+        ])
+
+        demoted, promoted, still_cold = [], [], set()
+
+        def update(record: Dict) -> Optional[Dict]:
+            story_id = record.get("id")
+            if record.get("tier") == COLD_TIER:
+                if story_id in to_promote:
+                    promoted.append(story_id)
+                    restored = {k: v for k, v in record.items() if k != "tier"}
+                    restored["body"] = to_promote[story_id]
+                    return restored
+                still_cold.add(story_id)
+            elif story_id in to_demote and record.get("body") == to_demote[story_id]:
+                demoted.append(story_id)
+                still_cold.add(story_id)
+                return {**record, "body": "", "tier": COLD_TIER}
+            return None
+
+        before = engine.signature()
+        engine.rewrite(update)
+        # Тексты сказок не изменились — поисковому индексу достаточно новой сигнатуры
+        _update_search_index(engine, _search_index(namespace), before,
+                             lambda index, after: index.touch(after), namespace)
+        # Тела вернувшихся, пересохранённых и удалённых сказок больше не нужны
+        cold.delete_many(set(cold.ids()) - still_cold)
+
+    if demoted or promoted:
+        mark_library_changed(namespace)
+        logger.info(f"Cold tier sweep: {len(demoted)} demoted, {len(promoted)} promoted")
+    return {"demoted": len(demoted), "promoted": len(promoted)}
+
+
+def cold_tier_stats(namespace: Optional[str] = None) -> Dict[str, int]:
+    """Размер холодного слоя: число сказок, исходные и сжатые байты, экономия."""
+    cold = _cold_store(namespace)
+    if not os.path.exists(cold.path):
+        return {"stories": 0, "raw_bytes": 0, "stored_bytes": 0, "saved_bytes": 0}
+    return cold.stats()
+
+
+# Время следующего фонового прохода по библиотеке: каталог -> time.monotonic() (LRU)
+_cold_sweeps: Dict[str, float] = {}
+_cold_sweeps_lock = threading.Lock()
+
+
+def _maybe_sweep_cold_tier(namespace: Optional[str]) -> None:
+    """
+    Запускает фоновый проход холодного слоя не чаще раза в COLD_TIER_SWEEP_INTERVAL
+    (только при LIBRARY_COLD_TIER). Первый проход — через интервал после первого
+    обращения к библиотеке в процессе.
+    """
+    if not LIBRARY_COLD_TIER:
+        return
+    key = os.path.abspath(_library_dir(namespace))
+    now = time.monotonic()
+    with _cold_sweeps_lock:
+        due = _cache_get(_cold_sweeps, key)
+        if due is not None and now < due:
+            return
+        _cache_put(_cold_sweeps, key, now + COLD_TIER_SWEEP_INTERVAL)
+        if due is None:
+            return
+
+    def run():
+        try:
+            sweep_cold_tier(namespace)
+        except Exception as e:
+            logger.exception(f"Cold tier sweep failed for {key}: {e}")
+
+    threading.Thread(target=run, name="stories-cold-sweep", daemon=True).start()
+
+
+def _record_access(namespace: Optional[str], story_id: str) -> None:
+    """
+    Дописывает открытие сказки в журнал открытий библиотеки.
+
+    Дозапись одной строки (O_APPEND) дешевле транзакции на каждый get_story;
+    журнал сворачивается в cold_store.story_access фоновыми проходами
+    (sweep_cold_tier, enforce_quota). Ведётся, только если открытия кому-то
+    нужны: холодному слою (LIBRARY_COLD_TIER) или вытеснению "lru".
+    """
+    if not LIBRARY_COLD_TIER and QUOTA_EVICTION != "lru":
+        return
+    line = json.dumps({"id": story_id, "at": datetime.now().isoformat()}, ensure_ascii=False) + "\n"
+    path = os.path.join(_library_dir(namespace), STORIES_ACCESS_LOG_FILE)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.warning(f"Failed to record access to story {story_id}: {e}")
+
+
+def _fold_access_log(namespace: Optional[str], cold: ColdStore) -> None:
+    """
+    Переносит журнал открытий в cold_store (вызывается под _file_lock(cold.path)).
+
+    Журнал сначала переименовывается: новые открытия пишутся в свежий файл,
+    а прерванный перенос будет завершён при следующем проходе.
+    """
+    path = os.path.join(_library_dir(namespace), STORIES_ACCESS_LOG_FILE)
+    folding = path + ".folding"
+    if os.path.exists(path) and not os.path.exists(folding):
+        os.replace(path, folding)
+    if not os.path.exists(folding):
+        return
+    latest: Dict[str, str] = {}
+    with open(folding, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Недописанная строка при сбое
+            if entry.get("at", "") > latest.get(entry.get("id"), ""):
+                latest[entry["id"]] = entry["at"]
+    cold.record_access(latest)
+    os.remove(folding)
+
+
+def set_library_plan(plan: str, namespace: Optional[str] = None) -> None:
+    """
+    Назначает библиотеке тариф из config.PLAN_QUOTAS (определяет её квоту).
+
+    Тариф записывается только в уже существующую библиотеку — гостевые
+    сессии без сохранённых сказок не создают каталогов. С QUOTA_AUTO_EVICT
+    после смены тарифа квота проверяется в фоне; без него библиотека сверх
+    квоты ничего не теряет, но новые сказки в неё не сохраняются.
+    """
+    if plan not in PLAN_QUOTAS:
+        raise ValueError(f"Unknown plan: {plan!r}")
+    directory = _library_dir(namespace)
+    if directory and not os.path.isdir(directory):
+        return
+    if library_plan(namespace) == plan:
+        return
+    _atomic_write_json(os.path.join(directory, STORIES_PLAN_FILE), {"plan": plan})
+    _schedule_quota_check(namespace)
+
+
+def library_plan(namespace: Optional[str] = None) -> Optional[str]:
+    """Тариф библиотеки (None — тариф не назначен, квота не действует)."""
+    try:
+        with open(os.path.join(_library_dir(namespace), STORIES_PLAN_FILE), encoding="utf-8") as f:
+            return json.load(f).get("plan")
+    except (OSError, ValueError):
+        return None
+
+
+def _record_size(record: Dict, cold_sizes: Dict[str, int]) -> int:
+    """Размер сказки в байтах (JSON записи; для холодной — плюс исходный размер тела)."""
+    size = len(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+    if record.get("tier") == COLD_TIER:
+        size += cold_sizes.get(record.get("id"), 0)
+    return size
+
+
+class QuotaExceededError(Exception):
+    """Сохранение отклонено: сказка не помещается в квоту тарифа библиотеки."""
+
+    def __init__(self, plan: str, max_stories: Optional[int], max_bytes: Optional[int]):
+        super().__init__(f"Library quota of plan {plan!r} exceeded")
+        self.plan = plan
+        self.max_stories = max_stories
+        self.max_bytes = max_bytes
+
+
+class _LibraryUsage:
+    """
+    Счётчики квоты библиотеки: размер каждой сказки (с учётом очереди
+    WRITE_BEHIND) для состояния движка с сигнатурой `signature`.
+    """
+
+    def __init__(self, signature, sizes: Dict[str, int]):
+        self.signature = signature
+        self.sizes = sizes
+        self.bytes = sum(sizes.values())
+
+    def apply(self, story_id: str, record: Optional[Dict]) -> None:
+        """Учитывает сохранение (record) или удаление (None) сказки; повтор ничего не меняет."""
+        self.bytes -= self.sizes.pop(story_id, 0)
+        if record is not None:
+            self.sizes[story_id] = _record_size(record, {})
+            self.bytes += self.sizes[story_id]
+
+
+# Счётчики квот процесса (LRU): каталог библиотеки -> _LibraryUsage.
+# Ведутся только для библиотек, квоту которых уже проверяли
+_usage: Dict[str, _LibraryUsage] = {}
+_usage_lock = threading.Lock()
+
+
+def _library_usage(namespace: Optional[str]) -> _LibraryUsage:
+    """
+    Счётчики квоты библиотеки. Полный проход по библиотеке — только если
+    её сигнатура изменилась в обход этого процесса (другой процесс, проход
+    холодного слоя); свои записи учитывает _track_usage.
+    """
+    key = os.path.abspath(_library_dir(namespace))
+    engine = _get_engine(namespace)
+    signature = engine.signature() if engine is not None else None
+    with _usage_lock:
+        usage = _cache_get(_usage, key)
+    if usage is not None and signature is not None and usage.signature == signature:
+        return usage
+    sizes = {}
+    if engine is not None:
+        cold = _cold_store(namespace)
+        cold_sizes = cold.raw_sizes() if os.path.exists(cold.path) else {}
+        sizes = {r["id"]: _record_size(r, cold_sizes) for r in engine.load_all() if r.get("id")}
+    usage = _LibraryUsage(signature, sizes)
+    for story_id, record in _pending_writes(namespace).items():
+        usage.apply(story_id, record)
+    # Без сигнатуры (библиотеки ещё нет или она недоступна) счётчики не кэшируются
+    if signature is not None:
+        with _usage_lock:
+            _cache_put(_usage, key, usage)
+    return usage
+
+
+def _track_usage(namespace: Optional[str], ops: Dict[str, Optional[Dict]],
+                 engine: Optional[StorageBackend] = None, before=None) -> None:
+    """
+    Переносит запись в счётчики квоты, если они ведутся для библиотеки.
+
+    После записи в движок (engine, before — сигнатура до записи) счётчики
+    получают новую сигнатуру, только если соответствовали состоянию до
+    записи; иначе они сбрасываются и будут пересчитаны при следующей
+    проверке. Без engine — изменение поставлено в очередь WRITE_BEHIND.
+    """
+    key = os.path.abspath(_library_dir(namespace))
+    with _usage_lock:
+        if key not in _usage:
+            return
+    after = engine.signature() if engine is not None else None
+    with _usage_lock:
+        usage = _usage.get(key)
+        if usage is None:
+            return
+        if engine is not None:
+            if after is None or usage.signature != before:
+                del _usage[key]
+                return
+            usage.signature = after
+        for story_id, record in ops.items():
+            usage.apply(story_id, record)
+
+
+def _check_quota(namespace: Optional[str], record: Dict) -> None:
+    """
+    Отклоняет сохранение, после которого библиотека превысит квоту тарифа.
+
+    Проверяется по счётчикам (_library_usage), без прохода по библиотеке.
+    Изменение уже сохранённой сказки, не увеличивающее её размер (например,
+    ссылка на озвучку), проходит и в переполненной библиотеке. С
+    QUOTA_AUTO_EVICT проверка не делается — лишнее удаляет enforce_quota.
+    """
+    if QUOTA_AUTO_EVICT:
+        return
+    plan = library_plan(namespace)
+    quota = PLAN_QUOTAS.get(plan)
+    if not quota:
+        return
+    usage = _library_usage(namespace)
+    size = _record_size(record, {})
+    previous = usage.sizes.get(record["id"])
+    if previous is not None and size <= previous:
+        return
+    max_stories, max_bytes = quota.get("stories"), quota.get("bytes")
+    count = len(usage.sizes) + (previous is None)
+    total = usage.bytes - (previous or 0) + size
+    if (max_stories is not None and count > max_stories) or (max_bytes is not None and total > max_bytes):
+        logger.info(f"Save of story {record['id']} rejected: quota of plan {plan!r} exceeded")
+        raise QuotaExceededError(plan, max_stories, max_bytes)
+
+
+def library_usage(namespace: Optional[str] = None) -> Dict:
+    """
+    Занятое библиотекой место и её квота.
+
+    Returns:
+        Dict: {"plan", "stories", "bytes", "max_stories", "max_bytes"}
+        (max_* — None, если ограничения нет).
+    """
+    plan = library_plan(namespace)
+    quota = PLAN_QUOTAS.get(plan, {})
+    usage = _library_usage(namespace)
+    return {
+        "plan": plan,
+        "stories": len(usage.sizes),
+        "bytes": usage.bytes,
+        "max_stories": quota.get("stories"),
+        "max_bytes": quota.get("bytes"),
+    }
+
+
+def enforce_quota(namespace: Optional[str] = None, limit: Optional[int] = None) -> Dict[str, int]:
+    """
+    Удаляет сказки сверх квоты тарифа библиотеки (config.PLAN_QUOTAS).
+
+    Порядок вытеснения — config.QUOTA_EVICTION: "oldest" — по дате создания,
+    "lru" — по времени последнего открытия (get_story), для ни разу не
+    открытых — по дате создания.
+
+    Args:
+        limit: Не удалять больше стольких сказок за вызов (None — сколько нужно).
+
+    Returns:
+        Dict[str, int]: {"evicted": удалено, "over": 1, если квота всё ещё превышена}.
+    """
+    if QUOTA_EVICTION not in ("oldest", "lru"):
+        raise ValueError(f"Unknown QUOTA_EVICTION: {QUOTA_EVICTION!r}")
+    quota = PLAN_QUOTAS.get(library_plan(namespace))
+    if not quota:
+        return {"evicted": 0, "over": 0}
+    flush_writes(namespace)
+    engine = _get_engine(namespace)
+    if engine is None:
+        return {"evicted": 0, "over": 0}
+    max_stories, max_bytes = quota.get("stories"), quota.get("bytes")
+    cold = _cold_store(namespace)
+
+    # Под той же блокировкой, что и проход холодного слоя: оба переписывают библиотеку
+    with _file_lock(cold.path):
+        _fold_access_log(namespace, cold)
+        access = cold.access_times() if QUOTA_EVICTION == "lru" else {}
+        cold_sizes = cold.raw_sizes()
+        records = [r for r in engine.load_all() if r.get("id")]
+        count = len(records)
+        total = sum(_record_size(r, cold_sizes) for r in records)
+
+        def eviction_key(record: Dict) -> Tuple[str, str]:
+            created = record.get("created_at", "")
+            return (max(created, access.get(record["id"], "")), created)
+
+        doomed = []
+        for record in sorted(records, key=eviction_key):
+            over = (max_stories is not None and count > max_stories) or (max_bytes is not None and total > max_bytes)
+            if not over or (limit is not None and len(doomed) >= limit):
+                break
+            doomed.append(record["id"])
+            count -= 1
+            total -= _record_size(record, cold_sizes)
+        if doomed:
+            _persist_batch(namespace, {story_id: None for story_id in doomed})
+
+    still_over = (max_stories is not None and count > max_stories) or (max_bytes is not None and total > max_bytes)
+    if doomed:
+        logger.info(f"Quota eviction ({QUOTA_EVICTION}): {len(doomed)} stories removed, "
+                    f"{count} stories / {total} bytes left")
+    return {"evicted": len(doomed), "over": int(still_over)}
+
+
+class _QuotaReaper:
+    """
+    Фоновое применение квот (только при QUOTA_AUTO_EVICT).
+
+    save_story только отмечает библиотеку; поток через QUOTA_REAP_DELAY
+    проверяет все отмеченные за это время библиотеки и удаляет не больше
+    QUOTA_REAP_BATCH сказок за проход — остальное доделывают следующие.
+    Библиотеки, которые не меняли, не проверяются вовсе.
+    """
+
+    def __init__(self):
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def mark(self, namespace: Optional[str]) -> None:
+        with self._lock:
+            self._dirty.add(namespace)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stories-quota-reaper", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def run_once(self) -> Dict[Optional[str], int]:
+        """Один проход по отмеченным библиотекам: пространство имён -> удалено сказок."""
+        with self._lock:
+            namespaces, self._dirty = self._dirty, set()
+        evicted = {}
+        for namespace in namespaces:
+            try:
+                result = enforce_quota(namespace, limit=QUOTA_REAP_BATCH)
+            except Exception as e:
+                logger.exception(f"Quota check failed for {namespace!r}: {e}")
+                continue
+            evicted[namespace] = result["evicted"]
+            if result["over"]:
+                with self._lock:
+                    self._dirty.add(namespace)
+        return evicted
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait()
+            time.sleep(QUOTA_REAP_DELAY)
+            self._wakeup.clear()
+            self.run_once()
+            with self._lock:
+                if self._dirty:
+                    self._wakeup.set()
+
+
+_quota_reaper = _QuotaReaper()
+
 
-def get_story(story_id: str) -> Optional[Dict]:
-    """Возвращает сказку по ID."""
-    stories = load_stories()
-    return next((s for s in stories if s.get("id") == story_id), None)
+def _schedule_quota_check(namespace: Optional[str]) -> None:
+    """Отмечает библиотеку для фоновой проверки квоты (при QUOTA_AUTO_EVICT и если у неё есть тариф)."""
+    if QUOTA_AUTO_EVICT and library_plan(namespace) is not None:
+        _quota_reaper.mark(namespace)
@@ -0,0 +1,123 @@
+"""
+Запись сказки: компактный типизированный объект вместо словаря.
+
+Story — dataclass со __slots__: у объекта нет __dict__, поэтому закэшированная
+библиотека из тысяч сказок занимает заметно меньше памяти, чем те же записи
+словарями (без учёта самих строк — примерно на треть), а поля читаются
+атрибутами без `.get()` с умолчаниями.
+
+Формат на диске не меняется: from_dict/to_dict переводят запись библиотеки
+(JSON-объект) в Story и обратно без потерь — неизвестные поля хранятся в
+`extra`, а поля, которых в записи не было, в неё и не возвращаются.
+
+Граница применения: Story — тип текущей сказки в приложении (session_state),
+аргумент storage.save_story и формат кэшей процесса json- и журнальной
+библиотеки. Публичные функции чтения storage (load_stories, get_story,
+list_*), движки, квоты и холодный слой работают с записями-словарями —
+форматом на диске и в Supabase; в Story их переводит Story.from_dict там,
+где запись нужна приложению.
+"""
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple, Union
+
+GENDERS = ("boy", "girl", "auto")
+
+
+@dataclass(slots=True)
+class Story:
+    """Сказка библиотеки (поля записи актуальной версии схемы, см. storage._MIGRATIONS)."""
+
+    title: str = ""
+    body: str = ""
+    id: Optional[str] = None
+    created_at: Optional[str] = None
+    lang: Optional[str] = None
+    audio_key: Optional[str] = None
+    # Параметры генерации (v3)
+    child: Optional[str] = None
+    gender: Optional[str] = None
+    age_group: Optional[Union[int, float]] = None
+    genre: Optional[str] = None
+    hobbies: Optional[str] = None
+    voice: Optional[str] = None
+    model: Optional[str] = None
+    schema_version: Optional[int] = None
+    tier: Optional[str] = None  # "cold" — тело в холодном слое (cold_store.py)
+    # Поля записи, которых нет среди атрибутов (сохраняются как есть); None — таких нет
+    extra: Optional[Dict[str, Any]] = field(default=None, repr=False)
+    # Озвучка текущей сессии; в библиотеку не пишется (там только audio_key)
+    audio: Optional[BytesIO] = field(default=None, repr=False, compare=False)
+    # Биты полей, присутствовавших в исходной записи (from_dict)
+    _present: int = field(default=0, repr=False, compare=False)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Story":
+        """Запись библиотеки -> Story (без проверки — записи с диска принимаются как есть)."""
+        story = cls()
+        present = 0
+        for key, value in data.items():
+            bit = _FIELD_BITS.get(key)
+            if bit is not None:
+                setattr(story, key, value)
+                present |= bit
+            elif key == "audio":
+                story.audio = value
+            elif story.extra is None:
+                story.extra = {key: value}
+            else:
+                story.extra[key] = value
+        story._present = present
+        return story
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Story -> запись библиотеки (без audio).
+
+        Поле попадает в запись, если оно было в исходной записи или задано
+        (не None) — None не превращается в лишний ключ.
+        """
+        record = {}
+        for name, bit in _FIELD_BITS.items():
+            value = getattr(self, name)
+            if value is not None or self._present & bit:
+                record[name] = value
+        if self.extra:
+            record.update(self.extra)
+        return record
+
+    def summary(self) -> Dict[str, str]:
+        """Метаданные для списка библиотеки (storage.SUMMARY_FIELDS)."""
+        return {"id": self.id or "", "title": self.title or "", "created_at": self.created_at or ""}
+
+    def sort_key(self) -> Tuple[str, str]:
+        """Порядок библиотеки: по дате создания, при равенстве — по ID."""
+        return (self.created_at or "", self.id or "")
+
+    def validate(self) -> None:
+        """Проверяет типы полей новой сказки; ValueError с описанием первой ошибки."""
+        for name in ("title", "body"):
+            if not isinstance(getattr(self, name), str):
+                raise ValueError(f"Story {name} must be a string")
+        for name in ("id", "lang", "audio_key", "child", "genre", "hobbies", "voice", "model", "tier"):
+            value = getattr(self, name)
+            if value is not None and not isinstance(value, str):
+                raise ValueError(f"Story {name} must be a string or None, got {type(value).__name__}")
+        if self.created_at is not None:
+            try:
+                datetime.fromisoformat(self.created_at)
+            except (TypeError, ValueError):
+                raise ValueError(f"Story created_at is not an ISO date: {self.created_at!r}") from None
+        if self.gender is not None and self.gender not in GENDERS:
+            raise ValueError(f"Unknown story gender: {self.gender!r}")
+        age_group = self.age_group
+        if age_group is not None and (isinstance(age_group, bool) or not isinstance(age_group, (int, float))):
+            raise ValueError(f"Story age_group must be a number, got {age_group!r}")
+
+
+# Поля записи (всё, кроме служебных extra/audio/_present) и их биты в _present
+_FIELD_BITS = {
+    f.name: 1 << i
+    for i, f in enumerate(f for f in fields(Story) if f.name not in ("extra", "audio", "_present"))
+}
@@ -0,0 +1,249 @@
+"""
+Локальная замена табличного REST API Supabase (PostgREST) для тестов и бенчмарков.
+
+FakeSupabase реализует `request()` как у `requests.Session` и понимает то
+подмножество PostgREST, которым пользуется storage._SupabaseStorage:
+`select`, `order`, `limit`, `offset`, фильтры `col=op.value` (включая `in.(...)`), `or=(...)` с
+вложенным `and(...)`, upsert через `on_conflict` + `Prefer: resolution=merge-duplicates`
+и `Prefer: count=exact`. Строки хранятся в памяти процесса; `latency`
+имитирует сетевую задержку каждого запроса. Столбцы `versioned` заполняет
+«сервер»: каждая вставка или обновление строки получает следующее значение
+счётчика (как триггер с nextval в схеме из storage._SupabaseStorage).
+
+Пример:
+    fake = FakeSupabase(latency=0.02)
+    storage._supabase_http = fake
+"""
+import json
+import time
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+_OPERATORS: Dict[str, Callable[[str, str], bool]] = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+}
+_RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "or"}
+
+
+class FakeResponse:
+    """Ответ с интерфейсом requests.Response (json, headers, raise_for_status)."""
+
+    def __init__(self, status_code: int, payload=None, headers: Optional[Dict[str, str]] = None):
+        self.status_code = status_code
+        self._payload = payload
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(json.dumps(self._payload))
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}: {self._payload}", response=self)
+
+
+def _parse_in_list(text: str) -> List[str]:
+    """Разбирает `("a","b",c)` из фильтра `in`."""
+    if not (text.startswith("(") and text.endswith(")")):
+        raise ValueError(f"Malformed in-list: {text!r}")
+    values, pos, body = [], 0, text[1:-1]
+    while pos < len(body):
+        if body[pos] == '"':
+            pos += 1
+            chars = []
+            while body[pos] != '"':
+                if body[pos] == "\\":
+                    pos += 1
+                chars.append(body[pos])
+                pos += 1
+            values.append("".join(chars))
+            pos += 2  # закрывающая кавычка и запятая
+        else:
+            end = body.find(",", pos)
+            end = len(body) if end < 0 else end
+            values.append(body[pos:end])
+            pos = end + 1
+    return values
+
+
+def _sort_value(value) -> Tuple:
+    """Ключ сортировки: числа — как числа (1 < 10), остальное — как строки."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (0, value, "")
+    return (1, 0, "" if value is None else str(value))
+
+
+def _condition(column: str, op: str, value: str) -> Callable[[Dict], bool]:
+    if op == "in":
+        allowed = set(_parse_in_list(value))
+        return lambda row: row.get(column) is not None and str(row[column]) in allowed
+    if op not in _OPERATORS:
+        raise ValueError(f"Unsupported operator: {op}")
+    compare = _OPERATORS[op]
+    return lambda row: row.get(column) is not None and compare(str(row[column]), value)
+
+
+def _parse_logic(text: str) -> Callable[[Dict], bool]:
+    """Разбирает `(cond,and(cond,cond),...)` из параметра `or` в предикат."""
+    pos = 0
+
+    def expect(char: str) -> None:
+        nonlocal pos
+        if text[pos] != char:
+            raise ValueError(f"Expected {char!r} at {pos} in {text!r}")
+        pos += 1
+
+    def parse_value() -> str:
+        nonlocal pos
+        if text[pos] != '"':
+            end = pos
+            while text[end] not in ",)":
+                end += 1
+            value, pos = text[pos:end], end
+            return value
+        pos += 1
+        chars = []
+        while text[pos] != '"':
+            if text[pos] == "\\":
+                pos += 1
+            chars.append(text[pos])
+            pos += 1
+        pos += 1
+        return "".join(chars)
+
+    def parse_group() -> List[Callable[[Dict], bool]]:
+        nonlocal pos
+        expect("(")
+        items = [parse_item()]
+        while text[pos] == ",":
+            pos += 1
+            items.append(parse_item())
+        expect(")")
+        return items
+
+    def parse_item() -> Callable[[Dict], bool]:
+        nonlocal pos
+        for keyword, combine in (("and(", all), ("or(", any)):
+            if text.startswith(keyword, pos):
+                pos += len(keyword) - 1
+                items = parse_group()
+                return lambda row: combine(item(row) for item in items)
+        column_end = text.index(".", pos)
+        op_end = text.index(".", column_end + 1)
+        column, op = text[pos:column_end], text[column_end + 1:op_end]
+        pos = op_end + 1
+        return _condition(column, op, parse_value())
+
+    items = parse_group()
+    if pos != len(text):
+        raise ValueError(f"Trailing characters in {text!r}")
+    return lambda row: any(item(row) for item in items)
+
+
+class FakeSupabase:
+    """
+    In-process таблицы Supabase с REST-интерфейсом.
+
+    Args:
+        latency: Задержка каждого запроса в секундах (имитация сети).
+        primary_keys: Первичные ключи таблиц; по умолчанию `stories` — (namespace, id).
+        versioned: Столбец версии, который выставляет сервер; по умолчанию `stories` — version.
+    """
+
+    def __init__(self, latency: float = 0.0, primary_keys: Optional[Dict[str, Tuple[str, ...]]] = None,
+                 versioned: Optional[Dict[str, str]] = None):
+        self.latency = latency
+        self.primary_keys = primary_keys or {"stories": ("namespace", "id")}
+        self.versioned = {"stories": "version"} if versioned is None else versioned
+        self.tables: Dict[str, Dict[Tuple, Dict]] = {}
+        self.request_count = 0
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def request(self, method: str, url: str, params=None, json=None, headers=None, timeout=None) -> FakeResponse:
+        if self.latency:
+            time.sleep(self.latency)
+        table_name = urlparse(url).path.rsplit("/rest/v1/", 1)[-1]
+        params = list(params.items() if isinstance(params, dict) else params or [])
+        prefer = (headers or {}).get("Prefer", "")
+        with self._lock:
+            self.request_count += 1
+            table = self.tables.setdefault(table_name, {})
+            try:
+                if method == "GET":
+                    return self._select(table, params, prefer)
+                if method == "POST":
+                    return self._insert(table_name, table, params, json, prefer)
+                if method == "DELETE":
+                    return self._delete(table, params)
+            except (ValueError, KeyError, IndexError) as e:
+                return FakeResponse(400, {"message": str(e)})
+        return FakeResponse(405, {"message": f"Method {method} is not supported"})
+
+    def rows(self, table_name: str = "stories") -> List[Dict]:
+        """Копия всех строк таблицы (для проверок в тестах)."""
+        with self._lock:
+            return [dict(row) for row in self.tables.get(table_name, {}).values()]
+
+    @staticmethod
+    def _filter(table: Dict[Tuple, Dict], params: List[Tuple[str, str]]) -> List[Dict]:
+        predicates = []
+        for key, value in params:
+            if key == "or":
+                predicates.append(_parse_logic(value))
+            elif key not in _RESERVED_PARAMS:
+                op, _, operand = value.partition(".")
+                predicates.append(_condition(key, op, operand))
+        return [row for row in table.values() if all(p(row) for p in predicates)]
+
+    def _select(self, table, params, prefer: str) -> FakeResponse:
+        options = dict(p for p in params if p[0] in _RESERVED_PARAMS)
+        rows = self._filter(table, params)
+        for part in reversed(options.get("order", "").split(",") if options.get("order") else []):
+            column, _, direction = part.partition(".")
+            rows.sort(key=lambda row: _sort_value(row.get(column)), reverse=direction == "desc")
+        total = len(rows)
+        offset = int(options.get("offset", 0))
+        limit = int(options["limit"]) if "limit" in options else None
+        rows = rows[offset:offset + limit if limit is not None else None]
+
+        columns = options.get("select", "*")
+        if columns != "*":
+            names = columns.split(",")
+            rows = [{name: row.get(name) for name in names} for row in rows]
+
+        headers = {}
+        if "count=exact" in prefer:
+            headers["Content-Range"] = f"{offset}-{offset + len(rows) - 1}/{total}" if rows else f"*/{total}"
+        return FakeResponse(200, rows, headers)
+
+    def _insert(self, table_name, table, params, body, prefer: str) -> FakeResponse:
+        rows = body if isinstance(body, list) else [body]
+        options = dict(p for p in params if p[0] in _RESERVED_PARAMS)
+        key_columns = tuple(options["on_conflict"].split(",")) if "on_conflict" in options \
+            else self.primary_keys.get(table_name, ("id",))
+        merge = "resolution=merge-duplicates" in prefer
+        keys = [tuple(row[c] for c in key_columns) for row in rows]
+        if not merge and any(key in table for key in keys):
+            return FakeResponse(409, {"message": "duplicate key value violates unique constraint"})
+        version_column = self.versioned.get(table_name)
+        for key, row in zip(keys, rows):
+            # Строки хранятся как после сериализации по сети
+            table[key] = json.loads(json.dumps(row))
+            if version_column:
+                self._version += 1
+                table[key][version_column] = self._version
+        return FakeResponse(201, None if "return=minimal" in prefer else rows)
+
+    def _delete(self, table, params) -> FakeResponse:
+        doomed = {id(row) for row in self._filter(table, params)}
+        for key in [k for k, row in table.items() if id(row) in doomed]:
+            del table[key]
+        return FakeResponse(204)
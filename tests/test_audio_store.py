@@ -0,0 +1,115 @@
+"""
+Tests for audio_store module.
+"""
+import os
+import time
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import audio_store
+from audio_store import audio_key, evict, get_audio, has_audio, put_audio
+
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, monkeypatch):
+    """Run every test against an empty store in a temp directory."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(audio_store, "_total_bytes", {})
+    return tmp_path / "audio_store"
+
+
+def set_age(key, seconds_ago):
+    """Backdate a blob's access time for LRU tests."""
+    path = audio_store._blob_path(key)
+    stamp = time.time() - seconds_ago
+    os.utime(path, (stamp, stamp))
+
+
+class TestAudioKey:
+    """Tests for content-addressed keys."""
+
+    def test_key_is_deterministic(self):
+        """Test that the same text and voice give the same key."""
+        assert audio_key("Жили-были", "ru-RU-DmitryNeural") == audio_key("Жили-были", "ru-RU-DmitryNeural")
+
+    def test_key_depends_on_voice_and_text(self):
+        """Test that changing either the voice or the text changes the key."""
+        base = audio_key("Жили-были", "ru-RU-DmitryNeural")
+        assert audio_key("Жили-были", "ru-RU-SvetlanaNeural") != base
+        assert audio_key("Жили-были.", "ru-RU-DmitryNeural") != base
+
+
+class TestPutGet:
+    """Tests for storing and reading blobs."""
+
+    def test_roundtrip(self, store_dir):
+        """Test that stored audio is returned as BytesIO."""
+        key = audio_key("text", "voice")
+        put_audio(key, b"mp3 data")
+
+        assert has_audio(key)
+        assert get_audio(key).getvalue() == b"mp3 data"
+
+    def test_sharded_layout(self, store_dir):
+        """Test that blobs live under two levels of hex shards."""
+        key = audio_key("text", "voice")
+        put_audio(key, b"mp3 data")
+
+        assert (store_dir / key[:2] / key[2:4] / f"{key}.mp3").exists()
+
+    def test_missing_returns_none(self):
+        """Test that an unknown key returns None."""
+        assert get_audio(audio_key("nothing", "voice")) is None
+        assert not has_audio(audio_key("nothing", "voice"))
+
+    def test_dedupe(self, store_dir):
+        """Test that storing the same key twice keeps one file and the first content."""
+        key = audio_key("text", "voice")
+        put_audio(key, b"first")
+        put_audio(key, b"second")
+
+        files = [f for _, _, names in os.walk(store_dir) for f in names]
+        assert files == [f"{key}.mp3"]
+        assert get_audio(key).getvalue() == b"first"
+
+
+class TestEviction:
+    """Tests for size-capped LRU eviction."""
+
+    def test_least_recently_used_evicted_first(self, monkeypatch):
+        """Test that going over the cap evicts the oldest-accessed blobs."""
+        monkeypatch.setattr(audio_store, "AUDIO_STORE_MAX_BYTES", 350)
+        keys = [audio_key(f"story {i}", "voice") for i in range(3)]
+        for i, key in enumerate(keys):
+            put_audio(key, b"x" * 100)
+            set_age(key, 100 - i * 10)
+        # Чтение «освежает» самую старую озвучку
+        get_audio(keys[0])
+
+        put_audio(audio_key("story 3", "voice"), b"x" * 100)
+
+        assert not has_audio(keys[1])
+        assert has_audio(keys[0])
+        assert has_audio(keys[2])
+        assert has_audio(audio_key("story 3", "voice"))
+
+    def test_under_cap_keeps_everything(self, monkeypatch):
+        """Test that nothing is evicted below the cap."""
+        monkeypatch.setattr(audio_store, "AUDIO_STORE_MAX_BYTES", 1000)
+        keys = [audio_key(f"story {i}", "voice") for i in range(3)]
+        for key in keys:
+            put_audio(key, b"x" * 100)
+
+        assert all(has_audio(key) for key in keys)
+
+    def test_explicit_evict_returns_freed_bytes(self):
+        """Test that evict() trims to the target ratio of the given limit."""
+        keys = [audio_key(f"story {i}", "voice") for i in range(4)]
+        for i, key in enumerate(keys):
+            put_audio(key, b"x" * 100)
+            set_age(key, 100 - i * 10)
+
+        assert evict(max_bytes=300) == 200
+        assert [has_audio(key) for key in keys] == [False, False, True, True]
@@ -0,0 +1,19 @@
+"""Smoke test for the prompt benchmark harness."""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import bench_prompts
+import prompts
+
+
+def test_measure():
+    """Test that every age bucket is measured in all three modes."""
+    result = bench_prompts.measure(iterations=5)
+    assert set(result) == {bucket for _, bucket in prompts.AGE_BUCKETS} | {prompts.ADULT_BUCKET}
+    for row in result.values():
+        assert row["cold_us"] > 0 and row["compiled_us"] > 0 and row["memoized_us"] > 0
+    json.dumps(result)
@@ -0,0 +1,33 @@
+"""Smoke test for the storage benchmark harness."""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import pytest
+
+import bench_storage
+
+
+@pytest.mark.parametrize("backend", bench_storage.BACKENDS)
+def test_prepare_and_measure(backend, tmp_path, monkeypatch):
+    """Test that a tiny library is generated and every operation is measured."""
+    import storage
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", backend)
+    monkeypatch.setattr(storage, "_journal_states", {})
+    monkeypatch.setattr(storage, "_supabase_http", None)
+    monkeypatch.setenv("SUPABASE_URL", "http://supabase.test")
+    monkeypatch.setenv("SUPABASE_KEY", "test-key")
+
+    bench_storage.prepare(backend, 50)
+    result = bench_storage.measure(backend, 50, iterations=3)
+
+    assert result["backend"] == backend
+    assert {"load_cold", "list_first_page", "get", "save_new", "delete", "search"} <= set(result["ops"])
+    assert all(op["median_ms"] >= 0 for op in result["ops"].values())
+    json.dumps(result)
+    # Stories saved during the run are deleted again
+    assert len(storage.load_stories()) == 50
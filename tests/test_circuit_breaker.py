@@ -0,0 +1,156 @@
+"""
+Tests for circuit_breaker module.
+"""
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from circuit_breaker import (
+    CircuitBreaker, BreakerRegistry, CircuitOpenError, is_model_failure, CLOSED, OPEN, HALF_OPEN,
+)
+
+
+class ManualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock):
+    return CircuitBreaker("m", window=4, min_calls=3, failure_rate=0.5, cooldown=10, clock=clock)
+
+
+class TestCircuitBreaker:
+    """Tests for the closed / open / half-open state machine."""
+
+    def test_stays_closed_below_min_calls(self):
+        """Test that failures do not open the circuit before min_calls outcomes."""
+        breaker = make_breaker(ManualClock())
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+        assert breaker.allow()
+
+    def test_opens_on_failure_rate(self):
+        """Test that the circuit opens once the failure rate in the window reaches the threshold."""
+        breaker = make_breaker(ManualClock())
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        assert not breaker.allow()
+
+    def test_window_forgets_old_failures(self):
+        """Test that only the last `window` calls count toward the failure rate."""
+        breaker = make_breaker(ManualClock())
+        breaker.record_failure()
+        for _ in range(4):
+            breaker.record_success()
+        breaker.record_failure()
+        assert breaker.snapshot() == {"state": CLOSED, "calls": 4, "failures": 1}
+
+    def test_half_open_allows_single_probe(self):
+        """Test that after the cool-down exactly one probe request is let through."""
+        clock = ManualClock()
+        breaker = make_breaker(clock)
+        for _ in range(3):
+            breaker.record_failure()
+        clock.now = 9.9
+        assert not breaker.allow()
+        clock.now = 10
+        assert breaker.state == HALF_OPEN
+        assert breaker.allow()
+        assert not breaker.allow()
+
+    def test_probe_success_closes(self):
+        """Test that a successful probe closes the circuit with a clean window."""
+        clock = ManualClock()
+        breaker = make_breaker(clock)
+        for _ in range(3):
+            breaker.record_failure()
+        clock.now = 10
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.snapshot() == {"state": CLOSED, "calls": 1, "failures": 0}
+        assert breaker.allow()
+
+    def test_probe_failure_reopens(self):
+        """Test that a failed probe opens the circuit for another cool-down."""
+        clock = ManualClock()
+        breaker = make_breaker(clock)
+        for _ in range(3):
+            breaker.record_failure()
+        clock.now = 10
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        clock.now = 19
+        assert not breaker.allow()
+        clock.now = 20
+        assert breaker.allow()
+
+    def test_release_frees_probe(self):
+        """Test that a cancelled probe lets the next request probe instead."""
+        clock = ManualClock()
+        breaker = make_breaker(clock)
+        for _ in range(3):
+            breaker.record_failure()
+        clock.now = 10
+        assert breaker.allow()
+        breaker.release()
+        assert breaker.allow()
+
+    def test_registry(self):
+        """Test that the registry keeps one breaker per model and reports their state."""
+        registry = BreakerRegistry(window=4, min_calls=1, failure_rate=1.0, cooldown=10)
+        assert registry.get("a") is registry.get("a")
+        registry.get("a").record_failure()
+        registry.get("b").record_success()
+        assert registry.stats() == {
+            "a": {"state": OPEN, "calls": 1, "failures": 1},
+            "b": {"state": CLOSED, "calls": 1, "failures": 0},
+        }
+        assert str(CircuitOpenError("a")) == "Circuit open for model a"
+
+
+class ResourceExhausted(Exception):
+    """Stands in for google.api_core.exceptions.ResourceExhausted."""
+
+
+class ServerError(Exception):
+    pass
+
+
+class ServiceUnavailable(ServerError):
+    """Matched through its base class name, like api_core's 5xx hierarchy."""
+
+
+class HttpError(Exception):
+    def __init__(self, code):
+        super().__init__("request failed")
+        self.code = code
+
+
+class TestIsModelFailure:
+    """Tests for which errors count against a model's circuit."""
+
+    def test_service_failures(self):
+        """Test that rate limits, 5xx and timeouts are model failures."""
+        for error in (
+            ResourceExhausted("quota"), ServiceUnavailable("down"), TimeoutError("read timed out"),
+            HttpError(429), HttpError(503), RuntimeError("429 Resource has been exhausted"),
+            RuntimeError("500 Internal error encountered."),
+        ):
+            assert is_model_failure(error), error
+
+    def test_request_errors_are_neutral(self):
+        """Test that blocked or empty responses, 400s and local bugs are not model failures."""
+        for error in (
+            ValueError("response was blocked"), ValueError("Model a returned an empty response"),
+            HttpError(400), RuntimeError("400 API key not valid"), KeyError("text"),
+            RuntimeError("reset after 500 chars"),
+        ):
+            assert not is_model_failure(error), error
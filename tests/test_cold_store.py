@@ -0,0 +1,70 @@
+"""
+Tests for cold_store module.
+"""
+import zlib
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import cold_store
+from cold_store import ColdStore, compress, decompress
+
+
+BODY = "Жил-был однажды маленький дракон. Он жил в лесу у речки и любил смотреть на звёзды. " * 3
+
+
+class TestCompression:
+    """Tests for dictionary compression."""
+
+    def test_roundtrip(self):
+        """Test that text survives compression with the shared dictionary."""
+        assert decompress(compress(BODY), cold_store.CURRENT_ZDICT) == BODY
+
+    def test_dictionary_beats_plain_zlib(self):
+        """Test that the shared dictionary improves the ratio on short stories."""
+        assert len(compress(BODY)) < len(zlib.compress(BODY.encode("utf-8"), 9))
+
+    def test_published_dictionaries_are_frozen(self):
+        """Test that blobs written with dictionary v1 stay readable."""
+        assert decompress(compress("Once upon a time", 1), 1) == "Once upon a time"
+
+
+class TestColdStore:
+    """Tests for the cold body database."""
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        return ColdStore(str(tmp_path / "stories.cold.db"))
+
+    def test_put_and_get_many(self, store):
+        """Test batch storage and retrieval."""
+        store.put_many([("a", BODY), ("b", "Once upon a time")])
+        assert store.get_many(["a", "b", "missing"]) == {"a": BODY, "b": "Once upon a time"}
+
+    def test_get_records_access(self, store):
+        """Test that opening a cold story remembers the access time."""
+        store.put_many([("a", BODY)])
+        assert store.get("a") == BODY
+        assert set(store.access_times()) == {"a"}
+        assert store.get("missing") is None
+        assert set(store.access_times()) == {"a"}
+
+    def test_delete_many(self, store):
+        """Test that bodies are deleted and access history is kept unless asked."""
+        store.put_many([("a", BODY), ("b", BODY)])
+        store.get("a")
+        store.delete_many(["a"])
+        assert store.ids() == ["b"]
+        assert "a" in store.access_times()
+        store.delete_many(["a"], forget_access=True)
+        assert store.access_times() == {}
+
+    def test_stats(self, store):
+        """Test that stats report raw, stored and saved bytes."""
+        assert store.stats() == {"stories": 0, "raw_bytes": 0, "stored_bytes": 0, "saved_bytes": 0}
+        store.put_many([("a", BODY)])
+        stats = store.stats()
+        assert stats["stories"] == 1
+        assert stats["raw_bytes"] == len(BODY.encode("utf-8"))
+        assert stats["saved_bytes"] == stats["raw_bytes"] - stats["stored_bytes"] > 0
@@ -0,0 +1,69 @@
+"""
+Tests for fingerprint module.
+"""
+import random
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import fingerprint
+from fingerprint import bands, hamming_distance, simhash
+from search_index import tokenize
+
+VOCABULARY = [f"слово{i}" for i in range(1000)]
+
+
+def make_words(seed: int, count: int = 300):
+    rng = random.Random(seed)
+    return [rng.choice(VOCABULARY) for _ in range(count)]
+
+
+class TestSimHash:
+    """Tests for SimHash fingerprints."""
+
+    def test_short_text_has_no_fingerprint(self):
+        """Test that texts shorter than MIN_WORDS are not fingerprinted."""
+        assert simhash(tokenize("Жил-был дракон.")) is None
+
+    def test_deterministic_and_64_bit(self):
+        """Test that the fingerprint is stable across calls and fits in 64 bits."""
+        words = make_words(1)
+        assert simhash(words) == simhash(list(words))
+        assert 0 <= simhash(words) < 2 ** 64
+
+    def test_small_edit_stays_close(self):
+        """Test that replacing one word moves the fingerprint by a few bits."""
+        words = make_words(2)
+        edited = list(words)
+        edited[150] = "дракон"
+        assert hamming_distance(simhash(words), simhash(edited)) <= 5
+
+    def test_unrelated_texts_are_far(self):
+        """Test that different stories are far apart."""
+        assert hamming_distance(simhash(make_words(3)), simhash(make_words(4))) > 10
+
+
+class TestBands:
+    """Tests for LSH banding."""
+
+    def test_bands_cover_all_bits(self):
+        """Test that bands reassemble into the original fingerprint."""
+        value = simhash(make_words(5))
+        width, extra = divmod(fingerprint.FINGERPRINT_BITS, fingerprint.BANDS)
+        restored, shift = 0, 0
+        for band, part in enumerate(bands(value)):
+            restored |= part << shift
+            shift += width + (band < extra)
+        assert shift == 64
+        assert restored == value
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_close_fingerprints_share_a_band(self, seed):
+        """Test the pigeonhole guarantee for distances below BANDS."""
+        rng = random.Random(seed)
+        value = rng.getrandbits(64)
+        other = value
+        for bit in rng.sample(range(64), fingerprint.BANDS - 1):
+            other ^= 1 << bit
+        assert any(a == b for a, b in zip(bands(value), bands(other)))
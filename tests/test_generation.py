@@ -0,0 +1,294 @@
+"""
+Tests for generation module (streaming generation over the model cascade).
+"""
+import threading
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from generation import (
+    stream_story, split_story, clean_title, first_paragraph_ready,
+    GenerationError, StreamInterrupted, FirstChunkLatency, hedge_stats,
+)
+from circuit_breaker import BreakerRegistry, CircuitOpenError, OPEN
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Yields the given pieces as stream chunks; an exception instance is raised instead."""
+
+    def __init__(self, pieces, calls):
+        self.pieces = pieces
+        self.calls = calls
+
+    def generate_content(self, prompt, stream=False):
+        assert stream is True
+        self.calls.append(prompt)
+        for piece in self.pieces:
+            if isinstance(piece, BaseException):
+                raise piece
+            yield FakeChunk(piece)
+
+
+class BlockedModel:
+    """Sends nothing until released, then yields its pieces."""
+
+    def __init__(self, release, pieces):
+        self.release = release
+        self.pieces = pieces
+
+    def generate_content(self, prompt, stream=False):
+        self.release.wait(5)
+        for piece in self.pieces:
+            yield FakeChunk(piece)
+
+
+def factory(responses, calls=None):
+    calls = [] if calls is None else calls
+    return lambda name: FakeModel(responses[name], calls)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+class TestSplitStory:
+    """Tests for splitting a model response into title and body."""
+
+    def test_title_is_first_line_without_markup(self):
+        """Test that markdown heading and bold markers are stripped from the title."""
+        assert split_story("## **Лесная сказка**\nЖил-был ёжик.\nКонец.") == ("Лесная сказка", "Жил-был ёжик.\nКонец.")
+
+    def test_single_line_has_no_title(self):
+        """Test that a one-line response is all body."""
+        assert split_story("  Жил-был ёжик.  ") == (None, "Жил-был ёжик.")
+
+    def test_clean_title(self):
+        """Test title cleanup on its own."""
+        assert clean_title("# *Title* ") == "Title"
+
+    def test_first_paragraph_ready(self):
+        """Test that the first paragraph counts once it is terminated by a newline."""
+        assert not first_paragraph_ready("Title\nOnce upon")
+        assert not first_paragraph_ready("Title\n\n")
+        assert first_paragraph_ready("Title\n\nOnce upon a time.\n")
+
+
+class TestStreamStory:
+    """Tests for streaming generation with cascade fallback."""
+
+    def test_streams_accumulated_text(self):
+        """Test that on_text sees the growing response and the result has the full text."""
+        seen = []
+        result = stream_story("p", ["a"], factory({"a": ["Title\n", "", "Once ", "upon.\n"]}), on_text=seen.append)
+        assert seen == ["Title\n", "Title\nOnce ", "Title\nOnce upon.\n"]
+        assert result.text == "Title\nOnce upon.\n"
+        assert result.model == "a"
+
+    def test_falls_back_before_first_chunk(self):
+        """Test that an error before any text moves on to the next model."""
+        calls = []
+        responses = {"a": [RuntimeError("429")], "b": ["", ValueError("blocked")], "c": ["Title\nBody"]}
+        result = stream_story("p", ["a", "b", "c"], factory(responses, calls))
+        assert result.model == "c"
+        assert calls == ["p", "p", "p"]
+
+    def test_empty_stream_falls_back(self):
+        """Test that a stream without text is treated as a failed attempt."""
+        result = stream_story("p", ["a", "b"], factory({"a": ["", " "], "b": ["Title\nBody"]}))
+        assert result.model == "b"
+
+    def test_interrupted_after_first_chunk(self):
+        """Test that a mid-stream error is not retried and keeps the partial text."""
+        calls = []
+        responses = {"a": ["Title\n", "Once", RuntimeError("reset")], "b": ["Title\nBody"]}
+        with pytest.raises(StreamInterrupted) as info:
+            stream_story("p", ["a", "b"], factory(responses, calls))
+        assert info.value.model == "a"
+        assert info.value.partial == "Title\nOnce"
+        assert str(info.value.last_error) == "reset"
+        assert calls == ["p"]
+
+    def test_all_models_fail(self):
+        """Test that the last error is reported when the whole cascade fails."""
+        responses = {"a": [RuntimeError("first")], "b": [RuntimeError("second")]}
+        with pytest.raises(GenerationError) as info:
+            stream_story("p", ["a", "b"], factory(responses))
+        assert not isinstance(info.value, StreamInterrupted)
+        assert str(info.value.last_error) == "second"
+        with pytest.raises(GenerationError):
+            stream_story("p", [], factory({}))
+
+    def test_latency_measured_from_cascade_start(self):
+        """Test that time to first paragraph is taken when a paragraph completes, before the total."""
+        responses = {"a": [RuntimeError("down")], "b": ["Title\n", "Para one.\n", "Para two."]}
+        result = stream_story("p", ["a", "b"], factory(responses), clock=FakeClock())
+        assert 0 < result.first_paragraph < result.total
+
+    def test_single_paragraph_latency_is_total(self):
+        """Test that a response without a finished paragraph reports total latency for both."""
+        result = stream_story("p", ["a"], factory({"a": ["Title\nOnly one"]}), clock=FakeClock())
+        assert result.first_paragraph == result.total > 0
+
+
+class TestFirstChunkLatency:
+    """Tests for the per-model hedge delay."""
+
+    def test_default_until_enough_samples(self):
+        """Test that the default delay is used until min_samples observations exist."""
+        latency = FirstChunkLatency(percentile=95, window=100, min_samples=3, default=8.0, floor=0.5)
+        latency.observe("a", 1.0)
+        latency.observe("a", 2.0)
+        assert latency.hedge_delay("a") == 8.0
+        latency.observe("a", 3.0)
+        assert latency.hedge_delay("a") == 3.0
+        assert latency.hedge_delay("b") == 8.0
+
+    def test_percentile_window_and_floor(self):
+        """Test the percentile over the recent window, bounded below by the floor."""
+        latency = FirstChunkLatency(percentile=50, window=4, min_samples=1, default=8.0, floor=0.0)
+        for seconds in (9.0, 9.0, 9.0, 9.0, 0.1, 0.1, 0.2, 2.0):
+            latency.observe("a", seconds)
+        assert latency.hedge_delay("a") == 0.2
+        latency = FirstChunkLatency(percentile=95, window=10, min_samples=1, default=8.0, floor=0.5)
+        latency.observe("a", 0.1)
+        assert latency.hedge_delay("a") == 0.5
+
+
+class TestHedging:
+    """Tests for hedged requests across the cascade."""
+
+    def latency(self, delay):
+        return FirstChunkLatency(percentile=95, window=10, min_samples=100, default=delay, floor=0.0)
+
+    def test_slow_model_is_hedged(self):
+        """Test that a hung model is raced by the next one and the faster answer wins."""
+        release = threading.Event()
+        models = {"slow": BlockedModel(release, ["Slow\nstory"]), "fast": FakeModel(["Fast\nstory"], [])}
+        before = hedge_stats()
+        try:
+            result = stream_story("p", ["slow", "fast"], models.__getitem__, hedging=True, latency=self.latency(0.05))
+        finally:
+            release.set()
+        assert result.model == "fast"
+        assert result.text == "Fast\nstory"
+        after = hedge_stats()
+        assert after["requests"] == before["requests"] + 1
+        assert after["hedged"] == before["hedged"] + 1
+        assert after["hedge_wins"] == before["hedge_wins"] + 1
+        assert after["saved_latency_total"] >= before["saved_latency_total"]
+        assert 0 < after["hedge_rate"] <= 1
+
+    def test_fast_model_is_not_hedged(self):
+        """Test that no hedge starts when the first model answers within the delay."""
+        calls = []
+        before = hedge_stats()
+        result = stream_story(
+            "p", ["a", "b"], factory({"a": ["A\nstory"], "b": ["B\nstory"]}, calls),
+            hedging=True, latency=self.latency(5.0),
+        )
+        assert result.model == "a"
+        assert calls == ["p"]
+        assert hedge_stats()["hedged"] == before["hedged"]
+
+    def test_primary_can_still_win(self):
+        """Test that the primary wins if it answers before the hedge, and the hedge is cancelled."""
+        release_primary = threading.Event()
+        release_hedge = threading.Event()
+        models = {"a": BlockedModel(release_primary, ["A\nstory"]), "b": BlockedModel(release_hedge, ["B\nstory"])}
+        timer = threading.Timer(0.2, release_primary.set)
+        timer.start()
+        try:
+            result = stream_story("p", ["a", "b"], models.__getitem__, hedging=True, latency=self.latency(0.05))
+        finally:
+            release_hedge.set()
+            timer.cancel()
+        assert result.model == "a"
+
+    def test_hedging_observes_latency(self):
+        """Test that the winner's time to first chunk feeds the model's percentile."""
+        latency = FirstChunkLatency(percentile=95, window=10, min_samples=1, default=8.0, floor=0.0)
+        stream_story("p", ["a"], factory({"a": ["A\nstory"]}), latency=latency)
+        assert latency.hedge_delay("a") < 8.0
+
+
+class TestCircuitBreakers:
+    """Tests for skipping models whose circuit breaker is open."""
+
+    def registry(self):
+        return BreakerRegistry(window=10, min_calls=2, failure_rate=0.5, cooldown=60)
+
+    def test_failing_model_is_skipped(self):
+        """Test that once a model's circuit opens the cascade stops calling it."""
+        breakers = self.registry()
+        calls = []
+        models = {"bad": FakeModel([RuntimeError("429")], calls), "good": FakeModel(["Title\nBody"], [])}
+        for _ in range(2):
+            assert stream_story("p", ["bad", "good"], models.__getitem__, breakers=breakers).model == "good"
+        assert len(calls) == 2
+        assert breakers.get("bad").state == OPEN
+        assert stream_story("p", ["bad", "good"], models.__getitem__, breakers=breakers).model == "good"
+        assert len(calls) == 2
+        assert breakers.stats()["good"]["failures"] == 0
+
+    def test_all_circuits_open(self):
+        """Test that the cascade fails fast when every model is switched off."""
+        breakers = self.registry()
+        for _ in range(2):
+            breakers.get("a").record_failure()
+        with pytest.raises(GenerationError) as info:
+            stream_story("p", ["a"], factory({}), breakers=breakers)
+        assert isinstance(info.value.last_error, CircuitOpenError)
+
+    def test_interrupted_stream_counts_as_failure(self):
+        """Test that a mid-stream timeout is recorded against the model."""
+        breakers = BreakerRegistry(window=10, min_calls=5, failure_rate=0.5, cooldown=60)
+        with pytest.raises(StreamInterrupted):
+            stream_story("p", ["a"], factory({"a": ["Title\n", TimeoutError("read timed out")]}), breakers=breakers)
+        assert breakers.stats()["a"] == {"state": "closed", "calls": 2, "failures": 1}
+
+    def test_request_errors_do_not_open_circuit(self):
+        """Test that blocked prompts and local errors leave a healthy model switched on."""
+        breakers = self.registry()
+        responses = {"a": [ValueError("response was blocked")], "b": ["Title\nBody"]}
+        for _ in range(5):
+            assert stream_story("p", ["a", "b"], factory(responses), breakers=breakers).model == "b"
+        with pytest.raises(StreamInterrupted):
+            stream_story("p", ["a"], factory({"a": ["Title\n", KeyError("text")]}), breakers=breakers)
+        assert breakers.stats()["a"] == {"state": "closed", "calls": 1, "failures": 0}
+
+    def test_neutral_error_releases_probe(self):
+        """Test that a half-open probe ending in a request error lets the next probe through."""
+        breakers = BreakerRegistry(window=10, min_calls=1, failure_rate=0.5, cooldown=0)
+        breakers.get("a").record_failure()
+        with pytest.raises(GenerationError):
+            stream_story("p", ["a"], factory({"a": [ValueError("blocked")]}), breakers=breakers)
+        assert breakers.get("a").state == "half_open"
+        assert breakers.get("a").allow()
+
+    def test_cancelled_hedge_releases_probe(self):
+        """Test that a half-open probe that loses a hedge race does not block later probes."""
+        breakers = BreakerRegistry(window=10, min_calls=1, failure_rate=0.5, cooldown=0)
+        breakers.get("slow").record_failure()
+        release = threading.Event()
+        models = {"slow": BlockedModel(release, ["Slow\nstory"]), "fast": FakeModel(["Fast\nstory"], [])}
+        latency = FirstChunkLatency(percentile=95, window=10, min_samples=100, default=0.05, floor=0.0)
+        try:
+            result = stream_story(
+                "p", ["slow", "fast"], models.__getitem__, hedging=True, latency=latency, breakers=breakers
+            )
+        finally:
+            release.set()
+        assert result.model == "fast"
+        assert breakers.get("slow").state == "half_open"
+        assert breakers.get("slow").allow()
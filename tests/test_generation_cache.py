@@ -0,0 +1,73 @@
+"""
+Tests for generation_cache module.
+"""
+import sqlite3
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from generation_cache import GenerationCache, cache_key
+
+KEY = cache_key("prompt")
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return GenerationCache(str(tmp_path / "generation_cache.db"), ttl=100, max_entries=2, variants=2)
+
+
+class TestGenerationCache:
+    """Tests for the disk-backed generation cache."""
+
+    def test_key_depends_on_prompt(self):
+        """Test that keys are stable and differ between prompts."""
+        assert cache_key("prompt") == KEY
+        assert cache_key("prompt!") != KEY
+
+    def test_miss_then_hit(self, cache):
+        """Test that a stored response is served back with its model."""
+        assert cache.get(KEY, now=0) is None
+        cache.put(KEY, "Story", "gemini-flash", now=1)
+        assert cache.get(KEY, now=2) == ("Story", "gemini-flash")
+        assert cache.stats() == {"entries": 1, "variants": 1, "hits": 1, "misses": 1}
+
+    def test_variants_rotate_and_are_capped(self, cache):
+        """Test that variants are served in turn and only the newest are kept."""
+        for i, text in enumerate(["A", "B", "C"], start=1):
+            cache.put(KEY, text, "m", now=i)
+        served = [cache.get(KEY, now=10 + i)[0] for i in range(4)]
+        assert served == ["B", "C", "B", "C"]
+        assert cache.stats()["variants"] == 2
+
+    def test_ttl(self, cache):
+        """Test that expired responses are not served and get purged."""
+        cache.put(KEY, "Old", "m", now=0)
+        assert cache.get(KEY, now=150) is None
+        cache.put(cache_key("other"), "New", "m", now=150)
+        assert cache.stats()["entries"] == 1
+
+    def test_lru_eviction(self, cache):
+        """Test that least recently requested keys are evicted beyond max_entries."""
+        first, second, third = (cache_key(p) for p in ("1", "2", "3"))
+        cache.put(first, "1", "m", now=1)
+        cache.put(second, "2", "m", now=2)
+        cache.get(first, now=3)
+        cache.put(third, "3", "m", now=4)
+        assert cache.get(second, now=5) is None
+        assert cache.get(first, now=5) == ("1", "m")
+        assert cache.get(third, now=5) == ("3", "m")
+
+    def test_shared_between_instances(self, cache):
+        """Test that another process (instance) sees the same entries and counters."""
+        cache.put(KEY, "Story", "m", now=1)
+        other = GenerationCache(cache.path, ttl=100)
+        assert other.get(KEY, now=2) == ("Story", "m")
+        assert cache.stats()["hits"] == 1
+
+    def test_unreadable_database(self, tmp_path):
+        """Test that a broken cache file surfaces as sqlite3.Error for the caller to log."""
+        path = tmp_path / "broken.db"
+        path.write_bytes(b"not a database" * 100)
+        with pytest.raises(sqlite3.Error):
+            GenerationCache(str(path)).get(KEY)
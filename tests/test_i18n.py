@@ -2,7 +2,7 @@
 Тесты для модуля интернационализации (i18n).
 """
 import pytest
-from i18n import t, get_translations, get_genre_list, get_age_ranges, TRANSLATIONS
+from i18n import t, get_translations, get_genre_list, get_genre_key, get_age_ranges, TRANSLATIONS
 
 
 class TestTranslationFunction:
@@ -103,6 +103,24 @@ class TestGetGenreList:
         assert genres_en == sorted(genres_en)
 
 
+class TestGetGenreKey:
+    """Тесты функции get_genre_key()"""
+    
+    def test_key_is_language_independent(self):
+        """Проверка что один жанр на разных языках даёт один ключ"""
+        assert get_genre_key("Сказка", 'ru') == "fairytale"
+        assert get_genre_key("Fairy Tale", 'en') == "fairytale"
+    
+    def test_every_listed_genre_has_key(self):
+        """Проверка что у каждого жанра из списка есть ключ"""
+        for lang in ('ru', 'en'):
+            assert all(get_genre_key(genre, lang) for genre in get_genre_list(lang))
+    
+    def test_unknown_genre(self):
+        """Проверка неизвестного названия"""
+        assert get_genre_key("Опера", 'ru') is None
+
+
 class TestGetAgeRanges:
     """Тесты функции get_age_ranges()"""
     
@@ -0,0 +1,86 @@
+"""
+Tests for prompts module.
+"""
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import prompts
+from config import AGE_RANGES
+from prompts import age_bucket, build_story_prompt
+
+
+def _prompt(**changes):
+    fields = dict(name="Маша", gender="girl", age=5, age_label="🧒 4-7 лет", genre="Сказка",
+                  hobbies="кошки", lang="ru", words=500)
+    fields.update(changes)
+    return build_story_prompt(**fields)
+
+
+class TestAgeBucket:
+    """Tests for age bucketing."""
+
+    @pytest.mark.parametrize("age,bucket", [
+        (0, "baby"), (0.5, "baby"), (1, "toddler"), (3, "toddler"), (3.5, "toddler"),
+        (4, "preschool"), (7, "preschool"), (8, "school"), (12, "school"),
+        (13, "teen"), (17, "teen"), (18, "adult"), (25, "adult"),
+    ])
+    def test_boundaries(self, age, bucket):
+        """Test that every age falls into the expected bucket."""
+        assert age_bucket(age) == bucket
+
+    def test_form_ages_cover_all_buckets(self):
+        """Test that each age option of the form gets its own bucket."""
+        assert len({age_bucket(age) for age in AGE_RANGES.values()}) == len(AGE_RANGES)
+
+
+class TestBuildStoryPrompt:
+    """Tests for prompt construction."""
+
+    def test_fills_form_fields(self):
+        """Test that the dynamic fields and static instructions are present."""
+        prompt = _prompt()
+        assert prompt.startswith("Ты — сказочник Disney.")
+        assert 'в жанре "Сказка"' in prompt
+        assert "возраста 5 лет (категория: 🧒 4-7 лет)" in prompt
+        assert "девочка по имени Маша" in prompt
+        assert "Интегрируй интересы/детали: кошки." in prompt
+        assert "Около 500 слов" in prompt
+        assert prompt.rstrip().endswith("Финал: Счастливый и поучительный.")
+        assert not any(marker in prompt for marker in ("<role>", "<gender>", "<style>", "<ending>"))
+
+    @pytest.mark.parametrize("lang,gender,expected", [
+        ("en", "boy", "a boy named Маша"),
+        ("en", "auto", "Determine gender from the name"),
+        ("ru", "boy", "мальчик по имени Маша"),
+        ("de", "auto", "Определи пол по имени"),
+        ("ru", "unknown", "Определи пол по имени"),
+    ])
+    def test_gender_instruction(self, lang, gender, expected):
+        """Test the language and gender specific instruction."""
+        assert expected in _prompt(lang=lang, gender=gender)
+
+    def test_age_specific_instructions(self):
+        """Test that each bucket brings its own role and ending."""
+        assert "Колыбельная" in _prompt(age=0)
+        assert "Герой: Маша." in _prompt(age=2)
+        assert "для ВЗРОСЛОГО (25 лет)" in _prompt(age=25)
+        assert len({_prompt(age=age) for age in AGE_RANGES.values()}) == len(AGE_RANGES)
+
+    def test_no_indentation_leaks(self):
+        """Test that template lines are not indented."""
+        assert all(not line.startswith(" ") for line in _prompt(age=25).splitlines())
+
+    def test_user_input_is_not_a_template(self):
+        """Test that braces typed by the user are inserted literally."""
+        assert "{words}" in _prompt(hobbies="{words}")
+
+    def test_memoized_on_normalized_inputs(self):
+        """Test that whitespace variants hit the same cache entry."""
+        prompts._build.cache_clear()
+        first = _prompt(name=" Маша ", hobbies="кошки  и   собаки")
+        assert _prompt(name="Маша", hobbies="кошки и собаки") is first
+        assert _prompt(hobbies=None) == _prompt(hobbies="")
+        info = prompts._build.cache_info()
+        assert info.hits >= 1 and info.currsize <= prompts.PROMPT_CACHE_SIZE
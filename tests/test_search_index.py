@@ -0,0 +1,175 @@
+"""
+Tests for search_index module.
+"""
+import sqlite3
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from fingerprint import simhash
+from search_index import SearchIndex, build_match_query, normalize, stem, tag_value, tokenize
+
+
+class TestTokenization:
+    """Tests for normalization, tokenization and stemming."""
+
+    def test_normalize_lowercases_and_folds_yo(self):
+        """Test that ё is folded to е and text is lowercased."""
+        assert normalize("Ёжик") == "ежик"
+
+    def test_tokenize_mixed_languages(self):
+        """Test tokenizing Russian and English words with punctuation."""
+        assert tokenize("Дракон, и Dragon!") == ["дракон", "и", "dragon"]
+
+    @pytest.mark.parametrize("word, expected", [
+        ("дракону", "дракон"),
+        ("драконами", "дракон"),
+        ("сказки", "сказк"),
+        ("лисица", "лисиц"),
+        ("dragons", "dragon"),
+        ("flying", "fly"),
+        ("кот", "кот"),
+        ("cat", "cat"),
+    ])
+    def test_stem(self, word, expected):
+        """Test that a single ending is stripped, keeping a minimal stem."""
+        assert stem(word) == expected
+
+    def test_build_match_query(self):
+        """Test that every word becomes a prefix term joined with AND."""
+        assert build_match_query("Храбрые драконы") == '"храбр"* AND "дракон"*'
+
+    def test_build_match_query_ignores_noise(self):
+        """Test that punctuation-only and one-letter queries yield None."""
+        assert build_match_query("  !!! ") is None
+        assert build_match_query("и") is None
+
+
+class TestSearchIndex:
+    """Tests for the FTS5-backed SearchIndex."""
+
+    @pytest.fixture
+    def index(self, tmp_path):
+        index = SearchIndex(str(tmp_path / "search.db"))
+        index.rebuild([
+            {"id": "1", "title": "Дракон и принцесса", "body": "Жил-был добрый дракон.", "created_at": "2026-01-01"},
+            {"id": "2", "title": "Ёжик в тумане", "body": "Ёжик шёл к медвежонку.", "created_at": "2026-01-02"},
+            {"id": "3", "title": "The Brave Knight", "body": "A knight met two dragons.", "created_at": "2026-01-03"},
+        ], source_signature=[1])
+        return index
+
+    def test_russian_inflection_matches(self, index):
+        """Test that an inflected Russian query finds the story."""
+        assert [r["id"] for r in index.search("драконом")] == ["1"]
+
+    def test_yo_folding(self, index):
+        """Test that queries with е match text written with ё."""
+        assert [r["id"] for r in index.search("ежик")] == ["2"]
+
+    def test_english_plural(self, index):
+        """Test that an English singular query matches a plural in the body."""
+        assert [r["id"] for r in index.search("dragon")] == ["3"]
+
+    def test_all_terms_required(self, index):
+        """Test that multi-word queries use AND semantics."""
+        assert [r["id"] for r in index.search("дракон принцесса")] == ["1"]
+        assert index.search("дракон туман") == []
+
+    def test_title_ranks_above_body(self, index):
+        """Test that a title match outranks a body-only match."""
+        index.upsert({"id": "4", "title": "Рыцарь", "body": "Про дракона и рыцаря.", "created_at": "2026-01-04"}, [2])
+        assert [r["id"] for r in index.search("дракон")] == ["1", "4"]
+
+    def test_results_are_summaries(self, index):
+        """Test that results carry metadata only."""
+        assert index.search("knight") == [{"id": "3", "title": "The Brave Knight", "created_at": "2026-01-03"}]
+
+    def test_upsert_replaces_and_delete_removes(self, index):
+        """Test incremental maintenance of a single story."""
+        index.upsert({"id": "1", "title": "Принцесса", "body": "Без чудовищ.", "created_at": "2026-01-01"}, [2])
+        assert index.search("дракон") == []
+
+        index.delete("1", [3])
+        assert index.search("принцесса") == []
+
+    def test_limit(self, index):
+        """Test that the limit caps the number of results."""
+        assert len(index.search("в", limit=1)) == 0
+        assert len(index.search("the", limit=1)) == 1
+
+    def test_is_synced(self, index):
+        """Test that the index remembers the source signature it was built from."""
+        assert index.is_synced([1])
+        index.delete("2", [[5, 6, 7], None])
+        assert index.is_synced([[5, 6, 7], None])
+        assert not index.is_synced([1])
+
+
+class TestNearDuplicates:
+    """Tests for fingerprint lookups in SearchIndex."""
+
+    BODY = " ".join(f"слово{i % 97} дракон{i % 13}" for i in range(150))
+
+    @pytest.fixture
+    def index(self, tmp_path):
+        index = SearchIndex(str(tmp_path / "search.db"))
+        index.rebuild([
+            {"id": "1", "title": "Оригинал", "body": self.BODY, "created_at": "2026-01-01"},
+            {"id": "2", "title": "Другая", "body": " ".join(f"knight{i}" for i in range(150)), "created_at": "2026-01-02"},
+            {"id": "3", "title": "Короткая", "body": "Жил-был дракон.", "created_at": "2026-01-03"},
+        ], source_signature=[1])
+        return index
+
+    def fingerprint(self, body):
+        return simhash(tokenize(body))
+
+    def test_finds_copy(self, index):
+        """Test that an identical body is found with distance 0."""
+        assert index.find_similar(self.fingerprint(self.BODY), 5) == [
+            {"id": "1", "title": "Оригинал", "created_at": "2026-01-01", "distance": 0}
+        ]
+
+    def test_exclude_and_delete(self, index):
+        """Test that the story itself can be excluded and deleted stories disappear."""
+        assert index.find_similar(self.fingerprint(self.BODY), 5, exclude="1") == []
+        index.delete("1", [2])
+        assert index.find_similar(self.fingerprint(self.BODY), 5) == []
+
+    def test_upsert_refreshes_fingerprint(self, index):
+        """Test that re-indexing a story replaces its fingerprint and bands."""
+        other = " ".join(f"knight{i}" for i in range(150))
+        index.upsert({"id": "1", "title": "Оригинал", "body": other, "created_at": "2026-01-01"}, [2])
+        assert index.find_similar(self.fingerprint(self.BODY), 5) == []
+        assert [m["id"] for m in index.find_similar(self.fingerprint(other), 5)] == ["1", "2"]
+
+    def test_index_from_older_version_is_not_synced(self, index):
+        """Test that an index built before fingerprints existed gets rebuilt."""
+        conn = sqlite3.connect(index.path)
+        with conn:
+            conn.execute("DELETE FROM search_meta WHERE key = 'version'")
+        conn.close()
+        assert not index.is_synced([1])
+
+
+class TestSecondaryIndexes:
+    """Tests for story_tags lookups in SearchIndex."""
+
+    def test_tag_value(self):
+        """Test that tag values are case-folded and integral floats match ints."""
+        assert tag_value("Ёжик ") == "ежик"
+        assert tag_value(5.0) == tag_value(5) == "5"
+        assert tag_value(0.5) == "0.5"
+
+    def test_query_and_reindex(self, tmp_path):
+        """Test filtering by indexed fields and that re-indexing replaces tags."""
+        index = SearchIndex(str(tmp_path / "search.db"))
+        index.rebuild([
+            {"id": "1", "title": "A", "body": "", "created_at": "2026-01-01", "child": "Маша", "genre": "fairytale"},
+            {"id": "2", "title": "B", "body": "", "created_at": "2026-01-02", "child": "Маша", "genre": None},
+        ], source_signature=[1])
+        assert [r["id"] for r in index.query({"child": "маша"}, 10)] == ["2", "1"]
+        assert [r["id"] for r in index.query({"child": "маша"}, 10, after=("2026-01-02", "2"))] == ["1"]
+        index.upsert({"id": "1", "title": "A", "body": "", "created_at": "2026-01-01", "child": "Петя"}, [2])
+        assert index.query({"genre": "fairytale"}, 10) == []
+        assert index.facets("child") == {"маша": 1, "петя": 1}
@@ -0,0 +1,73 @@
+"""
+Tests for snapshot module.
+"""
+import os
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import snapshot
+from snapshot import LibrarySnapshot, encode_snapshot, source_digest
+
+RECORDS = [
+    {"id": "b", "title": "Ёжик", "body": "Жил-был ёжик.", "created_at": "2026-01-02", "audio_key": None},
+    {"id": "a", "title": "Dragon", "body": "", "created_at": "2026-01-01", "tier": "cold"},
+]
+
+
+def write_snapshot(bodies_path, index_path, records, source_signature):
+    bodies, index = encode_snapshot(records, source_signature)
+    Path(bodies_path).write_bytes(bodies)
+    Path(index_path).write_bytes(index)
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "stories.snapshot.bin"), str(tmp_path / "stories.snapshot.idx")
+
+
+class TestSnapshot:
+    """Tests for writing and reading the mmap snapshot."""
+
+    def test_roundtrip(self, paths):
+        """Test that records come back unchanged and in library order."""
+        write_snapshot(*paths, RECORDS, [1, "x"])
+        snap = LibrarySnapshot.open(*paths)
+        assert snap.count == 2
+        assert snap.source == source_digest([1, "x"])
+        assert snap.load_all() == RECORDS
+        assert snap.get("a") == RECORDS[1]
+        assert snap.get("missing") is None
+        snap.close()
+
+    def test_empty_library(self, paths):
+        """Test that an empty library produces a valid snapshot."""
+        write_snapshot(*paths, [], None)
+        snap = LibrarySnapshot.open(*paths)
+        assert snap.load_all() == [] and snap.get("a") is None
+
+    def test_hash_collisions(self, paths, monkeypatch):
+        """Test that records sharing an ID hash are told apart by their ID."""
+        monkeypatch.setattr(snapshot, "_id_hash", lambda story_id: 7)
+        write_snapshot(*paths, RECORDS, None)
+        snap = LibrarySnapshot.open(*paths)
+        assert snap.get("a")["title"] == "Dragon"
+        assert snap.get("b")["title"] == "Ёжик"
+        assert snap.get("c") is None
+
+    def test_files_from_different_builds_are_ignored(self, paths, tmp_path):
+        """Test that a new index next to an old bodies file is not used."""
+        write_snapshot(*paths, RECORDS, None)
+        old_bodies = Path(paths[0]).read_bytes()
+        write_snapshot(*paths, RECORDS, None)
+        Path(paths[0]).write_bytes(old_bodies)
+        assert LibrarySnapshot.open(*paths) is None
+
+    def test_missing_or_truncated(self, paths):
+        """Test that absent or damaged snapshots are reported as unavailable."""
+        assert LibrarySnapshot.open(*paths) is None
+        write_snapshot(*paths, RECORDS, None)
+        with open(paths[1], "r+b") as f:
+            f.truncate(os.path.getsize(paths[1]) - 1)
+        assert LibrarySnapshot.open(*paths) is None
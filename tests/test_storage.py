@@ -175,3 +175,851 @@ class TestGetStory:
         
         found = get_story("nonexistent-id")
         assert found is None
+
+
+class TestSQLiteBackend:
+    """Tests for the SQLite storage engine."""
+
+    @pytest.fixture(autouse=True)
+    def sqlite_backend(self, tmp_path, monkeypatch):
+        import storage
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(storage, "STORAGE_BACKEND", "sqlite")
+
+    def test_save_and_load(self):
+        """Test that saved stories are returned newest first."""
+        save_story({"id": "a", "title": "Old", "body": "1", "created_at": "2026-01-01"})
+        save_story({"id": "b", "title": "New", "body": "2", "created_at": "2026-01-02"})
+
+        stories = load_stories()
+        assert [s["id"] for s in stories] == ["b", "a"]
+        assert os.path.exists("stories.db")
+        assert not os.path.exists("stories.json")
+
+    def test_save_story_update_existing(self):
+        """Test that saving the same ID upserts a single row."""
+        story = {"id": "test-id", "title": "Original", "body": "Original content"}
+        save_story(story)
+        story["title"] = "Updated"
+        save_story(story)
+
+        stories = load_stories()
+        assert len(stories) == 1
+        assert stories[0]["title"] == "Updated"
+
+    def test_audio_excluded(self):
+        """Test that BytesIO audio is not persisted."""
+        from io import BytesIO
+        save_story({"title": "With Audio", "body": "...", "audio": BytesIO(b"mp3")})
+
+        assert "audio" not in load_stories()[0]
+
+    def test_get_and_delete(self):
+        """Test get_story and delete_story."""
+        save_story({"id": "x", "title": "X", "body": "Content"})
+        assert get_story("x")["title"] == "X"
+
+        delete_story("x")
+        assert get_story("x") is None
+        assert load_stories() == []
+
+    def test_schema_has_primary_key_and_index(self):
+        """Test that the table has a PK on id and an index led by created_at."""
+        import sqlite3
+        save_story({"id": "x", "title": "X", "body": "Content"})
+
+        conn = sqlite3.connect("stories.db")
+        try:
+            pk = [row[1] for row in conn.execute("PRAGMA table_info(stories)") if row[5]]
+            index_columns = [row[2] for row in conn.execute("PRAGMA index_info(idx_stories_summary)")]
+            plan = " ".join(str(row) for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT id, title, created_at FROM stories ORDER BY created_at DESC"
+            ))
+        finally:
+            conn.close()
+        assert pk == ["id"]
+        assert index_columns == ["created_at", "id", "title"]
+        assert "COVERING INDEX idx_stories_summary" in plan
+
+    def test_list_story_summaries(self):
+        """Test that summaries carry metadata only."""
+        from storage import list_story_summaries
+        save_story({"id": "a", "title": "A", "body": "long body", "created_at": "2026-01-01"})
+        save_story({"id": "b", "title": "B", "body": "long body", "created_at": "2026-01-02"})
+
+        assert list_story_summaries() == [
+            {"id": "b", "title": "B", "created_at": "2026-01-02"},
+            {"id": "a", "title": "A", "created_at": "2026-01-01"},
+        ]
+
+    def test_existing_json_imported_on_first_open(self):
+        """Test that an existing stories.json is migrated into a new database."""
+        test_data = [
+            {"id": "1", "title": "Legacy 1", "body": "Content 1", "created_at": "2026-01-01"},
+            {"id": "2", "title": "Legacy 2", "body": "Content 2", "created_at": "2026-01-02"}
+        ]
+        with open("stories.json", "w", encoding="utf-8") as f:
+            json.dump(test_data, f)
+
+        stories = load_stories()
+        assert [s["id"] for s in stories] == ["2", "1"]
+
+    def test_import_json_stories(self, tmp_path):
+        """Test the explicit one-shot importer."""
+        from storage import import_json_stories
+        with open("legacy.json", "w", encoding="utf-8") as f:
+            json.dump([{"id": "1", "title": "Т", "body": "Текст", "created_at": "2026-01-01"}], f)
+
+        assert import_json_stories("legacy.json", "stories.db") == 1
+        # Повторный запуск не создаёт дубликатов
+        assert import_json_stories("legacy.json", "stories.db") == 1
+        assert len(load_stories()) == 1
+        assert get_story("1")["body"] == "Текст"
+
+
+class TestLoadStoriesCache:
+    """Tests for the process-wide load_stories cache."""
+
+    def test_unchanged_file_is_not_reparsed(self, tmp_path, monkeypatch):
+        """Test that repeated loads of an unchanged file skip json.load."""
+        import storage
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "1", "title": "Cached", "body": "Content"})
+        load_stories()
+
+        calls = []
+        real_load = json.load
+        monkeypatch.setattr(storage.json, "load", lambda f: calls.append(1) or real_load(f))
+
+        for _ in range(3):
+            assert load_stories()[0]["title"] == "Cached"
+        assert get_story("1")["title"] == "Cached"
+        assert calls == []
+
+    def test_external_change_is_picked_up(self, tmp_path, monkeypatch):
+        """Test that a file rewritten by another process invalidates the cache."""
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "1", "title": "Before", "body": "Content"})
+        assert load_stories()[0]["title"] == "Before"
+
+        with open("stories.json", "w", encoding="utf-8") as f:
+            json.dump([{"id": "1", "title": "After (changed)", "body": "Content"}], f)
+
+        assert load_stories()[0]["title"] == "After (changed)"
+
+    def test_save_and_delete_invalidate(self, tmp_path, monkeypatch):
+        """Test that writes through the API are visible immediately."""
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "1", "title": "One", "body": "Content"})
+        assert len(load_stories()) == 1
+
+        save_story({"id": "2", "title": "Two", "body": "Content"})
+        assert len(load_stories()) == 2
+
+        delete_story("1")
+        assert [s["id"] for s in load_stories()] == ["2"]
+
+    def test_returned_stories_do_not_alias_cache(self, tmp_path, monkeypatch):
+        """Test that callers mutating returned dicts don't corrupt the cache."""
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "1", "title": "Original", "body": "Content"})
+
+        loaded = load_stories()
+        loaded[0]["audio"] = None
+        loaded[0]["title"] = "Mutated"
+        loaded.clear()
+
+        stories = load_stories()
+        assert stories[0]["title"] == "Original"
+        assert "audio" not in stories[0]
+
+
+class TestJournalBackend:
+    """Tests for the append-only journal storage mode."""
+
+    @pytest.fixture(autouse=True)
+    def journal_backend(self, tmp_path, monkeypatch):
+        import storage
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(storage, "STORAGE_BACKEND", "journal")
+        monkeypatch.setattr(storage, "_journal_states", {})
+
+    @staticmethod
+    def read_journal():
+        with open("stories.journal", "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def test_writes_append_to_journal(self):
+        """Test that saves and deletes append records instead of rewriting the snapshot."""
+        save_story({"id": "a", "title": "A", "body": "1", "created_at": "2026-01-01"})
+        save_story({"id": "b", "title": "B", "body": "2", "created_at": "2026-01-02"})
+        delete_story("a")
+
+        assert not os.path.exists("stories.json")
+        assert [e["op"] for e in self.read_journal()] == ["upsert", "upsert", "delete"]
+        assert [s["id"] for s in load_stories()] == ["b"]
+        assert get_story("a") is None
+        assert get_story("b")["title"] == "B"
+
+    def test_delete_nonexistent_writes_nothing(self):
+        """Test that deleting an unknown ID does not add a tombstone."""
+        save_story({"id": "keep", "title": "Keep", "body": "1"})
+        delete_story("missing")
+
+        assert len(self.read_journal()) == 1
+
+    def test_startup_replays_snapshot_plus_journal(self, monkeypatch):
+        """Test that a fresh process rebuilds the library from snapshot and journal."""
+        import storage
+        with open("stories.json", "w", encoding="utf-8") as f:
+            json.dump([
+                {"id": "1", "title": "Snap 1", "body": "x", "created_at": "2026-01-01"},
+                {"id": "2", "title": "Snap 2", "body": "x", "created_at": "2026-01-02"},
+            ], f)
+        with open("stories.journal", "w", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "delete", "id": "1"}) + "\n")
+            f.write(json.dumps({"op": "upsert", "story": {"id": "2", "title": "Updated", "body": "y", "created_at": "2026-01-02"}}) + "\n")
+            f.write(json.dumps({"op": "upsert", "story": {"id": "3", "title": "New", "body": "z", "created_at": "2026-01-03"}}) + "\n")
+
+        monkeypatch.setattr(storage, "_journal_states", {})
+        stories = load_stories()
+        assert [(s["id"], s["title"]) for s in stories] == [("3", "New"), ("2", "Updated")]
+
+    def test_torn_last_record_is_ignored(self):
+        """Test that a half-written trailing line is skipped and later appends stay readable."""
+        save_story({"id": "ok", "title": "OK", "body": "1"})
+        with open("stories.journal", "a", encoding="utf-8") as f:
+            f.write('{"op": "upsert", "story": {"id": "torn"')
+
+        assert [s["id"] for s in load_stories()] == ["ok"]
+
+        save_story({"id": "next", "title": "Next", "body": "2"})
+        assert {s["id"] for s in load_stories()} == {"ok", "next"}
+
+    def test_compact_folds_journal_into_snapshot(self):
+        """Test that compaction writes a snapshot and empties the journal."""
+        from storage import compact_journal
+        save_story({"id": "a", "title": "A", "body": "1", "created_at": "2026-01-01"})
+        save_story({"id": "b", "title": "B", "body": "2", "created_at": "2026-01-02"})
+        delete_story("a")
+
+        compact_journal()
+
+        assert os.path.getsize("stories.journal") == 0
+        with open("stories.json", "r", encoding="utf-8") as f:
+            assert [s["id"] for s in json.load(f)] == ["b"]
+        assert [s["id"] for s in load_stories()] == ["b"]
+
+        save_story({"id": "c", "title": "C", "body": "3", "created_at": "2026-01-03"})
+        assert [s["id"] for s in load_stories()] == ["c", "b"]
+
+    def test_background_compaction_on_threshold(self, monkeypatch):
+        """Test that crossing the size threshold triggers background compaction."""
+        import time
+        import storage
+        monkeypatch.setattr(storage, "JOURNAL_COMPACT_BYTES", 1)
+
+        save_story({"id": "a", "title": "A", "body": "1"})
+
+        deadline = time.time() + 5
+        while time.time() < deadline and os.path.getsize("stories.journal") > 0:
+            time.sleep(0.01)
+        assert os.path.getsize("stories.journal") == 0
+        assert [s["id"] for s in load_stories()] == ["a"]
+
+
+class TestListStorySummaries:
+    """Tests for the metadata index used by the sidebar."""
+
+    def test_summaries_have_no_body(self, tmp_path, monkeypatch):
+        """Test that summaries contain only id, title and created_at, newest first."""
+        from storage import list_story_summaries
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "a", "title": "A", "body": "x" * 1000, "created_at": "2026-01-01"})
+        save_story({"id": "b", "title": "B", "body": "y" * 1000, "created_at": "2026-01-02"})
+
+        assert list_story_summaries() == [
+            {"id": "b", "title": "B", "created_at": "2026-01-02"},
+            {"id": "a", "title": "A", "created_at": "2026-01-01"},
+        ]
+        assert os.path.exists("stories.index.json")
+
+    def test_summaries_served_from_index_without_parsing_bodies(self, tmp_path, monkeypatch):
+        """Test that a fresh process reads the index file, not stories.json."""
+        import storage
+        from storage import list_story_summaries
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "a", "title": "A", "body": "Content"})
+
+        monkeypatch.setattr(storage, "_stories_cache", {})
+        monkeypatch.setattr(storage, "_summaries_cache", {})
+        opened = []
+        real_open = open
+        monkeypatch.setattr("builtins.open", lambda path, *a, **kw: opened.append(path) or real_open(path, *a, **kw))
+
+        assert [s["id"] for s in list_story_summaries()] == ["a"]
+        assert opened == ["stories.index.json"]
+
+    def test_stale_index_is_rebuilt(self, tmp_path, monkeypatch):
+        """Test that editing stories.json outside the API rebuilds the index."""
+        from storage import list_story_summaries
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "a", "title": "A", "body": "Content"})
+        assert [s["title"] for s in list_story_summaries()] == ["A"]
+
+        with open("stories.json", "w", encoding="utf-8") as f:
+            json.dump([{"id": "a", "title": "Edited by hand", "body": "Content"}], f)
+
+        assert [s["title"] for s in list_story_summaries()] == ["Edited by hand"]
+
+    def test_summaries_follow_writes(self, tmp_path, monkeypatch):
+        """Test that save and delete update the index."""
+        from storage import list_story_summaries
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "a", "title": "A", "body": "1", "created_at": "2026-01-01"})
+        save_story({"id": "b", "title": "B", "body": "2", "created_at": "2026-01-02"})
+        delete_story("b")
+
+        assert [s["id"] for s in list_story_summaries()] == ["a"]
+
+    def test_journal_summaries(self, tmp_path, monkeypatch):
+        """Test that the journal backend provides summaries too."""
+        import storage
+        from storage import list_story_summaries
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(storage, "STORAGE_BACKEND", "journal")
+        monkeypatch.setattr(storage, "_journal_states", {})
+        save_story({"id": "a", "title": "A", "body": "1"})
+
+        assert list_story_summaries() == [{"id": "a", "title": "A", "created_at": load_stories()[0]["created_at"]}]
+
+
+class TestListStories:
+    """Tests for cursor pagination of the library."""
+
+    @pytest.fixture(params=["json", "journal", "sqlite"])
+    def backend(self, request, tmp_path, monkeypatch):
+        import storage
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(storage, "STORAGE_BACKEND", request.param)
+        monkeypatch.setattr(storage, "_journal_states", {})
+        return request.param
+
+    def _walk(self, limit):
+        from storage import list_stories
+        ids, cursor = [], None
+        while True:
+            page, cursor = list_stories(limit, cursor)
+            assert len(page) <= limit
+            ids += [s["id"] for s in page]
+            if cursor is None:
+                return ids
+
+    def test_pages_cover_library_in_order(self, backend):
+        """Test that walking all pages yields every story once, newest first."""
+        for i in range(7):
+            save_story({"id": f"s{i}", "title": f"T{i}", "body": "x", "created_at": f"2026-01-0{i + 1}"})
+
+        assert self._walk(3) == [f"s{i}" for i in reversed(range(7))]
+
+    def test_equal_timestamps_are_ordered_by_id(self, backend):
+        """Test that stories with the same created_at are neither skipped nor repeated."""
+        for story_id in ["b", "d", "a", "c", "e"]:
+            save_story({"id": story_id, "title": story_id, "body": "x", "created_at": "2026-01-01"})
+
+        assert self._walk(2) == ["e", "d", "c", "b", "a"]
+
+    def test_cursor_is_stable_across_writes(self, backend):
+        """Test that inserts and deletes do not shift the next page."""
+        from storage import list_stories
+        for i in range(6):
+            save_story({"id": f"s{i}", "title": "T", "body": "x", "created_at": f"2026-01-0{i + 1}"})
+
+        first, cursor = list_stories(2)
+        assert [s["id"] for s in first] == ["s5", "s4"]
+        save_story({"id": "new", "title": "N", "body": "x", "created_at": "2026-02-01"})
+        delete_story("s5")
+
+        second, _ = list_stories(2, cursor)
+        assert [s["id"] for s in second] == ["s3", "s2"]
+
+    def test_last_page_has_no_cursor(self, backend):
+        """Test that an exactly full last page does not report a next page."""
+        from storage import list_stories
+        for i in range(2):
+            save_story({"id": f"s{i}", "title": "T", "body": "x"})
+
+        page, cursor = list_stories(2)
+        assert len(page) == 2
+        assert cursor is None
+
+    def test_empty_library(self, backend):
+        """Test that an empty library returns an empty first page."""
+        from storage import list_stories
+        assert list_stories(10) == ([], None)
+
+    def test_invalid_cursor(self, backend):
+        """Test that a malformed cursor is rejected."""
+        from storage import list_stories
+        save_story({"id": "a", "title": "A", "body": "x"})
+        with pytest.raises(ValueError):
+            list_stories(10, "not-a-cursor")
+
+
+def _concurrent_writer(directory, backend, worker_id, count):
+    """Worker for the multi-process stress test: saves `count` stories."""
+    import storage
+    os.chdir(directory)
+    storage.STORAGE_BACKEND = backend
+    for i in range(count):
+        storage.save_story({"id": f"w{worker_id}-{i}", "title": f"Story {worker_id}/{i}", "body": "x" * 200})
+
+
+class TestConcurrentWrites:
+    """Tests for atomic, lock-protected writes."""
+
+    @pytest.mark.parametrize("backend", ["json", "journal"])
+    def test_no_story_lost_under_contention(self, tmp_path, monkeypatch, backend):
+        """Test that concurrent save_story calls from several processes lose nothing."""
+        import multiprocessing
+        import storage
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(storage, "STORAGE_BACKEND", backend)
+        # Компактизация журнала в середине теста тоже должна быть безопасной
+        monkeypatch.setattr(storage, "JOURNAL_COMPACT_MIN_BYTES", 4096)
+
+        workers, per_worker = 6, 25
+        processes = [
+            multiprocessing.Process(target=_concurrent_writer, args=(str(tmp_path), backend, w, per_worker))
+            for w in range(workers)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join(timeout=60)
+            assert p.exitcode == 0
+
+        if backend == "json":
+            with open("stories.json", "r", encoding="utf-8") as f:
+                on_disk = json.load(f)
+            assert len(on_disk) == workers * per_worker
+
+        expected = {f"w{w}-{i}" for w in range(workers) for i in range(per_worker)}
+        assert {s["id"] for s in load_stories()} == expected
+
+    def test_write_leaves_no_temp_files(self, tmp_path, monkeypatch):
+        """Test that atomic replacement cleans up after itself."""
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "1", "title": "One", "body": "Content"})
+        save_story({"id": "2", "title": "Two", "body": "Content"})
+
+        assert not [name for name in os.listdir(".") if name.endswith(".tmp")]
+
+    def test_corrupt_library_is_not_overwritten(self, tmp_path, monkeypatch):
+        """Test that saving into an unreadable stories.json fails instead of wiping it."""
+        import storage
+        monkeypatch.chdir(tmp_path)
+        errors = []
+        monkeypatch.setattr(storage.st, "error", errors.append)
+        with open("stories.json", "w", encoding="utf-8") as f:
+            f.write('[{"id": "1", "title": "Torn')
+
+        save_story({"id": "2", "title": "New", "body": "Content"})
+
+        assert len(errors) == 1
+        with open("stories.json", "r", encoding="utf-8") as f:
+            assert f.read() == '[{"id": "1", "title": "Torn'
+
+
+class TestSearch:
+    """Tests for storage.search and index maintenance in save/delete."""
+
+    def test_search_finds_saved_story(self, tmp_path, monkeypatch):
+        """Test that a saved story is searchable by an inflected word."""
+        from storage import search
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "1", "title": "Кот в сапогах", "body": "Хитрый кот помог хозяину."})
+        save_story({"id": "2", "title": "Dragon Tale", "body": "The dragons were kind."})
+
+        assert [r["id"] for r in search("котом")] == ["1"]
+        assert [r["id"] for r in search("dragon")] == ["2"]
+
+    def test_delete_removes_from_index(self, tmp_path, monkeypatch):
+        """Test that deleted stories disappear from search results."""
+        from storage import search
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "1", "title": "Кот в сапогах", "body": "Хитрый кот."})
+        delete_story("1")
+
+        assert search("кот") == []
+
+    def test_updates_are_incremental(self, tmp_path, monkeypatch):
+        """Test that saving through the API does not rebuild the index."""
+        import storage
+        from storage import search
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "1", "title": "Первая", "body": "Текст"})
+
+        rebuilds = []
+        monkeypatch.setattr(storage.SearchIndex, "rebuild", lambda *a: rebuilds.append(a))
+        save_story({"id": "2", "title": "Вторая", "body": "Текст"})
+        delete_story("1")
+
+        assert [r["id"] for r in search("вторая")] == ["2"]
+        assert rebuilds == []
+
+    def test_external_edit_triggers_rebuild(self, tmp_path, monkeypatch):
+        """Test that an index out of sync with the library is rebuilt on search."""
+        from storage import search
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "1", "title": "Старое название", "body": "Текст"})
+
+        with open("stories.json", "w", encoding="utf-8") as f:
+            json.dump([{"id": "1", "title": "Новое название", "body": "Текст"}], f)
+
+        assert search("старое") == []
+        assert [r["id"] for r in search("новое")] == ["1"]
+
+    def test_search_sqlite_backend(self, tmp_path, monkeypatch):
+        """Test that search works with the SQLite backend as well."""
+        import storage
+        from storage import search
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(storage, "STORAGE_BACKEND", "sqlite")
+        save_story({"id": "1", "title": "Лиса", "body": "Рыжая лиса."})
+
+        assert [r["id"] for r in search("лисы")] == ["1"]
+
+
+class TestAudioReference:
+    """Tests for persisting the audio store reference with a story."""
+
+    def test_audio_key_persisted_without_audio_bytes(self, tmp_path, monkeypatch):
+        """Test that audio_key and voice survive a save while BytesIO is dropped."""
+        from io import BytesIO
+        monkeypatch.chdir(tmp_path)
+        save_story({
+            "id": "1", "title": "T", "body": "B",
+            "audio": BytesIO(b"mp3"), "audio_key": "ab" * 32, "voice": "ru-RU-DmitryNeural"
+        })
+
+        story = get_story("1")
+        assert "audio" not in story
+        assert story["audio_key"] == "ab" * 32
+        assert story["voice"] == "ru-RU-DmitryNeural"
+
+
+class TestNamespaces:
+    """Tests for per-user library namespaces."""
+
+    def test_namespaces_are_isolated(self, tmp_path, monkeypatch):
+        """Test that each namespace sees only its own stories."""
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "a", "title": "Alice's", "body": "Кот"}, namespace="user:alice")
+        save_story({"id": "b", "title": "Bob's", "body": "Кот"}, namespace="user:bob")
+
+        assert [s["id"] for s in load_stories(namespace="user:alice")] == ["a"]
+        assert [s["id"] for s in load_stories(namespace="user:bob")] == ["b"]
+        assert get_story("b", namespace="user:alice") is None
+        assert load_stories() == []
+
+    def test_namespace_directory_is_sharded(self, tmp_path, monkeypatch):
+        """Test that a namespace lives in libraries/<2 hex>/<hash>/."""
+        import hashlib
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "a", "title": "T", "body": "B"}, namespace="user:alice")
+
+        digest = hashlib.sha256(b"user:alice").hexdigest()[:32]
+        assert (tmp_path / "libraries" / digest[:2] / digest / "stories.json").exists()
+        assert not (tmp_path / "stories.json").exists()
+
+    def test_reading_unknown_namespace_creates_nothing(self, tmp_path, monkeypatch):
+        """Test that reads of an empty namespace don't create directories."""
+        from storage import list_story_summaries, search
+        monkeypatch.chdir(tmp_path)
+
+        assert load_stories(namespace="guest:1") == []
+        assert list_story_summaries(namespace="guest:1") == []
+        assert get_story("x", namespace="guest:1") is None
+        assert search("кот", namespace="guest:1") == []
+        delete_story("x", namespace="guest:1")
+        assert not (tmp_path / "libraries").exists()
+
+    def test_delete_and_search_are_scoped(self, tmp_path, monkeypatch):
+        """Test that delete and search only touch the given namespace."""
+        from storage import search
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "same", "title": "Кот", "body": "Кот"}, namespace="user:alice")
+        save_story({"id": "same", "title": "Кот", "body": "Кот"}, namespace="user:bob")
+
+        delete_story("same", namespace="user:alice")
+
+        assert search("кот", namespace="user:alice") == []
+        assert [r["id"] for r in search("кот", namespace="user:bob")] == ["same"]
+
+    @pytest.mark.parametrize("backend", ["sqlite", "journal"])
+    def test_namespaces_other_backends(self, tmp_path, monkeypatch, backend):
+        """Test namespace isolation with the SQLite and journal backends."""
+        import storage
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(storage, "STORAGE_BACKEND", backend)
+        save_story({"id": "a", "title": "A", "body": "1"}, namespace="user:alice")
+        save_story({"id": "b", "title": "B", "body": "2"}, namespace="user:bob")
+
+        assert [s["id"] for s in load_stories(namespace="user:alice")] == ["a"]
+        assert [s["id"] for s in load_stories(namespace="user:bob")] == ["b"]
+
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "migrations"
+
+
+def _fixture(version):
+    with open(FIXTURES_DIR / f"v{version}.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class TestMigrations:
+    """Tests for the streaming schema migration of the library."""
+
+    @pytest.mark.parametrize("version", sorted(__import__("storage")._MIGRATIONS))
+    def test_step_matches_fixture(self, version):
+        """Test that every migration step turns fixture v<n> into fixture v<n+1>."""
+        from storage import _migrate_record
+        migrated = [_migrate_record(record, version + 1) for record in _fixture(version)]
+        assert migrated == _fixture(version + 1)
+
+    def test_every_version_has_fixture(self):
+        """Test that the current schema version is covered by fixtures."""
+        from config import STORY_SCHEMA_VERSION
+        assert (FIXTURES_DIR / f"v{STORY_SCHEMA_VERSION}.json").exists()
+
+    def test_iter_json_array_small_chunks(self, tmp_path, monkeypatch):
+        """Test that records split across read chunks (mid UTF-8 character too) parse correctly."""
+        import storage
+        monkeypatch.setattr(storage, "_JSON_CHUNK_BYTES", 7)
+        records = _fixture(1)
+        path = tmp_path / "stories.json"
+        path.write_text(json.dumps(records, ensure_ascii=False, indent=4), encoding="utf-8")
+
+        with open(path, "rb") as f:
+            parsed = list(storage._iter_json_array(f))
+        assert [item for item, _ in parsed] == records
+
+        # Parsing can resume from any reported offset
+        with open(path, "rb") as f:
+            rest = [item for item, _ in storage._iter_json_array(f, parsed[1][1])]
+        assert rest == records[2:]
+
+    @pytest.mark.parametrize("content", ["", "{}", "[{\"id\": 1}", "[{\"id\": 1} {\"id\": 2}]"])
+    def test_iter_json_array_rejects_malformed(self, tmp_path, content):
+        """Test that a malformed library raises instead of being silently truncated."""
+        import storage
+        path = tmp_path / "stories.json"
+        path.write_text(content, encoding="utf-8")
+        with open(path, "rb") as f, pytest.raises(ValueError):
+            list(storage._iter_json_array(f))
+
+    @pytest.mark.parametrize("backend", ["json", "journal", "sqlite"])
+    def test_migrate_library(self, backend, tmp_path, monkeypatch):
+        """Test that a v1 library is upgraded in place on every backend."""
+        import storage
+        from storage import migrate_library
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(storage, "STORAGE_BACKEND", backend)
+        monkeypatch.setattr(storage, "_journal_states", {})
+        with open("stories.json", "w", encoding="utf-8") as f:
+            json.dump(_fixture(1), f, ensure_ascii=False)
+
+        assert migrate_library() == 4
+        from config import STORY_SCHEMA_VERSION
+        expected = {r["id"]: r for r in _fixture(STORY_SCHEMA_VERSION)}
+        assert {s["id"]: s for s in load_stories()} == expected
+        # A second run is a no-op
+        assert migrate_library() == 0
+        assert not os.path.exists("stories.json.migrating")
+
+    def test_migration_resumes_after_interruption(self, tmp_path, monkeypatch):
+        """Test that an interrupted migration continues from its last checkpoint."""
+        import storage
+        from storage import migrate_library
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(storage, "MIGRATION_CHECKPOINT_RECORDS", 3)
+        records = [{"id": f"s{i}", "title": "T", "body": "Текст", "created_at": f"2025-01-{i + 1:02d}"} for i in range(10)]
+        with open("stories.json", "w", encoding="utf-8") as f:
+            json.dump(records, f, indent=4)
+
+        real_migrate = storage._migrate_record
+        calls = []
+
+        def crashing_migrate(record, target_version):
+            calls.append(record["id"])
+            if len(calls) == 8:
+                raise KeyboardInterrupt
+            return real_migrate(record, target_version)
+
+        monkeypatch.setattr(storage, "_migrate_record", crashing_migrate)
+        with pytest.raises(KeyboardInterrupt):
+            migrate_library()
+        assert os.path.exists("stories.json.migrating.state")
+        assert [s["id"] for s in load_stories()][0] == "s9"
+        assert "schema_version" not in load_stories()[0]
+
+        calls.clear()
+        monkeypatch.setattr(storage, "_migrate_record", lambda r, v: calls.append(r["id"]) or real_migrate(r, v))
+        assert migrate_library() == 10
+        # Records before the last checkpoint (6 of them) are not processed again
+        assert calls == [f"s{i}" for i in range(6, 10)]
+        assert sorted(s["id"] for s in load_stories()) == sorted(r["id"] for r in records)
+        from config import STORY_SCHEMA_VERSION
+        assert all(s["schema_version"] == STORY_SCHEMA_VERSION and s["lang"] == "ru" for s in load_stories())
+        assert not os.path.exists("stories.json.migrating.state")
+
+    def test_stale_checkpoint_is_discarded(self, tmp_path, monkeypatch):
+        """Test that a checkpoint for a since-modified library starts over."""
+        import storage
+        from storage import migrate_library
+        monkeypatch.chdir(tmp_path)
+        with open("stories.json", "w", encoding="utf-8") as f:
+            json.dump(_fixture(1), f)
+        with open("stories.json.migrating", "w") as f:
+            f.write("[\n{\"id\": \"garbage\"}")
+        with open("stories.json.migrating.state", "w") as f:
+            json.dump({"source": [0, 0, 0], "target_version": 2, "input_offset": 10,
+                       "output_offset": 20, "count": 1, "migrated": 1}, f)
+
+        assert migrate_library() == 4
+        assert sorted(s["id"] for s in load_stories()) == sorted(r["id"] for r in _fixture(1))
+
+    def test_save_story_writes_current_version(self, tmp_path, monkeypatch):
+        """Test that new stories are stored in the current schema version."""
+        from config import STORY_SCHEMA_VERSION
+        monkeypatch.chdir(tmp_path)
+        save_story({"id": "a", "title": "Dragon", "body": "Once upon a time", "audio": object()})
+
+        story = get_story("a")
+        assert story["schema_version"] == STORY_SCHEMA_VERSION
+        assert story["lang"] == "en"
+        assert story["audio_key"] is None
+        assert "audio" not in story
+
+
+class TestColdTier:
+    """Tests for moving old stories into the compressed cold tier."""
+
+    NOW = __import__("datetime").datetime(2026, 6, 1)
+
+    @pytest.fixture(params=["json", "journal", "sqlite"])
+    def backend(self, request, tmp_path, monkeypatch):
+        import storage
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(storage, "STORAGE_BACKEND", request.param)
+        monkeypatch.setattr(storage, "_journal_states", {})
+        monkeypatch.setattr(storage, "LIBRARY_COLD_TIER", True)
+        save_story({"id": "old", "title": "Old", "body": "Жил-был дракон. " * 20, "created_at": "2026-01-01T10:00:00"})
+        save_story({"id": "new", "title": "New", "body": "Once upon a time", "created_at": "2026-05-30T10:00:00"})
+        return request.param
+
+    def _raw(self, story_id):
+        import storage
+        return storage._get_engine().get(story_id)
+
+    def test_sweep_demotes_old_stories(self, backend):
+        """Test that old stories lose their hot body but read back transparently."""
+        from storage import sweep_cold_tier, cold_tier_stats
+        assert sweep_cold_tier(now=self.NOW) == {"demoted": 1, "promoted": 0}
+
+        assert self._raw("old")["tier"] == "cold"
+        assert self._raw("old")["body"] == ""
+        assert "tier" not in self._raw("new")
+        assert get_story("old")["body"] == "Жил-был дракон. " * 20
+        assert "tier" not in get_story("old")
+        assert {s["id"]: s["body"] for s in load_stories()}["old"] == "Жил-был дракон. " * 20
+
+        stats = cold_tier_stats()
+        assert stats["stories"] == 1
+        assert stats["saved_bytes"] > 0
+
+    def test_opened_story_is_promoted(self, backend):
+        """Test that a cold story opened recently returns to the hot tier."""
+        from storage import sweep_cold_tier, cold_tier_stats
+        sweep_cold_tier(now=self.NOW)
+        get_story("old")
+
+        assert sweep_cold_tier(now=self.NOW) == {"demoted": 0, "promoted": 1}
+        assert self._raw("old")["body"] == "Жил-был дракон. " * 20
+        assert cold_tier_stats()["stories"] == 0
+        # A second sweep keeps it hot: the access time is still recent
+        assert sweep_cold_tier(now=self.NOW) == {"demoted": 0, "promoted": 0}
+
+    def test_search_covers_cold_stories(self, backend):
+        """Test that search still finds text whose body moved to the cold tier."""
+        import storage
+        from storage import sweep_cold_tier, search
+        assert [s["id"] for s in search("дракон")] == ["old"]
+        sweep_cold_tier(now=self.NOW)
+        assert [s["id"] for s in search("дракон")] == ["old"]
+
+        # A full rebuild reads bodies back from the cold tier
+        storage._search_index(None).touch("stale")
+        assert [s["id"] for s in search("дракон")] == ["old"]
+
+    def test_delete_and_resave_release_cold_body(self, backend):
+        """Test that deleted or re-saved stories do not leave bodies behind."""
+        from storage import sweep_cold_tier, cold_tier_stats
+        sweep_cold_tier(now=self.NOW)
+        story = get_story("old")
+        story["title"] = "Renamed"
+        save_story(story)
+        assert "tier" not in self._raw("old")
+        assert get_story("old")["body"] == "Жил-был дракон. " * 20
+
+        sweep_cold_tier(now=self.NOW)
+        assert cold_tier_stats()["stories"] == 0
+
+        save_story({"id": "older", "title": "Older", "body": "text", "created_at": "2025-01-01T10:00:00"})
+        sweep_cold_tier(now=self.NOW)
+        delete_story("older")
+        assert cold_tier_stats()["stories"] == 0
+
+    def test_story_changed_during_sweep_is_not_demoted(self, backend, monkeypatch):
+        """Test that a story edited while its body is being compressed stays hot."""
+        import cold_store
+        from storage import sweep_cold_tier
+        real_put_many = cold_store.ColdStore.put_many
+
+        def put_many_and_edit(self, bodies):
+            real_put_many(self, list(bodies))
+            save_story({"id": "old", "title": "Old", "body": "Edited", "created_at": "2026-01-01T10:00:00"})
+
+        monkeypatch.setattr(cold_store.ColdStore, "put_many", put_many_and_edit)
+        assert sweep_cold_tier(now=self.NOW) == {"demoted": 0, "promoted": 0}
+        assert self._raw("old")["body"] == "Edited"
+
+    def test_background_sweep_is_rate_limited(self, backend, monkeypatch):
+        """Test that listing the library schedules sweeps at most once per interval."""
+        import threading
+        import storage
+        from storage import list_story_summaries
+        monkeypatch.setattr(storage, "_cold_sweeps", {})
+        monkeypatch.setattr(storage, "COLD_TIER_SWEEP_INTERVAL", 0)
+        swept = threading.Event()
+        monkeypatch.setattr(storage, "sweep_cold_tier", lambda namespace=None: swept.set())
+
+        list_story_summaries()
+        assert not swept.wait(0.2)
+        list_story_summaries()
+        assert swept.wait(5)
+
+    def test_disabled_tier_is_passive(self, backend, monkeypatch):
+        """Test that without LIBRARY_COLD_TIER reads neither log opens nor schedule sweeps."""
+        import os
+        import storage
+        from config import STORIES_ACCESS_LOG_FILE
+        from storage import get_story, list_story_summaries, sweep_cold_tier
+        monkeypatch.setattr(storage, "LIBRARY_COLD_TIER", False)
+        monkeypatch.setattr(storage, "_cold_sweeps", {})
+        sweep_cold_tier(now=self.NOW)
+        assert get_story("old")["body"].startswith("Жил-был")
+        list_story_summaries()
+        assert not os.path.exists(STORIES_ACCESS_LOG_FILE)
+        assert storage._cold_sweeps == {}
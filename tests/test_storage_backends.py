@@ -0,0 +1,852 @@
+"""
+Shared conformance and throughput suite for every storage backend.
+
+Each test runs against all engines registered in storage._BACKENDS; the
+Supabase backend talks to the in-process FakeSupabase table API.
+"""
+import time
+from contextlib import contextmanager
+import pytest
+import requests
+from io import BytesIO
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import storage
+from storage import (
+    StorageBackend, delete_story, get_story, list_stories, list_story_summaries,
+    load_stories, migrate_library, save_story, search, sweep_cold_tier,
+)
+from story import Story
+from supabase_fake import FakeSupabase
+
+
+@pytest.fixture(params=sorted(storage._BACKENDS))
+def backend(request, tmp_path, monkeypatch):
+    """Run the test against one backend in an empty temp directory."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", request.param)
+    monkeypatch.setattr(storage, "_journal_states", {})
+    monkeypatch.setattr(storage, "_supabase_http", FakeSupabase())
+    monkeypatch.setenv("SUPABASE_URL", "http://supabase.test")
+    monkeypatch.setenv("SUPABASE_KEY", "test-key")
+    return request.param
+
+
+def _story(i, **extra):
+    return {"id": f"s{i:03d}", "title": f"Story {i}", "body": f"Body {i}", "created_at": f"2026-01-01T00:{i // 60:02d}:{i % 60:02d}", **extra}
+
+
+class TestConformance:
+    """Behaviour every backend must share."""
+
+    def test_implements_protocol(self, backend):
+        """Test that the engine satisfies the StorageBackend protocol."""
+        assert isinstance(storage._get_engine(create=True), StorageBackend)
+
+    def test_empty_library(self, backend):
+        """Test reads on an empty library."""
+        assert load_stories() == []
+        assert list_story_summaries() == []
+        assert list_stories(10) == ([], None)
+        assert get_story("missing") is None
+        delete_story("missing")
+
+    def test_save_get_roundtrip(self, backend):
+        """Test that a saved story reads back unchanged, including unicode."""
+        save_story(_story(1, title="Сказка про ёжика", voice="ru-RU-SvetlanaNeural"))
+        story = get_story("s001")
+        assert story["title"] == "Сказка про ёжика"
+        assert story["voice"] == "ru-RU-SvetlanaNeural"
+        assert story["body"] == "Body 1"
+
+    def test_save_typed_story(self, backend):
+        """Test that a Story is validated, saved without audio and given an ID."""
+        story = Story(title="Typed", body="Body", gender="girl", age_group=5, audio=BytesIO(b"mp3"))
+        save_story(story)
+        assert story.id is not None and story.created_at is not None
+        saved = get_story(story.id)
+        assert saved["gender"] == "girl" and "audio" not in saved
+        assert saved["schema_version"] == storage.STORY_SCHEMA_VERSION
+        with pytest.raises(ValueError):
+            save_story(Story(title="Bad", body="Body", gender="dragon"))
+        assert len(load_stories()) == 1
+
+    def test_update_replaces_story(self, backend):
+        """Test that saving an existing ID updates it instead of duplicating."""
+        save_story(_story(1))
+        save_story(_story(1, title="Renamed"))
+        assert [s["title"] for s in load_stories()] == ["Renamed"]
+
+    def test_order_and_summaries(self, backend):
+        """Test newest-first ordering with id as the tie breaker."""
+        for i in (2, 1, 3):
+            save_story(_story(i))
+        save_story({**_story(4), "created_at": _story(3)["created_at"]})
+
+        expected = ["s004", "s003", "s002", "s001"]
+        assert [s["id"] for s in load_stories()] == expected
+        assert [s["id"] for s in list_story_summaries()] == expected
+        assert set(list_story_summaries()[0]) == set(storage.SUMMARY_FIELDS)
+
+    def test_pagination(self, backend):
+        """Test that cursor pages cover the library exactly once."""
+        for i in range(25):
+            save_story(_story(i))
+        ids, cursor = [], None
+        while True:
+            page, cursor = list_stories(10, cursor)
+            ids += [s["id"] for s in page]
+            if cursor is None:
+                break
+        assert ids == [f"s{i:03d}" for i in reversed(range(25))]
+
+    def test_delete(self, backend):
+        """Test that delete removes exactly one story."""
+        save_story(_story(1))
+        save_story(_story(2))
+        delete_story("s001")
+        assert [s["id"] for s in load_stories()] == ["s002"]
+
+    def test_signature_changes_on_write(self, backend):
+        """Test that the engine signature reflects saves and deletes."""
+        engine = storage._get_engine(create=True)
+        empty = engine.signature()
+        save_story(_story(1))
+        saved = engine.signature()
+        delete_story("s001")
+        assert len({repr(empty), repr(saved), repr(engine.signature())}) >= 2
+        assert saved != empty
+
+    def test_search(self, backend):
+        """Test full-text search over title and body."""
+        save_story(_story(1, body="Жил-был дракон"))
+        save_story(_story(2, body="Once upon a time"))
+        assert [s["id"] for s in search("драконы")] == ["s001"]
+
+    def test_rewrite(self, backend):
+        """Test that rewrite applies an update and counts changed records."""
+        for i in range(3):
+            save_story(_story(i))
+        engine = storage._get_engine()
+        changed = engine.rewrite(lambda r: {**r, "title": "X"} if r["id"] != "s000" else None)
+        assert changed == 2
+        assert sorted(s["title"] for s in load_stories()) == ["Story 0", "X", "X"]
+
+    def test_write_batch(self, backend):
+        """Test that a batch of upserts and deletes is applied in one call."""
+        save_story(_story(1))
+        save_story(_story(2))
+        engine = storage._get_engine()
+        engine.write_batch([_story(2, title="Updated"), _story(3)], ["s001"])
+        assert [(s["id"], s["title"]) for s in load_stories()] == [("s003", "Story 3"), ("s002", "Updated")]
+
+    def test_migrate(self, backend):
+        """Test that legacy v1 records are upgraded."""
+        engine = storage._get_engine(create=True)
+        engine.upsert({"id": "legacy", "title": "Старая", "body": "Текст", "created_at": "2025-01-01"})
+        assert migrate_library() == 1
+        assert get_story("legacy")["schema_version"] == storage.STORY_SCHEMA_VERSION
+        assert get_story("legacy")["lang"] == "ru"
+
+    def test_cold_tier(self, backend):
+        """Test that cold-tier stubs read back transparently."""
+        from datetime import datetime
+        save_story(_story(1, created_at="2025-01-01T00:00:00"))
+        assert sweep_cold_tier(now=datetime(2026, 1, 1))["demoted"] == 1
+        assert get_story("s001")["body"] == "Body 1"
+
+    def test_namespaces_are_isolated(self, backend):
+        """Test that libraries of different namespaces do not see each other."""
+        save_story(_story(1), namespace="user:1")
+        save_story(_story(2), namespace="user:2")
+        assert [s["id"] for s in load_stories(namespace="user:1")] == ["s001"]
+        assert [s["id"] for s in list_story_summaries(namespace="user:2")] == ["s002"]
+
+    def test_guest_libraries_expire(self, backend):
+        """Test that idle guest libraries are swept while user libraries are kept."""
+        import os
+        save_story(_story(1), namespace="guest:old")
+        save_story(_story(2), namespace="guest:new")
+        save_story(_story(3), namespace="user:1")
+        old_dir = storage._library_dir("guest:old")
+        assert old_dir.startswith(storage.GUEST_LIBRARIES_DIR)
+        assert not storage._library_dir("user:1").startswith(storage.GUEST_LIBRARIES_DIR)
+        stale = time.time() - 2 * 86400
+        for path in [old_dir] + [os.path.join(old_dir, name) for name in os.listdir(old_dir)]:
+            os.utime(path, (stale, stale))
+
+        assert storage.sweep_guest_libraries(ttl=86400) == 1
+        assert not os.path.exists(old_dir)
+        assert load_stories(namespace="guest:old") == []
+        assert [s["id"] for s in load_stories(namespace="guest:new")] == ["s002"]
+        assert [s["id"] for s in load_stories(namespace="user:1")] == ["s003"]
+        assert storage.sweep_guest_libraries(ttl=86400) == 0
+
+    def test_guest_sweep_keeps_library_when_remote_delete_fails(self, backend, monkeypatch):
+        """Test that a guest library whose remote rows could not be deleted is retried later."""
+        import os
+        if backend not in storage._REMOTE_BACKENDS:
+            pytest.skip("remote backends only")
+        save_story(_story(1), namespace="guest:old")
+        old_dir = storage._library_dir("guest:old")
+        stale = time.time() - 2 * 86400
+        for path in [old_dir] + [os.path.join(old_dir, name) for name in os.listdir(old_dir)]:
+            os.utime(path, (stale, stale))
+        monkeypatch.setattr(storage, "_supabase_http", _FailingSession())
+        assert storage.sweep_guest_libraries(ttl=86400) == 0
+        assert os.path.isdir(old_dir)
+
+    def test_import_legacy_library(self, backend):
+        """Test that the shared root library is copied into a namespace once."""
+        save_story(_story(1))
+        save_story(_story(2))
+        save_story(_story(2, title="Mine"), namespace="user:1")
+        assert storage.import_legacy_library("user:1") == 1
+        assert [(s["id"], s["title"]) for s in load_stories(namespace="user:1")] == [
+            ("s002", "Mine"), ("s001", "Story 1"),
+        ]
+        assert storage.import_legacy_library("user:1") == 0
+        assert storage.import_legacy_library("user:1", overwrite=True) == 2
+        assert get_story("s002", namespace="user:1")["title"] == "Story 2"
+        assert [s["id"] for s in load_stories()] == ["s002", "s001"]
+
+    def test_library_caches_are_bounded(self, backend, monkeypatch):
+        """Test that per-library process caches keep at most LIBRARY_CACHE_SIZE libraries."""
+        monkeypatch.setattr(storage, "LIBRARY_CACHE_SIZE", 2)
+        monkeypatch.setattr(storage, "_stories_cache", {})
+        monkeypatch.setattr(storage, "_summaries_cache", {})
+        for i in range(4):
+            save_story(_story(i), namespace=f"user:{i}")
+            load_stories(namespace=f"user:{i}")
+            list_story_summaries(namespace=f"user:{i}")
+        for cache in (storage._stories_cache, storage._summaries_cache, storage._journal_states):
+            assert len(cache) <= 2
+        assert [s["id"] for s in load_stories(namespace="user:0")] == ["s000"]
+
+    def test_swept_guest_library_leaves_caches(self, backend, monkeypatch):
+        """Test that sweeping a guest library drops its entries from the process caches."""
+        import os
+        monkeypatch.setattr(storage, "LIBRARY_SNAPSHOT", True)
+        monkeypatch.setattr(storage, "_snapshots", {})
+        save_story(_story(1), namespace="guest:old")
+        storage.build_snapshot("guest:old")
+        load_stories(namespace="guest:old")
+        list_story_summaries(namespace="guest:old")
+        old_dir = os.path.abspath(storage._library_dir("guest:old"))
+        stale = time.time() - 2 * 86400
+        for path in [old_dir] + [os.path.join(old_dir, name) for name in os.listdir(old_dir)]:
+            os.utime(path, (stale, stale))
+
+        caches = (storage._stories_cache, storage._summaries_cache, storage._journal_states,
+                  storage._snapshots, storage._cold_sweeps)
+        assert any(key.startswith(old_dir) for cache in caches for key in cache)
+        assert storage.sweep_guest_libraries(ttl=86400) == 1
+        assert not any(key.startswith(old_dir) for cache in caches for key in cache)
+
+
+class TestSupabaseSignature:
+    """The Supabase signature comes from server-side values only."""
+
+    def test_signature_ignores_client_clock(self, backend, monkeypatch):
+        """Test that updates change the signature even when the client clock stands still."""
+        from datetime import datetime
+
+        class FrozenClock(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime(2026, 1, 1)
+
+        if backend not in storage._REMOTE_BACKENDS:
+            pytest.skip("supabase-only behaviour")
+        monkeypatch.setattr(storage, "datetime", FrozenClock)
+        save_story(_story(1))
+        engine = storage._get_engine()
+        first = engine.signature()
+        save_story(_story(1, title="Renamed"))
+        assert engine.signature() != first
+        assert all("updated_at" not in row for row in storage._supabase_http.rows())
+
+
+class _FailingSession:
+    """requests.Session stand-in whose every call fails like a network outage."""
+
+    def request(self, *args, **kwargs):
+        raise requests.ConnectionError("network is unreachable")
+
+
+class TestSupabaseOutage:
+    """Supabase network errors degrade reads instead of crashing the page."""
+
+    @pytest.fixture
+    def offline(self, backend, monkeypatch):
+        if backend != "supabase":
+            pytest.skip("Supabase-only behaviour")
+        save_story(_story(1, body="Жил-был дракон"))
+        assert search("дракон")
+        monkeypatch.setattr(storage, "_supabase_http", _FailingSession())
+        return storage._get_engine()
+
+    def test_signature_is_none(self, offline):
+        """Test that signature() logs the error and returns None."""
+        assert offline.signature() is None
+
+    def test_reads_and_saves_do_not_raise(self, offline, monkeypatch):
+        """Test that search, snapshot and save paths survive the outage."""
+        monkeypatch.setattr(storage, "LIBRARY_SNAPSHOT", True)
+        assert search("дракон") == []
+        assert storage.build_snapshot() == -1
+        assert load_stories() == []
+        save_story(_story(2))
+        assert not storage._search_index(None).is_synced(None)
+
+
+def _long_body(seed, edit=False):
+    words = [f"word{(seed * 7919 + i * 31) % 500}" for i in range(200)]
+    if edit:
+        words[100] = "dragon"
+    return " ".join(words)
+
+
+class TestNearDuplicates:
+    """Near-duplicate detection at save time under every DUPLICATE_POLICY."""
+
+    @pytest.fixture
+    def original(self, backend):
+        save_story(_story(1, body=_long_body(1)))
+        return get_story("s001")
+
+    def test_warn_saves_and_reports(self, original, monkeypatch):
+        """Test that "warn" keeps both stories and returns the match."""
+        monkeypatch.setattr(storage, "DUPLICATE_POLICY", "warn")
+        duplicate = save_story(_story(2, body=_long_body(1, edit=True)))
+        assert duplicate["id"] == "s001"
+        assert duplicate["distance"] <= storage.DUPLICATE_MAX_DISTANCE
+        assert [s["id"] for s in load_stories()] == ["s002", "s001"]
+
+    def test_skip_does_not_save(self, original, monkeypatch):
+        """Test that "skip" leaves the library unchanged."""
+        monkeypatch.setattr(storage, "DUPLICATE_POLICY", "skip")
+        assert save_story(_story(2, body=_long_body(1)))["id"] == "s001"
+        assert [s["id"] for s in load_stories()] == ["s001"]
+
+    def test_merge_replaces_existing(self, original, monkeypatch):
+        """Test that "merge" stores the new version under the existing ID."""
+        monkeypatch.setattr(storage, "DUPLICATE_POLICY", "merge")
+        story = _story(2, title="Newer", body=_long_body(1, edit=True))
+        assert save_story(story)["id"] == "s001"
+        assert story["id"] == "s001"
+        assert [(s["id"], s["title"]) for s in load_stories()] == [("s001", "Newer")]
+
+    def test_distinct_and_same_story_are_not_duplicates(self, original):
+        """Test that unrelated bodies and re-saves of the same story pass."""
+        assert save_story(_story(2, body=_long_body(2))) is None
+        assert save_story({**original, "title": "Renamed"}) is None
+        assert len(load_stories()) == 2
+
+    def test_allow_skips_lookup(self, original, monkeypatch):
+        """Test that "allow" does not look for duplicates at all."""
+        monkeypatch.setattr(storage, "DUPLICATE_POLICY", "allow")
+        assert save_story(_story(2, body=_long_body(1))) is None
+
+    def test_unknown_policy_raises(self, original, monkeypatch):
+        """Test that a misconfigured policy fails loudly."""
+        monkeypatch.setattr(storage, "DUPLICATE_POLICY", "ignore")
+        with pytest.raises(ValueError):
+            save_story(_story(2, body=_long_body(1)))
+
+    def test_deleted_story_is_forgotten(self, original):
+        """Test that a deleted story no longer counts as a duplicate."""
+        delete_story("s001")
+        assert save_story(_story(2, body=_long_body(1))) is None
+
+    def test_pending_writes_are_checked(self, backend, monkeypatch):
+        """Test that stories still queued by write-behind are detected too."""
+        monkeypatch.setattr(storage, "WRITE_BEHIND", True)
+        monkeypatch.setattr(storage, "WRITE_BEHIND_WINDOW", 60)
+        queue = storage._WriteBehind()
+        monkeypatch.setattr(storage, "_write_behind", queue)
+        try:
+            save_story(_story(1, body=_long_body(1)))
+            assert save_story(_story(2, body=_long_body(1, edit=True)))["id"] == "s001"
+        finally:
+            queue.flush()
+
+
+class TestWriteBehind:
+    """Write-behind mode: queued saves, read-your-writes and coalesced persists."""
+
+    @pytest.fixture
+    def queue(self, backend, monkeypatch):
+        """Enable write-behind with a window long enough to observe the queue."""
+        monkeypatch.setattr(storage, "WRITE_BEHIND", True)
+        monkeypatch.setattr(storage, "WRITE_BEHIND_WINDOW", 60)
+        queue = storage._WriteBehind()
+        monkeypatch.setattr(storage, "_write_behind", queue)
+        yield queue
+        # Persist leftovers while still inside the test's temp directory
+        queue.flush()
+
+    def _persisted_ids(self):
+        engine = storage._get_engine()
+        return [s["id"] for s in engine.load_all()] if engine else []
+
+    def test_save_is_deferred_but_visible(self, queue):
+        """Test that a queued save is not persisted yet but every read sees it."""
+        save_story(_story(1))
+        assert self._persisted_ids() == []
+        assert get_story("s001")["title"] == "Story 1"
+        assert [s["id"] for s in load_stories()] == ["s001"]
+        assert [s["id"] for s in list_story_summaries()] == ["s001"]
+        assert [s["id"] for s in list_stories(10)[0]] == ["s001"]
+
+        storage.flush_writes()
+        assert self._persisted_ids() == ["s001"]
+        assert get_story("s001")["title"] == "Story 1"
+
+    def test_writes_are_coalesced(self, queue, monkeypatch):
+        """Test that many saves of the window reach the engine as one batch."""
+        batches = []
+        real_persist = storage._persist_batch
+        monkeypatch.setattr(storage, "_persist_batch", lambda ns, ops: batches.append(dict(ops)) or real_persist(ns, ops))
+        for i in range(5):
+            save_story(_story(i))
+        save_story(_story(0, title="Final"))
+        delete_story("s004")
+
+        storage.flush_writes()
+        assert len(batches) == 1
+        assert len(batches[0]) == 5
+        assert [(s["id"], s["title"]) for s in load_stories()][-1] == ("s000", "Final")
+        assert self._persisted_ids() == ["s003", "s002", "s001", "s000"]
+
+    def test_pending_delete_hides_story(self, queue):
+        """Test that a queued delete hides a persisted story immediately."""
+        storage.WRITE_BEHIND = False
+        save_story(_story(1))
+        storage.WRITE_BEHIND = True
+        delete_story("s001")
+        assert get_story("s001") is None
+        assert load_stories() == []
+        assert self._persisted_ids() == ["s001"]
+        storage.flush_writes()
+        assert self._persisted_ids() == []
+
+    def test_pages_merge_pending_writes(self, queue):
+        """Test that cursor pages stay exact with queued inserts and deletes."""
+        storage.WRITE_BEHIND = False
+        for i in range(0, 20, 2):
+            save_story(_story(i))
+        storage.WRITE_BEHIND = True
+        for i in range(1, 20, 2):
+            save_story(_story(i))
+        delete_story("s010")
+
+        ids, cursor = [], None
+        while True:
+            page, cursor = list_stories(4, cursor)
+            ids += [s["id"] for s in page]
+            if cursor is None:
+                break
+        assert ids == [f"s{i:03d}" for i in reversed(range(20)) if i != 10]
+
+    def test_failed_flush_is_retried(self, queue, monkeypatch):
+        """Test that a failing persist keeps writes queued and readable."""
+        real_persist = storage._persist_batch
+        monkeypatch.setattr(storage, "_persist_batch", lambda ns, ops: (_ for _ in ()).throw(OSError("disk full")))
+        save_story(_story(1))
+        storage.flush_writes()
+        assert get_story("s001") is not None
+        assert self._persisted_ids() == []
+
+        monkeypatch.setattr(storage, "_persist_batch", real_persist)
+        storage.flush_writes()
+        assert self._persisted_ids() == ["s001"]
+
+    def test_background_writer_flushes(self, queue, monkeypatch):
+        """Test that the writer thread persists the queue after the window."""
+        monkeypatch.setattr(storage, "WRITE_BEHIND_WINDOW", 0.01)
+        save_story(_story(1))
+        deadline = time.time() + 5
+        while self._persisted_ids() != ["s001"] and time.time() < deadline:
+            time.sleep(0.01)
+        assert self._persisted_ids() == ["s001"]
+
+    def test_search_sees_pending_writes(self, queue):
+        """Test that search waits for queued writes to reach the index."""
+        save_story(_story(1, body="Жил-был дракон"))
+        assert [s["id"] for s in search("дракон")] == ["s001"]
+
+
+class TestThroughput:
+    """Coarse throughput floor shared by all backends (catches accidental O(n^2) paths)."""
+
+    STORIES = 200
+
+    def test_save_and_read_throughput(self, backend):
+        """Test that bulk saves and reads stay well above a conservative floor."""
+        start = time.perf_counter()
+        for i in range(self.STORIES):
+            save_story(_story(i))
+        save_rate = self.STORIES / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(self.STORIES):
+            get_story(f"s{i:03d}")
+        read_rate = self.STORIES / (time.perf_counter() - start)
+
+        assert save_rate > 20, f"{backend}: {save_rate:.0f} saves/s"
+        assert read_rate > 200, f"{backend}: {read_rate:.0f} reads/s"
+
+
+class TestQuotas:
+    """Plan quotas, eviction order and the background reaper."""
+
+    @pytest.fixture
+    def quotas(self, backend, monkeypatch):
+        """Tiny plans so a handful of stories exceeds them."""
+        monkeypatch.setattr(storage, "PLAN_QUOTAS", {
+            "free": {"stories": 3, "bytes": None},
+            "tiny": {"stories": None, "bytes": 600},
+        })
+        monkeypatch.setattr(storage, "_usage", {})
+        reaper = storage._QuotaReaper()
+        monkeypatch.setattr(storage, "_quota_reaper", reaper)
+        monkeypatch.setattr(reaper, "mark", lambda namespace: reaper._dirty.add(namespace))
+        for i in range(1, 6):
+            save_story(_story(i))
+        return reaper
+
+    def _ids(self):
+        return sorted(s["id"] for s in load_stories())
+
+    def test_library_without_plan_is_unlimited(self, quotas):
+        """Test that nothing is evicted or scheduled until a plan is assigned."""
+        assert storage.enforce_quota() == {"evicted": 0, "over": 0}
+        assert quotas._dirty == set()
+        assert len(self._ids()) == 5
+
+    def test_oldest_first(self, quotas):
+        """Test that the oldest stories go first when the count is exceeded."""
+        storage.set_library_plan("free")
+        assert storage.enforce_quota() == {"evicted": 2, "over": 0}
+        assert self._ids() == ["s003", "s004", "s005"]
+        assert search("Body") and all(r["id"] >= "s003" for r in search("Body"))
+
+    def test_byte_quota(self, quotas):
+        """Test that the byte allowance is enforced as well."""
+        storage.set_library_plan("tiny")
+        storage.enforce_quota()
+        usage = storage.library_usage()
+        assert usage["bytes"] <= 600 < usage["bytes"] + 200
+        assert usage["plan"] == "tiny" and usage["max_bytes"] == 600
+
+    def test_lru_keeps_recently_opened(self, quotas, monkeypatch):
+        """Test that "lru" evicts stories that were not opened recently."""
+        monkeypatch.setattr(storage, "QUOTA_EVICTION", "lru")
+        get_story("s001")
+        get_story("s002")
+        storage.set_library_plan("free")
+        storage.enforce_quota()
+        assert self._ids() == ["s001", "s002", "s005"]
+
+    def test_limit_is_incremental(self, quotas):
+        """Test that a bounded pass reports remaining work."""
+        storage.set_library_plan("free")
+        assert storage.enforce_quota(limit=1) == {"evicted": 1, "over": 1}
+        assert storage.enforce_quota(limit=1) == {"evicted": 1, "over": 0}
+
+    def test_save_over_quota_is_rejected(self, quotas):
+        """Test that a save past the quota is refused and nothing is deleted or scheduled."""
+        storage.set_library_plan("free")
+        with pytest.raises(storage.QuotaExceededError) as info:
+            save_story(_story(6))
+        assert info.value.plan == "free" and info.value.max_stories == 3
+        # Updating a saved story without growing it is still allowed
+        save_story(_story(5, title="Story 5"))
+        assert len(self._ids()) == 5
+        assert quotas._dirty == set()
+
+    def test_save_within_quota(self, quotas):
+        """Test that saves below the quota go through and bytes are checked too."""
+        storage.set_library_plan("tiny")
+        for story_id in self._ids():
+            delete_story(story_id)
+        save_story(_story(1))
+        with pytest.raises(storage.QuotaExceededError):
+            save_story(_story(2, body="x" * 1000))
+        assert self._ids() == ["s001"]
+
+    def test_quota_check_does_not_scan_library(self, quotas, monkeypatch):
+        """Test that after the first check saves and deletes only update the counters."""
+        storage.set_library_plan("free")
+        for story_id in ("s001", "s002", "s003"):
+            delete_story(story_id)
+        save_story(_story(6))
+        engine_type = type(storage._get_engine())
+        load_all = engine_type.load_all
+        monkeypatch.setattr(engine_type, "load_all", lambda self: pytest.fail("full library scan"))
+        save_story(_story(6, title="Renamed"))
+        delete_story("s006")
+        save_story(_story(7))
+        with pytest.raises(storage.QuotaExceededError):
+            save_story(_story(8))
+        assert storage.library_usage()["stories"] == 3
+        monkeypatch.setattr(engine_type, "load_all", load_all)
+        assert self._ids() == ["s004", "s005", "s007"]
+
+    def test_quota_counters_follow_outside_writes(self, quotas):
+        """Test that a write that bypasses the API is picked up through the signature."""
+        storage.set_library_plan("free")
+        for story_id in ("s001", "s002", "s003"):
+            delete_story(story_id)
+        save_story(_story(6))
+        storage._get_engine().delete("s006")
+        save_story(_story(7))
+        assert self._ids() == ["s004", "s005", "s007"]
+
+    def test_quota_counts_queued_writes(self, quotas, monkeypatch):
+        """Test that with WRITE_BEHIND queued saves count before they are flushed."""
+        monkeypatch.setattr(storage, "WRITE_BEHIND", True)
+        monkeypatch.setattr(storage, "WRITE_BEHIND_WINDOW", 60)
+        storage.set_library_plan("free")
+        try:
+            for story_id in ("s001", "s002", "s003"):
+                delete_story(story_id)
+            save_story(_story(6))
+            with pytest.raises(storage.QuotaExceededError):
+                save_story(_story(7))
+        finally:
+            storage.flush_writes()
+        assert self._ids() == ["s004", "s005", "s006"]
+
+    def test_reaper_processes_marked_libraries(self, quotas, monkeypatch):
+        """Test that with auto-eviction saves mark the library and the reaper works in batches."""
+        monkeypatch.setattr(storage, "QUOTA_AUTO_EVICT", True)
+        monkeypatch.setattr(storage, "QUOTA_REAP_BATCH", 1)
+        storage.set_library_plan("free")
+        save_story(_story(6))
+        assert quotas._dirty == {None}
+        assert quotas.run_once() == {None: 1}
+        assert quotas._dirty == {None}
+        quotas.run_once()
+        quotas.run_once()
+        assert self._ids() == ["s004", "s005", "s006"]
+        assert quotas._dirty == set()
+
+    def test_access_log_is_folded(self, quotas, monkeypatch):
+        """Test that the append-only access log is merged and removed by a pass."""
+        import os
+        from config import STORIES_ACCESS_LOG_FILE
+        monkeypatch.setattr(storage, "LIBRARY_COLD_TIER", True)
+        get_story("s005")
+        assert os.path.exists(STORIES_ACCESS_LOG_FILE)
+        storage.set_library_plan("free")
+        storage.enforce_quota()
+        assert not os.path.exists(STORIES_ACCESS_LOG_FILE)
+        assert "s005" in storage._cold_store(None).access_times()
+
+    def test_plan_validation_and_missing_library(self, backend, tmp_path):
+        """Test that unknown plans fail and absent libraries are not created."""
+        with pytest.raises(ValueError):
+            storage.set_library_plan("platinum")
+        storage.set_library_plan("free", namespace="guest:nobody")
+        assert storage.library_plan("guest:nobody") is None
+
+
+class TestQuery:
+    """Filtered library views served by the secondary indexes."""
+
+    @pytest.fixture
+    def library(self, backend):
+        params = [("Маша", "fairytale", "ru"), ("маша", "adventure", "ru"), ("Max", "fairytale", "en"), (None, None, "ru")]
+        for i, (child, genre, lang) in enumerate(params, start=1):
+            save_story(_story(i, child=child, genre=genre, lang=lang, age_group=5))
+        return backend
+
+    def test_filters_are_combined_and_case_insensitive(self, library):
+        """Test that every filter must match and names ignore case."""
+        assert [s["id"] for s in storage.query(child="МАША")[0]] == ["s002", "s001"]
+        assert [s["id"] for s in storage.query(child="маша", genre="fairytale")[0]] == ["s001"]
+        assert [s["id"] for s in storage.query(lang="ru", age_group=5.0)[0]] == ["s004", "s002", "s001"]
+        assert storage.query(genre="lullaby") == ([], None)
+
+    def test_pagination(self, library):
+        """Test keyset pages over a filtered view."""
+        page, cursor = storage.query(limit=2, lang="ru")
+        assert [s["id"] for s in page] == ["s004", "s002"]
+        assert page[0] == {"id": "s004", "title": "Story 4", "created_at": "2026-01-01T00:00:04"}
+        page, cursor = storage.query(limit=2, after_cursor=cursor, lang="ru")
+        assert [s["id"] for s in page] == ["s001"] and cursor is None
+
+    def test_updates_and_deletes_are_reflected(self, library):
+        """Test that the indexes follow saves and deletes."""
+        save_story(_story(3, child="Маша", genre="fairytale", lang="en"))
+        delete_story("s001")
+        assert [s["id"] for s in storage.query(child="маша", genre="fairytale")[0]] == ["s003"]
+
+    def test_does_not_scan_library(self, library, monkeypatch):
+        """Test that a synced index answers without loading stories."""
+        storage.query(child="маша")
+        engine_type = type(storage._get_engine())
+        monkeypatch.setattr(engine_type, "load_all", lambda self: pytest.fail("library scanned"))
+        monkeypatch.setattr(engine_type, "list_summaries", lambda self: pytest.fail("library scanned"))
+        assert len(storage.query(genre="fairytale")[0]) == 2
+
+    def test_facets(self, library):
+        """Test the distinct values offered by library filters."""
+        assert storage.library_facets("child") == {"max": 1, "маша": 2}
+        assert storage.library_facets("genre") == {"adventure": 1, "fairytale": 2}
+
+    def test_unknown_field(self, library):
+        """Test that only indexed fields can be filtered on."""
+        with pytest.raises(ValueError):
+            storage.query(title="Story 1")
+        with pytest.raises(ValueError):
+            storage.library_facets("body")
+
+
+class TestLibrarySnapshot:
+    """Reads served from the mmap snapshot when LIBRARY_SNAPSHOT is on."""
+
+    @pytest.fixture
+    def snapshots(self, backend, monkeypatch):
+        monkeypatch.setattr(storage, "LIBRARY_SNAPSHOT", True)
+        monkeypatch.setattr(storage, "_snapshots", {})
+        for i in range(1, 4):
+            save_story(_story(i))
+        storage.build_snapshot()
+        return backend
+
+    def test_reads_match_engine(self, snapshots):
+        """Test that snapshot reads equal the engine's own answers."""
+        assert storage.build_snapshot() == 3
+        assert [s["id"] for s in load_stories()] == ["s003", "s002", "s001"]
+        assert get_story("s002")["body"] == "Body 2"
+        assert get_story("s999") is None
+
+    def test_get_does_not_touch_engine(self, snapshots, monkeypatch):
+        """Test that a fresh snapshot answers get_story by itself."""
+        engine_type = type(storage._get_engine())
+        monkeypatch.setattr(engine_type, "get", lambda self, story_id: pytest.fail("engine read"))
+        monkeypatch.setattr(engine_type, "load_all", lambda self: pytest.fail("engine read"))
+        assert get_story("s001")["title"] == "Story 1"
+        assert len(load_stories()) == 3
+
+    def test_stale_snapshot_is_ignored(self, snapshots, monkeypatch):
+        """Test that writes are visible even when they did not rebuild the snapshot."""
+        monkeypatch.setattr(storage, "_write_library_snapshot", lambda *args: None)
+        save_story(_story(2, title="Renamed"))
+        delete_story("s003")
+        assert get_story("s002")["title"] == "Renamed"
+        assert get_story("s003") is None
+        assert [s["id"] for s in load_stories()] == ["s002", "s001"]
+
+    def test_json_writes_rebuild_snapshot(self, snapshots, monkeypatch):
+        """Test that the json engine keeps its snapshot fresh on every write."""
+        if snapshots != "json":
+            pytest.skip("only the json engine rewrites the whole library on save")
+        save_story(_story(4))
+        assert storage._fresh_snapshot(None, storage._get_engine()).get("s004")["title"] == "Story 4"
+
+    def test_journal_compaction_rebuilds_snapshot(self, snapshots):
+        """Test that compacting the journal leaves a fresh snapshot behind."""
+        if snapshots != "journal":
+            pytest.skip("journal-only behaviour")
+        save_story(_story(4))
+        assert storage._fresh_snapshot(None, storage._get_engine()) is None
+        storage.compact_journal()
+        assert storage._fresh_snapshot(None, storage._get_engine()).get("s004") is not None
+
+    def test_build_reads_under_write_lock(self, snapshots, monkeypatch):
+        """Test that build_snapshot reads and writes the library while holding the write lock."""
+        events = []
+        write_lock = storage._write_lock
+
+        @contextmanager
+        def recording_lock(engine):
+            with write_lock(engine):
+                events.append("lock")
+                yield
+                events.append("unlock")
+
+        engine_type = type(storage._get_engine())
+        load_all = engine_type.load_all
+        monkeypatch.setattr(storage, "_write_lock", recording_lock)
+        monkeypatch.setattr(engine_type, "load_all", lambda self: events.append("read") or load_all(self))
+        assert storage.build_snapshot() == 3
+        assert events == ["lock", "read", "unlock"]
+
+    def test_failed_write_leaves_no_temp_files(self, snapshots, monkeypatch, tmp_path):
+        """Test that a failed snapshot write cleans up its temporary file."""
+        def fail(src, dst):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(storage.os, "replace", fail)
+        with pytest.raises(OSError):
+            storage.build_snapshot()
+        assert not list(tmp_path.rglob("*.tmp"))
+
+
+class TestChangeFeed:
+    """Process-local read caches invalidated by the shared version counter."""
+
+    @pytest.fixture
+    def feed(self, backend, monkeypatch):
+        monkeypatch.setattr(storage, "LIBRARY_CHANGE_FEED", True)
+        monkeypatch.setattr(storage, "_views", {})
+        for i in range(1, 4):
+            save_story(_story(i, genre="fairytale"))
+        return backend
+
+    def test_writes_bump_version(self, feed):
+        """Test that every write through the API moves the version forward."""
+        first = storage.library_version()
+        assert first > 0
+        save_story(_story(4))
+        second = storage.library_version()
+        delete_story("s004")
+        assert first < second < storage.library_version()
+
+    def test_repeated_reads_are_cached(self, feed, monkeypatch):
+        """Test that unchanged libraries are not re-read on every rerun."""
+        storage.list_stories(2)
+        storage.library_facets("genre")
+        storage.search("Body")
+        engine_type = type(storage._get_engine())
+        monkeypatch.setattr(engine_type, "list_page", lambda self, limit, after: pytest.fail("engine read"))
+        monkeypatch.setattr(engine_type, "signature", lambda self: pytest.fail("engine read"))
+        monkeypatch.setattr(storage.SearchIndex, "facets", lambda self, field: pytest.fail("index read"))
+        assert [s["id"] for s in storage.list_stories(2)[0]] == ["s003", "s002"]
+        assert storage.library_facets("genre") == {"fairytale": 3}
+        assert len(storage.search("Body")) == 3
+
+    def test_cached_answers_are_copies(self, feed):
+        """Test that callers cannot corrupt the cache by editing the answer."""
+        storage.list_stories(2)[0][0]["title"] = "Edited"
+        assert storage.list_stories(2)[0][0]["title"] == "Story 3"
+
+    def test_change_from_another_process_is_seen(self, feed):
+        """Test that a bumped version invalidates this process's cached views."""
+        assert len(storage.list_stories(10)[0]) == 3
+        # Другой процесс пишет мимо кэшей этого процесса и повышает версию
+        engine = storage._get_engine()
+        engine.upsert(_story(4))
+        assert len(storage.list_stories(10)[0]) == 3
+        storage.mark_library_changed()
+        assert [s["id"] for s in storage.list_stories(10)[0]] == ["s004", "s003", "s002", "s001"]
+        assert storage.library_facets("genre") == {"fairytale": 3}
+
+    def test_cache_is_bounded(self, feed, monkeypatch):
+        """Test that the per-process cache keeps at most LIBRARY_VIEW_CACHE_SIZE answers."""
+        monkeypatch.setattr(storage, "LIBRARY_VIEW_CACHE_SIZE", 2)
+        for word in ("Body", "Story", "1", "2"):
+            storage.search(word)
+        assert len(storage._views) == 2
+
+    def test_disabled_feed_writes_no_counter(self, backend):
+        """Test that the counter file only exists when the feed is enabled."""
+        save_story(_story(1))
+        assert storage.library_version() == 0
+        assert storage.mark_library_changed() == 0
@@ -0,0 +1,86 @@
+"""
+Tests for story module.
+"""
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from story import Story
+
+RECORD = {
+    "id": "s1",
+    "title": "Сказка про ёжика",
+    "body": "Жил-был ёжик.",
+    "created_at": "2026-01-02T10:00:00",
+    "lang": "ru",
+    "audio_key": None,
+    "child": "Маша",
+    "gender": "girl",
+    "age_group": 5,
+    "genre": "fairytale",
+    "hobbies": None,
+    "voice": None,
+    "model": None,
+    "schema_version": 3,
+}
+
+
+class TestStory:
+    """Tests for the slotted Story record."""
+
+    def test_roundtrip_is_lossless(self):
+        """Test that a library record survives from_dict/to_dict unchanged."""
+        assert Story.from_dict(RECORD).to_dict() == RECORD
+
+    def test_missing_and_unknown_fields(self):
+        """Test that absent fields stay absent and unknown fields are kept."""
+        legacy = {"id": "old", "title": "Old", "body": "", "tier": "cold", "rating": 5}
+        story = Story.from_dict(legacy)
+        assert story.lang is None and story.tier == "cold"
+        assert story.extra == {"rating": 5}
+        assert story.to_dict() == legacy
+
+    def test_audio_is_not_serialised(self):
+        """Test that the session audio stream never reaches the record."""
+        story = Story.from_dict({**RECORD, "audio": BytesIO(b"mp3")})
+        assert story.audio.getvalue() == b"mp3"
+        assert "audio" not in story.to_dict()
+
+    def test_new_story_omits_unset_fields(self):
+        """Test that a freshly built story only serialises the fields it has."""
+        story = Story(title="T", body="B", lang="en")
+        story.id = "s2"
+        assert story.to_dict() == {"title": "T", "body": "B", "id": "s2", "lang": "en"}
+
+    def test_summary_and_sort_key(self):
+        """Test the list metadata helpers."""
+        story = Story.from_dict(RECORD)
+        assert story.summary() == {"id": "s1", "title": RECORD["title"], "created_at": RECORD["created_at"]}
+        assert story.sort_key() == (RECORD["created_at"], "s1")
+        assert Story().sort_key() == ("", "")
+
+    def test_is_compact(self):
+        """Test that stories carry no per-instance __dict__."""
+        assert not hasattr(Story.from_dict(RECORD), "__dict__")
+
+    @pytest.mark.parametrize("changes", [
+        {"title": None},
+        {"body": 42},
+        {"created_at": "yesterday"},
+        {"gender": "dragon"},
+        {"age_group": "5"},
+        {"age_group": True},
+        {"child": ["Маша"]},
+    ])
+    def test_validate_rejects_bad_fields(self, changes):
+        """Test that validation reports wrongly typed fields."""
+        with pytest.raises(ValueError):
+            Story.from_dict({**RECORD, **changes}).validate()
+
+    def test_validate_accepts_record(self):
+        """Test that a well-formed record passes validation."""
+        Story.from_dict(RECORD).validate()
+        Story(title="T", body="B", age_group=2.5).validate()
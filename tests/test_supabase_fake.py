@@ -0,0 +1,99 @@
+"""
+Tests for the in-process Supabase REST stand-in.
+"""
+import pytest
+import requests
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from supabase_fake import FakeSupabase
+
+URL = "http://supabase.test/rest/v1/stories"
+
+
+@pytest.fixture
+def fake():
+    fake = FakeSupabase()
+    rows = [
+        {"namespace": "n", "id": "a", "created_at": "2026-01-01", "title": "A", "data": {"id": "a"}},
+        {"namespace": "n", "id": "b", "created_at": "2026-01-01", "title": "B", "data": {"id": "b"}},
+        {"namespace": "n", "id": "c", "created_at": "2026-01-02", "title": "C", "data": {"id": "c"}},
+        {"namespace": "other", "id": "d", "created_at": "2026-01-03", "title": "D", "data": {"id": "d"}},
+    ]
+    fake.request("POST", URL, json=rows)
+    return fake
+
+
+def _ids(response):
+    return [row["id"] for row in response.json()]
+
+
+class TestSelect:
+    """Tests for GET requests."""
+
+    def test_filter_order_limit(self, fake):
+        """Test eq filters, multi-column ordering and limit/offset."""
+        params = [("namespace", "eq.n"), ("select", "id"), ("order", "created_at.desc,id.desc")]
+        assert _ids(fake.request("GET", URL, params=params)) == ["c", "b", "a"]
+        assert _ids(fake.request("GET", URL, params=params + [("limit", "1"), ("offset", "1")])) == ["b"]
+
+    def test_or_with_nested_and(self, fake):
+        """Test the keyset filter used for cursor pagination, with quoted values."""
+        params = [
+            ("namespace", "eq.n"), ("select", "id"), ("order", "created_at.desc,id.desc"),
+            ("or", '(created_at.lt."2026-01-01",and(created_at.eq."2026-01-01",id.lt."b"))'),
+        ]
+        assert _ids(fake.request("GET", URL, params=params)) == ["a"]
+
+    def test_select_columns_and_count(self, fake):
+        """Test column selection and the Content-Range count header."""
+        response = fake.request("GET", URL, params=[("namespace", "eq.n"), ("select", "title"), ("limit", "2")],
+                                headers={"Prefer": "count=exact"})
+        assert response.json() == [{"title": "A"}, {"title": "B"}]
+        assert response.headers["Content-Range"] == "0-1/3"
+
+    def test_bad_filter_is_400(self, fake):
+        """Test that an unsupported operator is rejected like PostgREST does."""
+        response = fake.request("GET", URL, params=[("id", "like.a*")])
+        with pytest.raises(requests.HTTPError):
+            response.raise_for_status()
+
+
+class TestWrites:
+    """Tests for POST and DELETE requests."""
+
+    def test_insert_conflict_and_upsert(self, fake):
+        """Test that plain inserts conflict and merge-duplicates upserts."""
+        row = {"namespace": "n", "id": "a", "created_at": "2026-01-01", "title": "New", "data": {}}
+        assert fake.request("POST", URL, json=[row]).status_code == 409
+        response = fake.request("POST", URL, params=[("on_conflict", "namespace,id")], json=[row],
+                                headers={"Prefer": "resolution=merge-duplicates"})
+        assert response.status_code == 201
+        assert {r["id"]: r["title"] for r in fake.rows()}["a"] == "New"
+
+    def test_delete_respects_filters(self, fake):
+        """Test that DELETE only removes matching rows."""
+        fake.request("DELETE", URL, params=[("namespace", "eq.n"), ("id", "eq.a")])
+        assert sorted(r["id"] for r in fake.rows()) == ["b", "c", "d"]
+
+    def test_counts_requests(self, fake):
+        """Test that every request is counted for benchmarks."""
+        before = fake.request_count
+        fake.request("GET", URL)
+        assert fake.request_count == before + 1
+
+    def test_delete_in_list(self, fake):
+        """Test DELETE with an in-list filter of quoted values."""
+        fake.request("DELETE", URL, params=[("namespace", "eq.n"), ("id", 'in.("a","c")')])
+        assert sorted(r["id"] for r in fake.rows()) == ["b", "d"]
+
+    def test_server_sets_version(self, fake):
+        """Test that every insert or update gets a new, numerically ordered server version."""
+        row = {"namespace": "n", "id": "a", "created_at": "2026-01-01", "title": "New", "data": {}, "version": -1}
+        before = max(r["version"] for r in fake.rows())
+        for _ in range(10):
+            fake.request("POST", URL, params=[("on_conflict", "namespace,id")], json=[row],
+                         headers={"Prefer": "resolution=merge-duplicates"})
+        params = [("select", "id,version"), ("order", "version.desc"), ("limit", "1")]
+        assert fake.request("GET", URL, params=params).json() == [{"id": "a", "version": before + 10}]